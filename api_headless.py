@@ -0,0 +1,292 @@
+"""
+API HTTP headless do MaxMarketing Total.
+
+Expõe as ferramentas de 'ferramentas_marketing' (post, email, campanha, plano de mídia,
+anúncios) para integrações (CRM, e-commerce) sem passar pelo Streamlit. Usa o mesmo
+núcleo da MaxMarketingApp: prompts, cliente do LLM, Firebase e briefing da empresa.
+
+Uso:
+    uvicorn api_headless:app --host 0.0.0.0 --port 8080     # servidor
+    MMT_LLM_BACKEND=falso python api_headless.py bench        # benchmark com o LLM falso
+
+Autenticação: 'Authorization: Bearer <ID token do Firebase>' (o mesmo token do login
+no app). O briefing da empresa do usuário é incluído automaticamente no prompt.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+
+import dna_marca
+import ferramentas
+import telemetria
+from resiliencia import LLMIndisponivel
+from servico_llm import invocar_llm_async, transmitir_llm_async
+
+# --- INÍCIO DA CONFIGURAÇÃO DA API ---
+# "desligada" só para benchmarks locais com o LLM falso
+AUTENTICACAO = os.environ.get("MMT_API_AUTENTICACAO", "firebase")
+MAX_ITENS_LOTE = int(os.environ.get("MMT_API_MAX_ITENS_LOTE", "20"))
+CONCORRENCIA_LOTE = int(os.environ.get("MMT_API_CONCORRENCIA_LOTE", "5"))
+# --- FIM DA CONFIGURAÇÃO DA API ---
+
+
+class _Servicos:
+    """Conexões compartilhadas pela API, criadas uma única vez no startup."""
+
+    def __init__(self):
+        secrets = ferramentas.carregar_secrets()
+        self.prompts = ferramentas.ler_prompts()
+        self.llm = ferramentas.criar_llm(secrets.get("GOOGLE_API_KEY"))
+        self.cache_prefixo = dna_marca.criar_cache_prefixo(secrets.get("GOOGLE_API_KEY"))
+        self.db = None
+        if AUTENTICACAO != "desligada":
+            self.db = ferramentas.inicializar_firebase_admin(secrets["gcp_service_account"])
+
+    async def dados_empresa(self, user_uid):
+        """Briefing da empresa (com o DNA compilado), já em cache curto no ferramentas."""
+        if not user_uid or self.db is None:
+            return {}
+        return await asyncio.to_thread(ferramentas.buscar_dados_empresa, self.db, user_uid)
+
+
+_servicos = None
+
+
+def _iniciar_servicos():
+    global _servicos
+    _servicos = _Servicos()
+
+
+@asynccontextmanager
+async def _ciclo_de_vida(app):
+    _iniciar_servicos()
+    yield
+
+
+app = FastAPI(title="MaxMarketing Total - API Headless", version="1.0", lifespan=_ciclo_de_vida)
+
+
+def servicos():
+    return _servicos
+
+
+# Modelo, reserva e último resultado bom esgotados, ou o prazo do LLM estourou: é uma
+# indisponibilidade temporária (503), não um erro do servidor (500)
+MENSAGEM_LLM_LENTO = "O Max demorou demais para responder agora. Tente novamente em instantes."
+
+
+@app.exception_handler(LLMIndisponivel)
+async def _llm_indisponivel(request, erro):
+    return JSONResponse(status_code=503, content={"detail": str(erro)})
+
+
+@app.exception_handler(TimeoutError)
+async def _llm_sem_resposta(request, erro):
+    return JSONResponse(status_code=503, content={"detail": MENSAGEM_LLM_LENTO})
+
+
+# ==============================================================================
+# AUTENTICAÇÃO E MODELOS DE ENTRADA
+# ==============================================================================
+
+async def usuario_autenticado(authorization: str = Header(default="")):
+    """Valida o ID token do Firebase e devolve o UID do usuário."""
+    if AUTENTICACAO == "desligada":
+        return None
+    if not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Envie 'Authorization: Bearer <ID token do Firebase>'.")
+    from firebase_admin import auth
+    try:
+        with telemetria.span("firebase.auth"):
+            token = await asyncio.to_thread(auth.verify_id_token, authorization[len("Bearer "):])
+    except Exception as e:
+        raise HTTPException(status_code=401, detail=f"Token inválido ou expirado: {e}")
+    return token["uid"]
+
+
+class PedidoGeracao(BaseModel):
+    campos: dict = Field(default_factory=dict, description="Valores do prompt_template da ferramenta")
+    usar_briefing: bool = Field(default=True, description="Inclui o briefing da empresa do usuário no prompt")
+
+
+class ItemLote(PedidoGeracao):
+    ferramenta: str
+
+
+class PedidoLote(BaseModel):
+    itens: list[ItemLote]
+
+
+async def _preparar_chamada(ferramenta, pedido, user_uid):
+    """Devolve (llm, prompt): com o cache de prefixo ativo, o DNA da marca não vai no prompt."""
+    dados_empresa = await servicos().dados_empresa(user_uid) if pedido.usar_briefing else {}
+    try:
+        return ferramentas.preparar_chamada(
+            servicos().llm, servicos().prompts, ferramenta, pedido.campos, dados_empresa, servicos().cache_prefixo
+        )
+    except ferramentas.FerramentaDesconhecida:
+        raise HTTPException(status_code=404, detail=f"Ferramenta '{ferramenta}' não encontrada.")
+
+
+# ==============================================================================
+# ENDPOINTS
+# ==============================================================================
+
+@app.get("/health", response_class=PlainTextResponse)
+async def health():
+    return "ok"
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return telemetria.exportar_prometheus()
+
+
+@app.get("/v1/ferramentas")
+async def listar_ferramentas():
+    return {
+        nome: {"nome": config["nome_ferramenta"], "descricao": config["descricao_curta"]}
+        for nome, config in servicos().prompts["ferramentas_marketing"].items()
+    }
+
+
+@app.post("/v1/ferramentas/{ferramenta}")
+async def gerar(ferramenta: str, pedido: PedidoGeracao, user_uid=Depends(usuario_autenticado)):
+    llm, prompt = await _preparar_chamada(ferramenta, pedido, user_uid)
+    with telemetria.span("api.requisicao", rota="gerar", ferramenta=ferramenta):
+        texto = await invocar_llm_async(llm, prompt, ferramenta)
+    return {"ferramenta": ferramenta, "texto": texto}
+
+
+@app.post("/v1/ferramentas/{ferramenta}/stream")
+async def gerar_stream(ferramenta: str, pedido: PedidoGeracao, user_uid=Depends(usuario_autenticado)):
+    llm, prompt = await _preparar_chamada(ferramenta, pedido, user_uid)
+    # Espera o primeiro pedaço antes de responder: se o LLM estiver indisponível, o cliente
+    # recebe um 503 em vez de um 200 com o corpo cortado. Depois disso o status já foi enviado.
+    pedacos = transmitir_llm_async(llm, prompt, ferramenta)
+    try:
+        primeiro = await pedacos.__anext__()
+    except StopAsyncIteration:
+        primeiro = ""
+    except (LLMIndisponivel, TimeoutError):
+        raise
+    except Exception as e:
+        # Stream não tem reserva nem último resultado bom: a falha do modelo vira o mesmo 503
+        print(f"Alerta: O stream de '{ferramenta}' falhou antes do primeiro pedaço. Erro: {e}")
+        raise LLMIndisponivel(
+            "O Max está com instabilidade para gerar conteúdo agora. Tente novamente em instantes."
+        ) from e
+
+    async def _continuar():
+        if primeiro:
+            yield primeiro
+        async for pedaco in pedacos:
+            yield pedaco
+
+    return StreamingResponse(_continuar(), media_type="text/plain; charset=utf-8")
+
+
+@app.post("/v1/lote")
+async def gerar_lote(pedido: PedidoLote, user_uid=Depends(usuario_autenticado)):
+    """Gera vários itens em paralelo (limitado por CONCORRENCIA_LOTE); um erro não derruba os outros."""
+    if len(pedido.itens) > MAX_ITENS_LOTE:
+        raise HTTPException(status_code=413, detail=f"Máximo de {MAX_ITENS_LOTE} itens por lote.")
+    semaforo = asyncio.Semaphore(CONCORRENCIA_LOTE)
+
+    async def _gerar_item(item):
+        async with semaforo:
+            try:
+                llm, prompt = await _preparar_chamada(item.ferramenta, item, user_uid)
+                texto = await invocar_llm_async(llm, prompt, item.ferramenta)
+                return {"ferramenta": item.ferramenta, "texto": texto}
+            except HTTPException as e:
+                return {"ferramenta": item.ferramenta, "erro": e.detail}
+            except LLMIndisponivel as e:
+                return {"ferramenta": item.ferramenta, "erro": str(e)}
+            except TimeoutError:
+                return {"ferramenta": item.ferramenta, "erro": MENSAGEM_LLM_LENTO}
+            except Exception as e:
+                return {"ferramenta": item.ferramenta, "erro": str(e)}
+
+    with telemetria.span("api.requisicao", rota="lote"):
+        resultados = await asyncio.gather(*(_gerar_item(item) for item in pedido.itens))
+    return {"resultados": resultados}
+
+
+# ==============================================================================
+# BENCHMARK (REQUISIÇÕES POR SEGUNDO CONTRA O LLM FALSO)
+# ==============================================================================
+
+async def _benchmark(total, concorrencia, identicas=False):
+    import httpx
+
+    _iniciar_servicos()
+
+    def _corpo(i):
+        # Prompts distintos medem chamadas reais; idênticos mostram a coalescência
+        campos = {"objetivo": "Gerar vendas", "produto_servico": "Sapato Verona"}
+        if not identicas:
+            campos["mensagem_chave"] = f"Variação {i}"
+        return {"campos": campos, "usar_briefing": False}
+
+    semaforo = asyncio.Semaphore(concorrencia)
+    latencias, erros = [], 0
+
+    transporte = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://bench") as cliente:
+        async def _uma(i):
+            nonlocal erros
+            async with semaforo:
+                inicio = time.perf_counter()
+                resposta = await cliente.post("/v1/ferramentas/criar_post_social", json=_corpo(i))
+                latencias.append(time.perf_counter() - inicio)
+                if resposta.status_code != 200:
+                    erros += 1
+
+        inicio_total = time.perf_counter()
+        await asyncio.gather(*(_uma(i) for i in range(total)))
+        duracao = time.perf_counter() - inicio_total
+
+    latencias.sort()
+    print(f"Requisições: {total} | Concorrência: {concorrencia} | Erros: {erros}")
+    print(f"Vazão: {total / duracao:.1f} req/s")
+    print(f"Latência p50: {latencias[len(latencias) // 2] * 1000:.1f} ms | "
+          f"p95: {latencias[int(len(latencias) * 0.95) - 1] * 1000:.1f} ms")
+    coalescidas = sum(
+        c["valor"] for c in telemetria.exportar_json()["contadores"] if c["nome"] == "mmt_llm_coalescidas_total"
+    )
+    print(f"Chamadas coalescidas: {coalescidas:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API headless do MaxMarketing Total")
+    sub = parser.add_subparsers(dest="comando")
+    bench = sub.add_parser("bench", help="Mede requisições/segundo usando o LLM falso")
+    bench.add_argument("--requisicoes", type=int, default=2000)
+    bench.add_argument("--concorrencia", type=int, default=100)
+    bench.add_argument("--identicas", action="store_true", help="Envia o mesmo prompt em todas as requisições")
+    servir = sub.add_parser("servir", help="Sobe o servidor HTTP")
+    servir.add_argument("--porta", type=int, default=8080)
+    args = parser.parse_args()
+
+    if args.comando == "bench":
+        if ferramentas.LLM_BACKEND != "falso" or AUTENTICACAO != "desligada":
+            print("Rode o benchmark com MMT_LLM_BACKEND=falso e MMT_API_AUTENTICACAO=desligada.")
+            return 1
+        asyncio.run(_benchmark(args.requisicoes, args.concorrencia, args.identicas))
+        return 0
+
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=getattr(args, "porta", 8080))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,17 +8,24 @@ import pyrebase
 import base64
 import time
 import datetime
-import firebase_admin
+import functools
 import pandas as pd
 from PIL import Image
 from docx import Document
 from fpdf import FPDF
-from langchain_google_genai import ChatGoogleGenerativeAI
-from firebase_admin import credentials, firestore as firebase_admin_firestore
 import plotly.graph_objects as go
 
 # Importa as funções que centralizamos no nosso arquivo de utilidades
-from utils import get_asset_path, carregar_prompts_config
+from utils import get_asset_path, get_static_url, carregar_prompts_config
+from memoria_sessao import obter_do_estado, aplicar_orcamento_de_memoria, marcar_alterado
+import telemetria
+import estado_externo
+import ferramentas
+import dna_marca
+import pre_geracao
+from refinamento import SessaoRefinamento
+from ativacao import resgatar_chave, ErroAtivacao
+from firebase_admin import auth as firebase_admin_auth
 
 # --- CONFIGURAÇÃO DA PÁGINA (STREAMLIT) ---
 try:
@@ -51,6 +58,10 @@ APP_KEY_SUFFIX = "mmt_app_v1.0" # MMT = MaxMarketing Total
 USER_COLLECTION = "users" # Nome da coleção para os usuários no Firestore
 COMPANY_COLLECTION = "companies" # Nome da coleção para os dados das empresas dos usuários
 SALES_PAGE_URL = "https://sua-pagina-de-vendas.com.br" # IMPORTANTE: Substituir pela URL real de vendas
+LOGO_FILE = "max_marketing_total_logo.png"
+BACKGROUND_FILE = "fundo_pagina_entrada.jpg" # Baixado e otimizado pelo pipeline_assets.py
+# Usada apenas se o pipeline de assets não tiver rodado (ex: ambiente de desenvolvimento)
+BACKGROUND_FALLBACK_URL = "https://images.pexels.com/photos/3184418/pexels-photo-3184418.jpeg?auto=compress&cs=tinysrgb&w=1260&h=750&dpr=1"
 
 # --- Configuração de Ambiente ---
 # Evita avisos de paralelismo de algumas bibliotecas de IA.
@@ -99,6 +110,48 @@ def convert_image_to_base64(image_name):
         st.error(f"Erro ao converter a imagem '{image_name}': {e}")
         return None
 
+def exibir_logo(largura):
+    """
+    Exibe a logo pela URL da variante estática (o navegador guarda em cache),
+    em vez de enviar os bytes da imagem a cada rerun.
+    """
+    logo_url = get_static_url(LOGO_FILE, largura)
+    if logo_url:
+        st.markdown(f'<img src="{logo_url}" width="{largura}" alt="{APP_NAME}">', unsafe_allow_html=True)
+    else:
+        st.image(get_asset_path(LOGO_FILE), width=largura)
+
+def fragmento(nome):
+    """
+    Transforma um trecho de página em um st.fragment: os widgets dele reexecutam só esse
+    trecho, sem repetir a autenticação, a leitura do perfil no Firestore e a sidebar do main().
+    Como o main() não roda nesses reruns, o próprio fragmento grava o estado que mudou.
+    """
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def executar(*args, **kwargs):
+            with telemetria.interacao("fragmento", fragmento=nome) as rerun_isolado:
+                try:
+                    return funcao(*args, **kwargs)
+                finally:
+                    if rerun_isolado:
+                        salvar_estado_da_sessao()
+        return st.fragment(executar)
+    return decorador
+
+def salvar_estado_da_sessao():
+    """Grava o que mudou no backend de estado e avisa o usuário do que não coube lá."""
+    try:
+        recusadas = estado_externo.persistir_estado(state_backend)
+    except Exception as e:
+        print(f"Alerta: Não foi possível salvar o estado da sessão. Erro: {e}")
+        return
+    if recusadas:
+        st.toast(
+            "Parte do seu trabalho ficou grande demais para ser salva e pode se perder se a "
+            "página for recarregada. Considere usar fotos menores no catálogo.", icon="⚠️"
+        )
+
 st.success("Funções auxiliares carregadas com sucesso!")
 # ==============================================================================
 # 4. INICIALIZAÇÃO DE SERVIÇOS E AUTENTICAÇÃO
@@ -120,12 +173,8 @@ def initialize_firebase_services():
         pb_auth_client = firebase_client.auth()
 
         # Inicializa o Firebase Admin SDK para operações de backend (acesso ao Firestore)
-        # A verificação "if not firebase_admin._apps" impede a reinicialização do app.
-        if not firebase_admin._apps:
-            cred = credentials.Certificate(service_account_creds)
-            firebase_admin.initialize_app(cred)
-        
-        firestore_db_client = firebase_admin_firestore.client()
+        # (a mesma inicialização usada pela API headless, centralizada em ferramentas.py)
+        firestore_db_client = ferramentas.inicializar_firebase_admin(service_account_creds)
         
         return pb_auth_client, firestore_db_client
 
@@ -138,13 +187,30 @@ def initialize_firebase_services():
 # Inicializa os serviços e os armazena em variáveis globais
 pb_auth_client, firestore_db = initialize_firebase_services()
 
+@st.cache_resource
+def get_state_backend():
+    """
+    Retorna o backend onde o estado das sessões é guardado fora do processo
+    (memória, Redis ou Firestore, conforme MMT_BACKEND_ESTADO), para que qualquer
+    instância do Cloud Run possa atender qualquer sessão.
+    """
+    try:
+        return estado_externo.criar_backend(firestore_db)
+    except Exception as e:
+        st.error(f"Erro crítico ao conectar ao backend de estado: {e}")
+        st.stop()
+        return None
+
+state_backend = get_state_backend()
+
 @st.cache_resource
 def get_llm():
     """Inicializa e retorna o cliente do modelo de linguagem (Gemini)."""
     try:
         api_key = st.secrets["GOOGLE_API_KEY"]
         # Configura o LLM com a chave e uma temperatura para respostas criativas
-        return ChatGoogleGenerativeAI(model="gemini-1.5-pro-latest", google_api_key=api_key, temperature=0.75)
+        # (MMT_LLM_BACKEND=falso troca o Gemini por um LLM simulado, para testes)
+        return ferramentas.criar_llm(api_key)
     except Exception as e:
         st.error(f"Erro crítico ao inicializar a IA do Google: {e}")
         st.info("Verifique se a GOOGLE_API_KEY está correta no seu arquivo secrets.toml.")
@@ -154,6 +220,28 @@ def get_llm():
 # Inicializa o LLM
 llm = get_llm()
 
+@st.cache_resource
+def get_prefix_cache():
+    """
+    Retorna o cache de prefixo do prompt (context caching do Gemini em produção),
+    onde fica o DNA da marca compilado no salvamento do briefing.
+    """
+    return dna_marca.criar_cache_prefixo(st.secrets.get("GOOGLE_API_KEY"))
+
+@st.cache_resource
+def iniciar_telemetria():
+    """
+    Sobe o endpoint de métricas (Prometheus) uma única vez por processo, quando o app roda
+    com 'streamlit run'. Pelo servidor.py as métricas já saem na porta do app.
+    """
+    try:
+        return telemetria.iniciar_servidor_metricas()
+    except OSError as e:
+        print(f"Alerta: Não foi possível iniciar o endpoint de métricas. Erro: {e}")
+        return None
+
+iniciar_telemetria()
+
 def get_current_user_status():
     """
     Verifica se existe uma sessão de usuário válida e atualiza o estado do aplicativo.
@@ -167,7 +255,8 @@ def get_current_user_status():
         try:
             # Tenta usar o token da sessão para obter informações da conta.
             # Isso valida se o token ainda é válido.
-            user_info = pb_auth_client.get_account_info(st.session_state.user_session['idToken'])
+            with telemetria.span("firebase.auth"):
+                user_info = pb_auth_client.get_account_info(st.session_state.user_session['idToken'])
             
             # Se for bem-sucedido, extrai os dados do usuário
             uid = user_info['users'][0]['localId']
@@ -181,9 +270,11 @@ def get_current_user_status():
             })
             return True, uid, email
             
-        except Exception:
-            # Se o token for inválido/expirado, limpa a sessão e desloga o usuário.
-            st.session_state.clear()
+        except Exception as e:
+            # Token inválido/expirado (ou falha momentânea da rede): desloga o usuário nesta aba,
+            # mas mantém o trabalho salvo, que volta quando ele fizer login de novo.
+            print(f"Alerta: Não foi possível validar a sessão do usuário. Erro: {e}")
+            estado_externo.esquecer_usuario()
             return False, None, None
             
     return False, None, None
@@ -193,10 +284,11 @@ st.success("Serviços de autenticação e IA carregados com sucesso!")
 # 5. CLASSE PRINCIPAL DA APLICAÇÃO
 # ==============================================================================
 class MaxMarketingApp:
-    def __init__(self, llm_instance, db_firestore_instance):
+    def __init__(self, llm_instance, db_firestore_instance, prefix_cache=None):
         """Inicializa a aplicação com as conexões para a IA e o Banco de Dados."""
         self.llm = llm_instance
         self.db = db_firestore_instance
+        self.prefix_cache = prefix_cache
 
     # --- MÉTODO DE ONBOARDING E BRIEFING ESTRATÉGICO ---
     def exibir_briefing_estrategico(self):
@@ -236,13 +328,29 @@ class MaxMarketingApp:
                     try:
                         user_uid = st.session_state.get('user_uid')
                         if user_uid:
+                            # Compila o briefing uma única vez no DNA da marca (prefixo compacto do prompt),
+                            # que é guardado junto com a empresa e reaproveitado por todas as ferramentas
+                            prompts = carregar_prompts_config() or {}
+                            st.session_state.briefing_data['dna_marca'] = dna_marca.compilar_dna_marca(
+                                st.session_state.briefing_data, ferramentas.system_prompt(prompts), self.llm
+                            )
+
                             # Cria ou atualiza um documento com o ID da empresa do usuário
                             company_ref = self.db.collection(COMPANY_COLLECTION).document(user_uid)
-                            company_ref.set(st.session_state.briefing_data, merge=True) # merge=True permite atualizar sem apagar dados antigos
+                            with telemetria.span("firestore.escrita", colecao=COMPANY_COLLECTION):
+                                company_ref.set(st.session_state.briefing_data, merge=True) # merge=True permite atualizar sem apagar dados antigos
+                            ferramentas.invalidar_dados_empresa(user_uid)
+
+                            # Começa a gerar o kit inicial em segundo plano, para a primeira
+                            # ferramenta aberta já ter conteúdo pronto
+                            pre_geracao.agendar_pacote_inicial(
+                                self.llm, prompts, self.db, user_uid, st.session_state.briefing_data, self.prefix_cache
+                            )
                             
                             # Marca no perfil do usuário que o briefing foi concluído
                             user_ref = self.db.collection(USER_COLLECTION).document(user_uid)
-                            user_ref.update({"briefing_completed": True})
+                            with telemetria.span("firestore.escrita", colecao=USER_COLLECTION):
+                                user_ref.update({"briefing_completed": True})
 
                             st.success("Briefing salvo! Estamos prontos para decolar.")
                             time.sleep(2)
@@ -254,6 +362,19 @@ class MaxMarketingApp:
                     except Exception as e:
                         st.error(f"Ocorreu um erro ao salvar o briefing: {e}")
 
+    def _pacote_inicial(self):
+        """Kit inicial pré-gerado depois do briefing ({} se ainda não houver nada pronto)."""
+        user_uid = st.session_state.get('user_uid')
+        return pre_geracao.obter_pacote(ferramentas.buscar_dados_empresa(self.db, user_uid), user_uid)
+
+    def _usar_do_pacote_inicial(self, parte):
+        """Marca uma parte do kit como usada nesta sessão; devolve False se já tinha sido usada."""
+        usadas = st.session_state.get('pacote_inicial_aplicado', [])
+        if parte in usadas:
+            return False
+        st.session_state['pacote_inicial_aplicado'] = usadas + [parte]
+        return True
+
     # --- PLACEHOLDERS PARA AS FUNCIONALIDADES ---
     
     # ==============================================================================
@@ -318,62 +439,81 @@ class MaxMarketingApp:
             with st.spinner("Aguarde... Max está combinando sua estratégia com criatividade para gerar o post ideal! 🚀"):
                 try:
                     # Passo 1: Buscar o briefing geral da empresa que salvamos no Firestore
-                    # (Vamos criar essa função de busca depois, por enquanto é um placeholder)
-                    # company_data = buscar_dados_empresa_do_firestore(self.db, st.session_state.get('user_uid'))
-                    
+                    company_data = ferramentas.buscar_dados_empresa(self.db, st.session_state.get('user_uid'))
+
                     # Passo 2: Montar o prompt final para a IA
                     # (Aqui combinamos o briefing da empresa com o briefing específico deste post)
-                    # prompt_final = montar_prompt_para_post(
-                    #     prompts, company_data, canal_selecionado, tipo_post, 
-                    #     objetivo_post, produto_servico_foco, mensagem_central, cta_especifica
-                    # )
-                    
-                    # Passo 3: Chamar a IA para gerar o conteúdo
-                    # (Usamos o 'llm' que inicializamos na Parte 4)
-                    # resultado_ia = self.llm.invoke(prompt_final)
-                    
-                    # --- SIMULAÇÃO DO RESULTADO (para fins de desenvolvimento visual) ---
-                    st.session_state['post_gerado'] = """
-**Título Impactante:** 👞 Seu Pai Merece o Melhor. E o Melhor Está com 50% OFF!
-
-**Texto do Post:**
-O presente perfeito para o Dia dos Pais está aqui na Sapataria do Zé! 🎁
-
-Toda a nossa linha de sapatos de couro artesanais, incluindo o nosso campeão de vendas Verona, está com um desconto incrível de 50%. Qualidade, conforto e durabilidade que seu pai vai sentir a cada passo.
-
-Não deixe para a última hora! A promoção é válida somente até sábado.
-
-**Sugestão de Imagem/Vídeo:**
-Um vídeo curto e elegante mostrando os detalhes do sapato de couro Verona, com foco na costura e no acabamento. O vídeo termina com o sapato sendo colocado em uma bela caixa de presente.
-
-**Chamada para Ação (CTA):**
-Visite nossa loja na Rua X e garanta o presente do seu paizão!
+                    campos_post = {
+                        'objetivo': objetivo_post,
+                        'publico': company_data.get('cliente_ideal'),
+                        'produto_servico': produto_servico_foco,
+                        'mensagem_chave': mensagem_central,
+                        'usp': company_data.get('diferencial'),
+                        'tom_estilo': company_data.get('personalidade'),
+                        'info_adicional': f"Canal: {canal_selecionado} {tipo_post}".strip() + f" | CTA: {cta_especifica}",
+                    }
 
-**Hashtags Estratégicas:**
-#diadospais #presenteparaopai #sapatomasculino #sapatodecouro #juizdefora #promocao #modamasculina
-                    """
-                    # --- FIM DA SIMULAÇÃO ---
+                    # Passo 3: Chamar a IA para gerar o conteúdo
+                    # (O mesmo núcleo de geração usado pela API headless)
+                    st.session_state['post_gerado'] = ferramentas.gerar_conteudo(
+                        self.llm, prompts, 'criar_post_social', campos_post, company_data, self.prefix_cache
+                    )
+                    # Cada post gerado começa uma nova conversa de refinamento
+                    st.session_state['refinamento_post'] = SessaoRefinamento('criar_post_social', st.session_state['post_gerado'])
 
                 except Exception as e:
                     st.error(f"Ocorreu um erro ao gerar o conteúdo: {e}")
 
+        # No primeiro acesso depois do briefing, o post já vem pronto do kit inicial pré-gerado
+        pacote = self._pacote_inicial()
+        if pacote.get('posts') and obter_do_estado('post_gerado') is None and self._usar_do_pacote_inicial('post'):
+            st.session_state['post_gerado'] = pacote['posts'][0]
+            st.session_state['refinamento_post'] = SessaoRefinamento('criar_post_social', pacote['posts'][0])
+            st.info("💡 O Max já preparou este post a partir do seu briefing. Peça ajustes ou gere um novo acima.")
+        elif pacote.get('status') == 'gerando' and obter_do_estado('post_gerado') is None:
+            st.caption("⏳ O Max está preparando o seu kit inicial de conteúdos...")
+
         # Se um post foi gerado, exibe na tela
-        if 'post_gerado' in st.session_state and st.session_state.post_gerado:
+        post_gerado = obter_do_estado('post_gerado')
+        if post_gerado:
             st.divider()
             st.subheader("✅ Conteúdo Gerado pelo Max:")
-            st.markdown(st.session_state.post_gerado)
+            st.markdown(post_gerado)
 
             st.subheader("Refinamento e Ações")
             col1, col2 = st.columns(2)
             with col1:
                 st.button("Salvar no Histórico", type="primary")
             with col2:
-                st.download_button("Baixar como .txt", st.session_state.post_gerado, file_name="post_max_marketing.txt")
+                st.download_button("Baixar como .txt", post_gerado, file_name="post_max_marketing.txt")
             
             refinamento = st.text_input("Gostou? Peça um ajuste para o Max:", placeholder="Ex: 'Deixe o texto mais curto', 'Use mais emojis', 'Crie outra opção de título'")
+            sessao_refinamento = obter_do_estado('refinamento_post')
+            if sessao_refinamento and sessao_refinamento.rodadas:
+                st.caption(f"Ajustes feitos neste post: {sessao_refinamento.rodadas}")
             if st.button("Refinar Texto"):
-                # Aqui entraria a lógica para refinar o texto, enviando um novo prompt para a IA
-                st.info("Função de refinamento em desenvolvimento.")
+                if not refinamento:
+                    st.warning("Descreva o ajuste que você quer no post.")
+                else:
+                    with st.spinner("Max está ajustando o seu post..."):
+                        try:
+                            if not sessao_refinamento:
+                                sessao_refinamento = SessaoRefinamento('criar_post_social', post_gerado)
+                            # Só o rascunho atual e um resumo curto dos ajustes vão para a IA
+                            company_data = ferramentas.buscar_dados_empresa(self.db, st.session_state.get('user_uid'))
+                            st.session_state['post_gerado'] = sessao_refinamento.refinar(
+                                self.llm, carregar_prompts_config(), refinamento, company_data, self.prefix_cache
+                            )
+                            st.session_state['refinamento_post'] = sessao_refinamento
+                            st.rerun()
+                        except Exception as e:
+                            st.error(f"Ocorreu um erro ao refinar o conteúdo: {e}")
+
+        if len(pacote.get('posts', [])) > 1:
+            with st.expander("💡 Mais ideias do seu kit inicial"):
+                for ideia in pacote['posts'][1:]:
+                    st.markdown(ideia)
+                    st.divider()
 
     def exibir_criador_de_campanhas(self):
         """
@@ -383,6 +523,13 @@ Visite nossa loja na Rua X e garanta o presente do seu paizão!
         st.header("📣 Criador de Campanhas Completas")
         st.markdown("Defina a estratégia da sua campanha e deixe o Max criar todas as peças de comunicação para você de forma integrada.")
 
+        # E-mail de boas-vindas do kit inicial, pré-gerado depois do briefing
+        email_boas_vindas = self._pacote_inicial().get('email_boas_vindas')
+        if email_boas_vindas:
+            with st.expander("📧 Seu e-mail de boas-vindas (kit inicial)"):
+                st.markdown(email_boas_vindas)
+                st.download_button("Baixar como .txt", email_boas_vindas, file_name="email_boas_vindas.txt")
+
         # Define as opções de canais para a campanha
         canais_disponiveis = [
             'Instagram', 'Facebook', 'E-mail Marketing', 'Google Ads (Pesquisa)', 'WhatsApp'
@@ -469,13 +616,14 @@ Equipe MaxMarketing Total
                     # --- FIM DA SIMULAÇÃO ---
 
         # Se uma campanha foi gerada, exibe na tela
-        if 'campanha_gerada' in st.session_state:
+        campanha_gerada = obter_do_estado('campanha_gerada')
+        if campanha_gerada:
             st.divider()
-            st.subheader(f"✅ Pacote de Criativos para a Campanha: '{st.session_state['campanha_gerada']['nome']}'")
+            st.subheader(f"✅ Pacote de Criativos para a Campanha: '{campanha_gerada['nome']}'")
             
             # Usamos um expander para não poluir a tela, o usuário abre se quiser ver os detalhes
             with st.expander("Ver pacote de criativos gerados", expanded=True):
-                st.markdown(st.session_state['campanha_gerada']['pacote_criativos'])
+                st.markdown(campanha_gerada['pacote_criativos'])
 
             col1, col2 = st.columns(2)
             with col1:
@@ -483,8 +631,8 @@ Equipe MaxMarketing Total
             with col2:
                 st.download_button(
                     "Baixar como .txt", 
-                    st.session_state['campanha_gerada']['pacote_criativos'], 
-                    file_name=f"campanha_{st.session_state['campanha_gerada']['nome']}.txt"
+                    campanha_gerada['pacote_criativos'], 
+                    file_name=f"campanha_{campanha_gerada['nome']}.txt"
                 )
 
     def exibir_construtor_de_ofertas(self):
@@ -493,7 +641,8 @@ Equipe MaxMarketing Total
         st.markdown("---")
 
         # <<< MUDANÇA: Carrega o catálogo do Firestore ou inicializa um novo
-        if 'catalogo_ofertas' not in st.session_state:
+        # (também quando o catálogo se perdeu na camada de descarga e o backend de estado não tinha cópia)
+        if obter_do_estado('catalogo_ofertas', somente_leitura=True) is None:
             # st.session_state.catalogo_ofertas = self.carregar_catalogo_do_firestore()
             # SIMULAÇÃO: Enquanto a função de carregar não está pronta, inicializamos um vazio
             st.session_state.catalogo_ofertas = {
@@ -502,7 +651,19 @@ Equipe MaxMarketing Total
                 'ofertas': [], 'footer_text': f"© {datetime.date.today().year} Sua Empresa"
             }
         
-        state = st.session_state.catalogo_ofertas
+        # Painel e pré-visualização rodam como fragmentos: editar o catálogo não reexecuta o app inteiro
+        self._editor_de_catalogo()
+
+    @fragmento("catalogo_editor")
+    def _editor_de_catalogo(self):
+        """Painel de controle do catálogo, com a pré-visualização ao lado (que reflete cada edição)."""
+        # Lido sem marcar alteração: um rerun que não muda nada não serializa o catálogo (e as fotos) de novo
+        state = obter_do_estado('catalogo_ofertas', somente_leitura=True)
+
+        def atualizar(campo, valor):
+            if state.get(campo) != valor:
+                state[campo] = valor
+                marcar_alterado('catalogo_ofertas')
 
         # --- Layout de duas colunas ---
         col1, col2 = st.columns([1, 1.2])
@@ -512,16 +673,16 @@ Equipe MaxMarketing Total
             st.subheader("Painel de Controle 🎛️")
 
             with st.expander("1. Design do Catálogo", expanded=True):
-                state['theme_color'] = st.selectbox("Paleta de Cores", ["Roxo Inovação", "Azul Moderno", "Verde Crescimento", "Cinza Corporativo"])
-                state['theme_font'] = st.selectbox("Fonte", ["Montserrat", "Poppins", "Roboto", "Lato"])
+                atualizar('theme_color', st.selectbox("Paleta de Cores", ["Roxo Inovação", "Azul Moderno", "Verde Crescimento", "Cinza Corporativo"]))
+                atualizar('theme_font', st.selectbox("Fonte", ["Montserrat", "Poppins", "Roboto", "Lato"]))
                 uploaded_logo = st.file_uploader("Sua Logomarca (PNG, JPG)", type=['png', 'jpg'])
                 if uploaded_logo:
-                    state['logo_b64'] = base64.b64encode(uploaded_logo.getvalue()).decode()
+                    atualizar('logo_b64', base64.b64encode(uploaded_logo.getvalue()).decode())
 
             with st.expander("2. Títulos e Contato", expanded=True):
-                state['header_pitch'] = st.text_area("Título Principal do Catálogo", value=state['header_pitch'])
-                state['whatsapp'] = st.text_input("Nº WhatsApp para Contato (Opcional)", value=state['whatsapp'], placeholder="Ex: 5532912345678")
-                state['footer_text'] = st.text_input("Texto do Rodapé", value=state['footer_text'])
+                atualizar('header_pitch', st.text_area("Título Principal do Catálogo", value=state['header_pitch']))
+                atualizar('whatsapp', st.text_input("Nº WhatsApp para Contato (Opcional)", value=state['whatsapp'], placeholder="Ex: 5532912345678"))
+                atualizar('footer_text', st.text_input("Texto do Rodapé", value=state['footer_text']))
 
             with st.expander("3. Adicionar Ofertas (até 18)", expanded=True):
                 with st.form("offer_form", clear_on_submit=True):
@@ -535,6 +696,7 @@ Equipe MaxMarketing Total
                         if len(state['ofertas']) < 18:
                             photo_b64 = base64.b64encode(offer_photo.getvalue()).decode()
                             state['ofertas'].append({'name': offer_name, 'photo_b64': photo_b64, 'desc': offer_desc})
+                            marcar_alterado('catalogo_ofertas')
                             st.success(f"Oferta '{offer_name}' adicionada!")
                         else:
                             st.warning("Limite de 18 ofertas atingido.")
@@ -546,7 +708,8 @@ Equipe MaxMarketing Total
                         c1.write(f"_{offer['name']}_")
                         if c2.button("Remover", key=f"del_offer_{i}", use_container_width=True):
                             state['ofertas'].pop(i)
-                            st.rerun()
+                            marcar_alterado('catalogo_ofertas')
+                            st.rerun(scope="fragment")
 
             # <<< MUDANÇA: Botão para salvar o progresso no Firestore
             if st.button("💾 Salvar Catálogo", type="primary", use_container_width=True):
@@ -557,41 +720,49 @@ Equipe MaxMarketing Total
 
         # --- COLUNA 2: Pré-visualização e Download ---
         with col2:
-            st.subheader("Pré-visualização do Catálogo 📄")
-
-            color_map = {
-                'Roxo Inovação': {'primary': (124, 58, 237), 'secondary': (243, 232, 255), 'text': (88, 28, 135), 'bg': '#faf5ff'},
-                'Azul Moderno': {'primary': (37, 99, 235), 'secondary': (219, 234, 254), 'text': (30, 64, 175), 'bg': '#eff6ff'},
-                'Verde Crescimento': {'primary': (22, 163, 74), 'secondary': (220, 252, 231), 'text': (20, 83, 45), 'bg': '#f0fdf4'},
-                'Cinza Corporativo': {'primary': (71, 85, 105), 'secondary': (226, 232, 240), 'text': (30, 41, 59), 'bg': '#f8fafc'},
-            }
-            font_family = state['theme_font']
-            colors = color_map[state['theme_color']]
-
-            # Lógica para paginação na pré-visualização
-            total_ofertas = len(state['ofertas'])
-            page_size = 6
-            total_pages = (total_ofertas + page_size - 1) // page_size if total_ofertas > 0 else 1
-            
-            page_num = st.number_input('Ver Página', min_value=1, max_value=total_pages, value=1, step=1) if total_pages > 1 else 1
-            start_index = (page_num - 1) * page_size
-            end_index = start_index + page_size
-            ofertas_para_exibir = state['ofertas'][start_index:end_index]
-            
-            # Montando o HTML para o st.markdown
-            # ... (O código HTML e a classe PDF FPDF são praticamente os mesmos do MaxConstrutor,
-            #    apenas trocando 'product' por 'offer' e ajustando os campos conforme necessário)
-            # Para manter a resposta focada, omiti a repetição do HTML e da classe PDF,
-            # pois a estrutura é idêntica. Você pode copiar e colar do seu código original.
-
-            if st.download_button(
-                label="📥 Baixar Catálogo em PDF", data=b"simulacao_pdf", file_name="meu_catalogo_de_ofertas.pdf",
-                mime="application/pdf", use_container_width=True
-            ):
-                # A lógica real de geração de PDF seria chamada aqui
-                pass
-
-   def exibir_estrategista_de_midia(self):
+            self._pre_visualizacao_do_catalogo()
+
+    @fragmento("catalogo_previa")
+    def _pre_visualizacao_do_catalogo(self):
+        """Pré-visualização e download; trocar de página reexecuta só este trecho."""
+        # Lido do estado (e não recebido como argumento) para nunca exibir um catálogo antigo;
+        # a pré-visualização nunca altera o catálogo
+        state = obter_do_estado('catalogo_ofertas', somente_leitura=True)
+        st.subheader("Pré-visualização do Catálogo 📄")
+
+        color_map = {
+            'Roxo Inovação': {'primary': (124, 58, 237), 'secondary': (243, 232, 255), 'text': (88, 28, 135), 'bg': '#faf5ff'},
+            'Azul Moderno': {'primary': (37, 99, 235), 'secondary': (219, 234, 254), 'text': (30, 64, 175), 'bg': '#eff6ff'},
+            'Verde Crescimento': {'primary': (22, 163, 74), 'secondary': (220, 252, 231), 'text': (20, 83, 45), 'bg': '#f0fdf4'},
+            'Cinza Corporativo': {'primary': (71, 85, 105), 'secondary': (226, 232, 240), 'text': (30, 41, 59), 'bg': '#f8fafc'},
+        }
+        font_family = state['theme_font']
+        colors = color_map[state['theme_color']]
+
+        # Lógica para paginação na pré-visualização
+        total_ofertas = len(state['ofertas'])
+        page_size = 6
+        total_pages = (total_ofertas + page_size - 1) // page_size if total_ofertas > 0 else 1
+        
+        page_num = st.number_input('Ver Página', min_value=1, max_value=total_pages, value=1, step=1) if total_pages > 1 else 1
+        start_index = (page_num - 1) * page_size
+        end_index = start_index + page_size
+        ofertas_para_exibir = state['ofertas'][start_index:end_index]
+        
+        # Montando o HTML para o st.markdown
+        # ... (O código HTML e a classe PDF FPDF são praticamente os mesmos do MaxConstrutor,
+        #    apenas trocando 'product' por 'offer' e ajustando os campos conforme necessário)
+        # Para manter a resposta focada, omiti a repetição do HTML e da classe PDF,
+        # pois a estrutura é idêntica. Você pode copiar e colar do seu código original.
+
+        if st.download_button(
+            label="📥 Baixar Catálogo em PDF", data=b"simulacao_pdf", file_name="meu_catalogo_de_ofertas.pdf",
+            mime="application/pdf", use_container_width=True
+        ):
+            # A lógica real de geração de PDF seria chamada aqui
+            pass
+
+    def exibir_estrategista_de_midia(self):
         """
         Página com um conjunto de ferramentas para análise e planejamento de mídia paga e orgânica,
         incluindo GEO (Generative Engine Optimization) e otimização de anúncios.
@@ -599,121 +770,149 @@ Equipe MaxMarketing Total
         st.header("📊 Estrategista de Mídia Digital")
         st.markdown("Analise sua presença online, planeje seus investimentos em anúncios e otimize seus criativos com o poder da IA.")
 
+        # Sem plano de mídia ainda, começa pelo plano base do kit inicial (orçamento e duração padrão)
+        plano_base = self._pacote_inicial().get('plano_midia')
+        if plano_base and obter_do_estado('media_plan_result') is None and self._usar_do_pacote_inicial('plano_midia'):
+            st.session_state['media_plan_result'] = plano_base
+
         # Criação das abas para organizar as ferramentas
         tab1, tab2, tab3 = st.tabs(["📈 Plano de Mídia", "🌐 Análise GEO", "✍️ Otimizador de Anúncios"])
 
+        # Cada aba é um fragmento: enviar o formulário de uma aba reexecuta só aquela aba
         # --- Aba 1: Plano de Mídia (Adaptado do seu Estrategista) ---
         with tab1:
-            st.subheader("Planejador de Orçamento e Canais")
-            st.write("Defina seu objetivo e orçamento para receber uma recomendação estratégica de investimento.")
-
-            with st.form("media_plan_form"):
-                objetivo = st.selectbox(
-                    "Qual o principal objetivo do seu investimento?",
-                    ["Aumentar as vendas online", "Levar mais clientes à loja física", "Gerar mais contatos (leads)", "Fortalecer a marca"]
-                )
-                orcamento = st.number_input("Qual o seu orçamento total de mídia (R$)?", min_value=100, value=500, step=100)
-                duracao = st.slider("A campanha durará quantos dias?", 7, 90, 15)
-                
-                submitted = st.form_submit_button("🧠 Montar Plano de Mídia")
-                if submitted:
-                    with st.spinner("Max está analisando os melhores canais para o seu objetivo e orçamento..."):
-                        # Lógica para chamar a IA e gerar um plano de mídia.
-                        # SIMULAÇÃO:
-                        st.session_state['media_plan_result'] = f"""
-                        #### 🎯 Plano de Ação para '{objetivo}'
-
-                        Com um orçamento de **R$ {orcamento:.2f}** para **{duracao} dias** (aprox. R$ {orcamento/duracao:.2f}/dia), esta é a minha recomendação estratégica:
-
-                        **1. Alocação de Orçamento:**
-                        * **60% (R$ {orcamento*0.6:.2f}) em Meta Ads (Instagram/Facebook):** Ideal para segmentação precisa do seu público local e para gerar desejo com criativos visuais. Foco em anúncios de tráfego e conversão.
-                        * **40% (R$ {orcamento*0.4:.2f}) em Google Ads (Rede de Pesquisa):** Essencial para capturar a demanda de pessoas que já estão procurando ativamente pelo seu produto/serviço.
-
-                        **2. Foco do Público-Alvo:**
-                        * **Meta Ads:** Criar um público de 'Interesses' baseado no seu briefing e um público de 'Remarketing' para re-impactar quem visitou seu site ou perfil.
-                        * **Google Ads:** Focar em palavras-chave de 'cauda longa' e com intenção de compra, como "melhor [seu produto] em [sua cidade]".
-
-                        **3. Próximo Passo Sugerido:**
-                        * Use o **Otimizador de Anúncios** (na próxima aba) para criar os textos e headlines para esta campanha.
-                        """
-            
-            if 'media_plan_result' in st.session_state:
-                st.markdown("---")
-                st.subheader("✅ Seu Plano de Mídia Estratégico:")
-                st.markdown(st.session_state['media_plan_result'], unsafe_allow_html=True)
-
+            self._aba_plano_de_midia()
 
         # --- Aba 2: Análise GEO (Nova funcionalidade) ---
         with tab2:
-            st.subheader("Analisador de Presença Local (GEO)")
-            st.write("Otimize seu conteúdo para ser encontrado por IAs e mecanismos de busca quando clientes locais procurarem por você.")
-
-            with st.form("geo_analysis_form"):
-                st.write("Vamos analisar e otimizar sua principal página de serviço.")
-                url_pagina = st.text_input("Cole a URL da sua principal página de produto/serviço:", placeholder="https://seusite.com.br/servico-principal")
-                
-                submitted_geo = st.form_submit_button("🔍 Analisar para GEO")
-                if submitted_geo and url_pagina:
-                    with st.spinner("Max está lendo sua página e identificando pontos de otimização para GEO..."):
-                        # Lógica para a IA analisar a URL
-                        # SIMULAÇÃO:
-                        st.session_state['geo_result'] = """
-                        #### ✅ Análise GEO da sua página:
-
-                        **Pontos Fortes:**
-                        * O título da página menciona seu serviço principal.
-                        * As imagens têm texto alternativo, o que ajuda na acessibilidade.
-
-                        **Oportunidades de Melhoria para IAs:**
-                        1.  **Crie uma seção de FAQ:** Responda diretamente às 5 perguntas mais comuns sobre seu serviço. IAs adoram o formato de Pergunta e Resposta. Sugestão de pergunta: "Qual o preço do [seu serviço]?"
-                        2.  **Adicione Dados Estruturados:** Inclua o endereço e o telefone da sua empresa de forma clara e explícita no rodapé da página.
-                        3.  **Use Tópicos Locais:** Adicione um parágrafo sobre a história da sua empresa na sua cidade ou como seu serviço atende especificamente à comunidade local.
-                        """
-
-            if 'geo_result' in st.session_state:
-                st.markdown("---")
-                st.subheader("💡 Recomendações de Otimização GEO:")
-                st.markdown(st.session_state['geo_result'])
+            self._aba_analise_geo()
 
         # --- Aba 3: Otimizador de Anúncios (Adaptado do seu Especialista Google) ---
         with tab3:
-            st.subheader("Criador e Otimizador de Anúncios para Google")
-            st.write("Crie rapidamente os textos para seus anúncios na Rede de Pesquisa do Google.")
+            self._aba_otimizador_de_anuncios()
+
+    @fragmento("midia_plano")
+    def _aba_plano_de_midia(self):
+        st.subheader("Planejador de Orçamento e Canais")
+        st.write("Defina seu objetivo e orçamento para receber uma recomendação estratégica de investimento.")
+
+        with st.form("media_plan_form"):
+            objetivo = st.selectbox(
+                "Qual o principal objetivo do seu investimento?",
+                ["Aumentar as vendas online", "Levar mais clientes à loja física", "Gerar mais contatos (leads)", "Fortalecer a marca"]
+            )
+            orcamento = st.number_input("Qual o seu orçamento total de mídia (R$)?", min_value=100, value=500, step=100)
+            duracao = st.slider("A campanha durará quantos dias?", 7, 90, 15)
+            
+            submitted = st.form_submit_button("🧠 Montar Plano de Mídia")
+            if submitted:
+                with st.spinner("Max está analisando os melhores canais para o seu objetivo e orçamento..."):
+                    # Lógica para chamar a IA e gerar um plano de mídia.
+                    # SIMULAÇÃO:
+                    st.session_state['media_plan_result'] = f"""
+                    #### 🎯 Plano de Ação para '{objetivo}'
+
+                    Com um orçamento de **R$ {orcamento:.2f}** para **{duracao} dias** (aprox. R$ {orcamento/duracao:.2f}/dia), esta é a minha recomendação estratégica:
+
+                    **1. Alocação de Orçamento:**
+                    * **60% (R$ {orcamento*0.6:.2f}) em Meta Ads (Instagram/Facebook):** Ideal para segmentação precisa do seu público local e para gerar desejo com criativos visuais. Foco em anúncios de tráfego e conversão.
+                    * **40% (R$ {orcamento*0.4:.2f}) em Google Ads (Rede de Pesquisa):** Essencial para capturar a demanda de pessoas que já estão procurando ativamente pelo seu produto/serviço.
+
+                    **2. Foco do Público-Alvo:**
+                    * **Meta Ads:** Criar um público de 'Interesses' baseado no seu briefing e um público de 'Remarketing' para re-impactar quem visitou seu site ou perfil.
+                    * **Google Ads:** Focar em palavras-chave de 'cauda longa' e com intenção de compra, como "melhor [seu produto] em [sua cidade]".
+
+                    **3. Próximo Passo Sugerido:**
+                    * Use o **Otimizador de Anúncios** (na próxima aba) para criar os textos e headlines para esta campanha.
+                    """
+        
+        plano_midia = obter_do_estado('media_plan_result')
+        if plano_midia:
+            st.markdown("---")
+            st.subheader("✅ Seu Plano de Mídia Estratégico:")
+            st.markdown(plano_midia, unsafe_allow_html=True)
+
+    @fragmento("midia_geo")
+    def _aba_analise_geo(self):
+        st.subheader("Analisador de Presença Local (GEO)")
+        st.write("Otimize seu conteúdo para ser encontrado por IAs e mecanismos de busca quando clientes locais procurarem por você.")
+
+        with st.form("geo_analysis_form"):
+            st.write("Vamos analisar e otimizar sua principal página de serviço.")
+            url_pagina = st.text_input("Cole a URL da sua principal página de produto/serviço:", placeholder="https://seusite.com.br/servico-principal")
+            
+            submitted_geo = st.form_submit_button("🔍 Analisar para GEO")
+            if submitted_geo and url_pagina:
+                with st.spinner("Max está lendo sua página e identificando pontos de otimização para GEO..."):
+                    # Lógica para a IA analisar a URL
+                    # SIMULAÇÃO:
+                    st.session_state['geo_result'] = """
+                    #### ✅ Análise GEO da sua página:
+
+                    **Pontos Fortes:**
+                    * O título da página menciona seu serviço principal.
+                    * As imagens têm texto alternativo, o que ajuda na acessibilidade.
+
+                    **Oportunidades de Melhoria para IAs:**
+                    1.  **Crie uma seção de FAQ:** Responda diretamente às 5 perguntas mais comuns sobre seu serviço. IAs adoram o formato de Pergunta e Resposta. Sugestão de pergunta: "Qual o preço do [seu serviço]?"
+                    2.  **Adicione Dados Estruturados:** Inclua o endereço e o telefone da sua empresa de forma clara e explícita no rodapé da página.
+                    3.  **Use Tópicos Locais:** Adicione um parágrafo sobre a história da sua empresa na sua cidade ou como seu serviço atende especificamente à comunidade local.
+                    """
+
+        resultado_geo = obter_do_estado('geo_result')
+        if resultado_geo:
+            st.markdown("---")
+            st.subheader("💡 Recomendações de Otimização GEO:")
+            st.markdown(resultado_geo)
+
+    @fragmento("midia_anuncios")
+    def _aba_otimizador_de_anuncios(self):
+        st.subheader("Criador e Otimizador de Anúncios para Google")
+        st.write("Crie rapidamente os textos para seus anúncios na Rede de Pesquisa do Google.")
+
+        with st.form("ads_creator_form"):
+            termo_busca = st.text_input("O que seu cliente ideal digitaria no Google para te achar?", placeholder="Ex: Sapataria artesanal em Juiz de Fora")
+            
+            submitted_ads = st.form_submit_button("✍️ Gerar Textos do Anúncio")
+            if submitted_ads and termo_busca:
+                with st.spinner("Max está criando headlines e descrições de alta conversão..."):
+                    # Lógica para chamar a IA e gerar os anúncios
+                    # SIMULAÇÃO:
+                    st.session_state['ads_result'] = f"""
+                    #### ✅ Textos para Anúncios de Pesquisa:
+
+                    **Sugestão de Palavras-Chave:**
+                    * `{termo_busca}`
+                    * `loja de sapatos artesanais juiz de fora`
+                    * `onde comprar sapato de couro em jf`
+
+                    ---
+                    **Opção de Anúncio 1 (Foco em Qualidade):**
+                    * **Título 1:** Sapatos Artesanais em Juiz de Fora
+                    * **Título 2:** Couro Legítimo e Durabilidade
+                    * **Título 3:** Qualidade em Cada Detalhe
+                    * **Descrição:** Conheça nossa coleção exclusiva de sapatos feitos à mão. Conforto e estilo que duram. Visite nossa loja no centro!
+
+                    **Opção de Anúncio 2 (Foco em Exclusividade):**
+                    * **Título 1:** {termo_busca.title()}
+                    * **Título 2:** Modelos Únicos e Exclusivos
+                    * **Título 3:** Atendimento Personalizado
+                    * **Descrição:** Cansado do mesmo? Encontre sapatos com personalidade e design autoral. Estoque limitado. Garanta já o seu par!
+                    """
+
+        resultado_ads = obter_do_estado('ads_result')
+        if resultado_ads:
+            st.markdown("---")
+            st.subheader("📝 Seus Anúncios para o Google:")
+            st.markdown(resultado_ads)
+@st.cache_resource
+def get_app_instance():
+    """
+    Retorna a instância única da MaxMarketingApp para todo o processo.
+    A classe não guarda estado do usuário, apenas as conexões com a IA e o Firestore.
+    """
+    return MaxMarketingApp(llm, firestore_db, get_prefix_cache())
 
-            with st.form("ads_creator_form"):
-                termo_busca = st.text_input("O que seu cliente ideal digitaria no Google para te achar?", placeholder="Ex: Sapataria artesanal em Juiz de Fora")
-                
-                submitted_ads = st.form_submit_button("✍️ Gerar Textos do Anúncio")
-                if submitted_ads and termo_busca:
-                    with st.spinner("Max está criando headlines e descrições de alta conversão..."):
-                        # Lógica para chamar a IA e gerar os anúncios
-                        # SIMULAÇÃO:
-                        st.session_state['ads_result'] = f"""
-                        #### ✅ Textos para Anúncios de Pesquisa:
-
-                        **Sugestão de Palavras-Chave:**
-                        * `{termo_busca}`
-                        * `loja de sapatos artesanais juiz de fora`
-                        * `onde comprar sapato de couro em jf`
-
-                        ---
-                        **Opção de Anúncio 1 (Foco em Qualidade):**
-                        * **Título 1:** Sapatos Artesanais em Juiz de Fora
-                        * **Título 2:** Couro Legítimo e Durabilidade
-                        * **Título 3:** Qualidade em Cada Detalhe
-                        * **Descrição:** Conheça nossa coleção exclusiva de sapatos feitos à mão. Conforto e estilo que duram. Visite nossa loja no centro!
-
-                        **Opção de Anúncio 2 (Foco em Exclusividade):**
-                        * **Título 1:** {termo_busca.title()}
-                        * **Título 2:** Modelos Únicos e Exclusivos
-                        * **Título 3:** Atendimento Personalizado
-                        * **Descrição:** Cansado do mesmo? Encontre sapatos com personalidade e design autoral. Estoque limitado. Garanta já o seu par!
-                        """
-
-            if 'ads_result' in st.session_state:
-                st.markdown("---")
-                st.subheader("📝 Seus Anúncios para o Google:")
-                st.markdown(st.session_state['ads_result'])
 # ==============================================================================
 # 7. INTERFACE DE LOGIN E REGISTRO
 # ==============================================================================
@@ -722,9 +921,8 @@ def exibir_pagina_de_entrada():
     """Renderiza a capa de abertura com 2 opções: Cliente ou Não Cliente."""
     # Tenta carregar e aplicar um estilo visual mais imersivo para a página inicial
     try:
-        logo_base64 = convert_image_to_base64('max_marketing_total_logo.png') # <<< MUDANÇA: Usando a nova logo
-        # Usaremos uma imagem de fundo genérica por enquanto
-        background_image_url = "https://images.pexels.com/photos/3184418/pexels-photo-3184418.jpeg?auto=compress&cs=tinysrgb&w=1260&h=750&dpr=1"
+        # O fundo é servido pelo próprio contêiner; a URL externa fica só como reserva
+        background_image_url = get_static_url(BACKGROUND_FILE, 1920) or BACKGROUND_FALLBACK_URL
         
         st.markdown(f"""
             <style>
@@ -733,8 +931,12 @@ def exibir_pagina_de_entrada():
             /* Outros estilos que você tinha, mantidos aqui */
             </style>""", unsafe_allow_html=True)
         
-        if logo_base64:
-            st.image(f"data:image/png;base64,{logo_base64}", width=200)
+        if get_static_url(LOGO_FILE, 200):
+            exibir_logo(200)
+        else:
+            logo_base64 = convert_image_to_base64(LOGO_FILE)
+            if logo_base64:
+                st.image(f"data:image/png;base64,{logo_base64}", width=200)
 
     except Exception as e:
         st.title(APP_NAME)
@@ -758,7 +960,7 @@ def exibir_login_e_registro():
     
     _ , col, _ = st.columns([1, 1.5, 1])
     with col:
-        st.image(get_asset_path('max_marketing_total_logo.png'), width=150)
+        exibir_logo(150)
         st.header(f"Acesse o {APP_NAME}")
 
         # --- Abas para Login e Ativação ---
@@ -798,14 +1000,17 @@ def exibir_login_e_registro():
                 if st.form_submit_button("Criar Conta e Ativar", use_container_width=True):
                     if reg_email and len(reg_password) >= 6 and activation_key:
                         with st.spinner("Verificando sua chave e criando sua conta..."):
-                            # LÓGICA DE ATIVAÇÃO (a ser implementada)
-                            # 1. Buscar a 'activation_key' no Firestore na coleção 'chaves_ativacao'.
-                            # 2. Verificar se a chave é válida e se o status é 'disponivel'.
-                            # 3. Se for válida, criar o usuário no Firebase Auth com 'reg_email' e 'reg_password'.
-                            # 4. Criar o documento do usuário na coleção 'users'.
-                            # 5. Atualizar a chave no Firestore para status 'usada' e vincular ao ID do novo usuário.
-                            # 6. Mostrar st.success e pedir para o usuário ir para a aba de Login.
-                            st.success("Conta criada! Volte para a aba 'Entrar' para fazer seu primeiro login.")
+                            # Passos 1 a 5 (buscar e validar a chave, criar o usuário no Auth, criar o
+                            # documento em 'users' e marcar a chave como usada) ficam em ativacao.py,
+                            # numa transação idempotente: um duplo clique não cria duas contas.
+                            try:
+                                resgatar_chave(firestore_db, firebase_admin_auth, reg_email, reg_password, activation_key)
+                                # 6. Mostrar st.success e pedir para o usuário ir para a aba de Login.
+                                st.success("Conta criada! Volte para a aba 'Entrar' para fazer seu primeiro login.")
+                            except ErroAtivacao as e:
+                                st.error(str(e))
+                            except Exception as e:
+                                st.error(f"Ocorreu um erro ao ativar sua conta: {e}")
                     else:
                         st.warning("Por favor, preencha todos os campos corretamente.")
 # ==============================================================================
@@ -825,24 +1030,29 @@ def main():
     # Verifica o status de autenticação do usuário na sessão atual
     user_is_authenticated, user_uid, user_email = get_current_user_status()
 
+    # Traz o estado da sessão guardado fora do processo (uma leitura em lote por rerun).
+    # Vem depois do login porque o trabalho do usuário só é liberado para o uid confirmado.
+    try:
+        estado_externo.carregar_estado(state_backend)
+    except Exception as e:
+        st.warning(f"Não foi possível recuperar sua sessão salva: {e}")
+
     if user_is_authenticated:
         # --- FLUXO DO USUÁRIO LOGADO ---
 
-        # Inicializa a nossa classe principal da aplicação
-        # (Isso garante que temos um 'agente' pronto para chamar os métodos de exibição)
-        if 'app_instance' not in st.session_state:
-            st.session_state.app_instance = MaxMarketingApp(llm, firestore_db)
-        app = st.session_state.app_instance
+        # Usa a instância da aplicação compartilhada pelo processo
+        # (Ela só guarda as conexões, então não precisa ser copiada em cada sessão)
+        app = get_app_instance()
 
         # --- Sidebar (Menu Lateral) ---
         with st.sidebar:
-            st.image(get_asset_path('max_marketing_total_logo.png'), width=150)
+            exibir_logo(150)
             st.title(APP_NAME)
             st.markdown("---")
             st.write(f"Logado como:")
             st.caption(user_email)
             if st.button("Logout", use_container_width=True):
-                st.session_state.clear()
+                estado_externo.limpar_sessao(state_backend)
                 st.rerun()
             
             # <<< MUDANÇA: Assinatura adicionada no final da sidebar
@@ -851,7 +1061,8 @@ def main():
 
         # --- LÓGICA DE EXIBIÇÃO PRINCIPAL ---
         try:
-            user_doc = firestore_db.collection(USER_COLLECTION).document(user_uid).get()
+            with telemetria.span("firestore.leitura", colecao=USER_COLLECTION):
+                user_doc = firestore_db.collection(USER_COLLECTION).document(user_uid).get()
             user_data = user_doc.to_dict() if user_doc.exists else {}
         except Exception as e:
             st.error(f"Erro ao buscar dados do seu perfil: {e}")
@@ -860,7 +1071,8 @@ def main():
         # <<< MUDANÇA: Novo fluxo baseado no preenchimento do briefing
         # Verificamos se o usuário já completou o briefing estratégico
         if not user_data.get("briefing_completed", False):
-            app.exibir_briefing_estrategico()
+            with telemetria.span("pagina.render", pagina="exibir_briefing_estrategico"):
+                app.exibir_briefing_estrategico()
         else:
             # Se já completou, mostra o menu de ferramentas de marketing
             st.sidebar.markdown("### Ferramentas de Marketing")
@@ -879,16 +1091,26 @@ def main():
             )
             
             # Executa a função correspondente à escolha do menu
-            menu_opcoes[escolha]()
+            with telemetria.span("pagina.render", pagina=menu_opcoes[escolha].__name__):
+                menu_opcoes[escolha]()
 
     else:
         # --- FLUXO DO USUÁRIO NÃO LOGADO ---
         # <<< MUDANÇA: Chamando a função com o nome que atualizamos
         if st.session_state.get('show_login_form', False):
-            exibir_login_e_registro() 
+            with telemetria.span("pagina.render", pagina="exibir_login_e_registro"):
+                exibir_login_e_registro() 
         else:
-            exibir_pagina_de_entrada()
+            with telemetria.span("pagina.render", pagina="exibir_pagina_de_entrada"):
+                exibir_pagina_de_entrada()
 
 # Ponto de entrada padrão para executar o aplicativo
 if __name__ == "__main__":
-    main()
+    try:
+        with telemetria.span("rerun"), telemetria.interacao("app"):
+            main()
+    finally:
+        # Ao final de cada rerun, grava o que mudou no backend de estado e, só depois,
+        # mede a sessão e descarrega o que estourar o orçamento de memória
+        salvar_estado_da_sessao()
+        aplicar_orcamento_de_memoria()
@@ -0,0 +1,472 @@
+"""
+Ativação de contas por chave (coleção 'chaves_ativacao' no Firestore).
+
+- resgatar_chave(): resgate idempotente e seguro contra envios duplicados/concorrentes.
+- gerar_chaves() / importar_chaves(): geração e importação em massa com commits em lote paralelos.
+
+Uso pela linha de comando:
+    python ativacao.py gerar --quantidade 10000 --plano PRO --saida chaves.csv
+    python ativacao.py importar --arquivo chaves.csv --plano PRO
+    python ativacao.py bench --quantidade 200000            # Firestore em memória
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python ativacao.py bench --emulador
+"""
+import argparse
+import csv
+import datetime
+import hashlib
+import itertools
+import os
+import secrets
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import telemetria
+
+# --- INÍCIO DA CONFIGURAÇÃO DE ATIVAÇÃO ---
+KEYS_COLLECTION = "chaves_ativacao"
+USER_COLLECTION = "users"
+STATUS_DISPONIVEL = "disponivel"
+STATUS_USADA = "usada"
+
+# O Firestore aceita no máximo 500 operações por commit em lote
+TAMANHO_LOTE = 500
+PARALELISMO_IMPORTACAO = int(os.environ.get("MMT_PARALELISMO_IMPORTACAO", "16"))
+# Tentativas de cada lote com erro transitório (timeout, 503...), com espera crescente entre elas
+TENTATIVAS_LOTE = int(os.environ.get("MMT_TENTATIVAS_LOTE", "4"))
+SEGUNDOS_ESPERA_LOTE = float(os.environ.get("MMT_SEGUNDOS_ESPERA_LOTE", "0.5"))
+# Alfabeto sem caracteres ambíguos (0/O, 1/I) para chaves digitadas à mão
+ALFABETO_CHAVE = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+TAMANHO_CHAVE = 10
+# --- FIM DA CONFIGURAÇÃO DE ATIVAÇÃO ---
+
+
+class ErroAtivacao(Exception):
+    """Erro de negócio na ativação, com mensagem pronta para mostrar ao usuário."""
+
+
+def normalizar_chave(chave):
+    return chave.strip().upper()
+
+
+def uid_da_chave(chave):
+    """
+    O UID do usuário é derivado da chave. Assim, dois envios da mesma chave tentam
+    criar o MESMO usuário no Firebase Auth, e o segundo é detectado em vez de
+    gerar uma conta duplicada.
+    """
+    return "mmt_" + hashlib.sha256(normalizar_chave(chave).encode("utf-8")).hexdigest()[:24]
+
+
+def _agora():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _executar_em_transacao(db, funcao):
+    """Roda a função dentro de uma transação do Firestore (ou da implementação em memória)."""
+    if hasattr(db, "executar_transacao"):
+        return db.executar_transacao(funcao)
+    from google.cloud import firestore
+    return firestore.transactional(funcao)(db.transaction())
+
+
+# ==============================================================================
+# RESGATE DE CHAVE
+# ==============================================================================
+
+def resgatar_chave(db, auth_admin, email, senha, chave):
+    """
+    Ativa uma conta a partir de uma chave. Idempotente: reenviar o mesmo formulário
+    (duplo clique, rede instável) devolve o mesmo UID sem criar nada novo.
+    'auth_admin' é o módulo firebase_admin.auth (ou um substituto com a mesma interface).
+    Devolve o UID do usuário ativado.
+    """
+    chave = normalizar_chave(chave)
+    email = email.strip().lower()
+    chave_ref = db.collection(KEYS_COLLECTION).document(chave)
+    user_uid = uid_da_chave(chave)
+
+    # 1 e 2. Busca a chave (o ID do documento é a própria chave) e verifica se está disponível
+    with telemetria.span("firestore.leitura", colecao=KEYS_COLLECTION):
+        chave_doc = chave_ref.get()
+    if not chave_doc.exists:
+        raise ErroAtivacao("Chave de ativação inválida. Confira se digitou corretamente.")
+    dados_chave = chave_doc.to_dict()
+    if dados_chave.get("status") == STATUS_USADA:
+        if dados_chave.get("email") == email:
+            return dados_chave["uid"] # Reenvio do mesmo usuário: nada a fazer
+        raise ErroAtivacao("Esta chave de ativação já foi utilizada.")
+    if dados_chave.get("status") != STATUS_DISPONIVEL:
+        # Qualquer outro status (revogada, por exemplo) não pode ser resgatado
+        raise ErroAtivacao("Esta chave de ativação não está disponível.")
+
+    # 3. Cria o usuário no Firebase Auth com o UID derivado da chave
+    try:
+        with telemetria.span("firebase.auth", operacao="criar_usuario"):
+            auth_admin.create_user(uid=user_uid, email=email, password=senha)
+    except auth_admin.UidAlreadyExistsError:
+        # Envio concorrente da mesma chave: só seguimos se for o mesmo e-mail
+        if (auth_admin.get_user(user_uid).email or "").lower() != email:
+            raise ErroAtivacao("Esta chave de ativação já está sendo utilizada por outra conta.")
+    except auth_admin.EmailAlreadyExistsError:
+        raise ErroAtivacao("Este e-mail já possui uma conta. Use a aba 'Entrar'.")
+
+    # 4 e 5. Numa única transação: confere a chave de novo, cria o perfil e marca a chave como usada
+    user_ref = db.collection(USER_COLLECTION).document(user_uid)
+
+    def _confirmar(transacao):
+        atual = chave_ref.get(transaction=transacao).to_dict() or {}
+        if atual.get("status") == STATUS_USADA:
+            if atual.get("uid") == user_uid:
+                return user_uid
+            raise ErroAtivacao("Esta chave de ativação já foi utilizada.")
+        if atual.get("status") != STATUS_DISPONIVEL:
+            raise ErroAtivacao("Esta chave de ativação não está disponível.")
+        transacao.set(user_ref, {
+            "email": email,
+            "plano": atual.get("plano"),
+            "chave_ativacao": chave,
+            "briefing_completed": False,
+            "criado_em": _agora(),
+        })
+        transacao.update(chave_ref, {"status": STATUS_USADA, "uid": user_uid, "email": email, "usada_em": _agora()})
+        return user_uid
+
+    with telemetria.span("firestore.transacao", colecao=KEYS_COLLECTION):
+        return _executar_em_transacao(db, _confirmar)
+
+
+# ==============================================================================
+# GERAÇÃO E IMPORTAÇÃO EM MASSA
+# ==============================================================================
+
+def gerar_chaves(quantidade, prefixo="MMT-PRO"):
+    """
+    Gera chaves aleatórias no formato 'MMT-PRO-XXXXXXXXXX'. Com 32^10 combinações,
+    uma colisão é improvável, e o 'create' da importação recusa qualquer repetida.
+    """
+    for _ in range(quantidade):
+        yield f"{prefixo}-" + "".join(secrets.choice(ALFABETO_CHAVE) for _ in range(TAMANHO_CHAVE))
+
+
+def _em_lotes(iteravel, tamanho):
+    iterador = iter(iteravel)
+    while True:
+        lote = list(itertools.islice(iterador, tamanho))
+        if not lote:
+            return
+        yield lote
+
+
+def _ja_existe(erro):
+    """AlreadyExists do Firestore (ou do FirestoreMemoria): repetir o mesmo lote não adianta."""
+    return type(erro).__name__ in ("AlreadyExists", "Conflict")
+
+
+def importar_chaves(db, chaves, plano, paralelismo=PARALELISMO_IMPORTACAO, ao_gravar=None):
+    """
+    Grava as chaves em commits de até 500 documentos, vários em paralelo.
+    Usa 'create' para nunca sobrescrever uma chave existente (já usada, por exemplo).
+    Aceita um gerador, então milhões de chaves não precisam caber na memória.
+    Um lote com erro transitório é repetido até TENTATIVAS_LOTE vezes; um lote recusado
+    porque alguma chave já existe é regravado chave a chave, para salvar as demais.
+    'ao_gravar(chaves)' é chamada (sempre na thread de quem chamou) com cada grupo de
+    chaves confirmadas pelo Firestore, por exemplo para escrevê-las no CSV.
+    Devolve (gravadas, chaves_com_erro).
+    """
+    colecao = db.collection(KEYS_COLLECTION)
+    criada_em = _agora()
+    gravadas, chaves_com_erro = 0, []
+
+    def _commit(lote):
+        batch = db.batch()
+        for chave in lote:
+            batch.create(colecao.document(normalizar_chave(chave)), {
+                "status": STATUS_DISPONIVEL, "plano": plano, "criada_em": criada_em,
+            })
+        batch.commit()
+
+    def _commit_com_tentativas(lote):
+        for tentativa in range(TENTATIVAS_LOTE):
+            try:
+                return _commit(lote)
+            except Exception as e:
+                if _ja_existe(e) or tentativa == TENTATIVAS_LOTE - 1:
+                    raise
+                time.sleep(SEGUNDOS_ESPERA_LOTE * 2 ** tentativa)
+
+    def _gravar_lote(lote):
+        """Devolve (chaves gravadas, chaves com erro)."""
+        try:
+            _commit_com_tentativas(lote)
+            return lote, []
+        except Exception as e:
+            if not _ja_existe(e):
+                print(f"Erro ao gravar um lote de chaves após {TENTATIVAS_LOTE} tentativas: {e}")
+                return [], lote
+        gravadas_do_lote, com_erro = [], []
+        for chave in lote:
+            try:
+                _commit_com_tentativas([chave])
+                gravadas_do_lote.append(chave)
+            except Exception as e:
+                print(f"Chave não gravada ({chave}): {e}")
+                com_erro.append(chave)
+        return gravadas_do_lote, com_erro
+
+    def _receber(futuro):
+        nonlocal gravadas
+        gravadas_do_lote, com_erro = futuro.result()
+        gravadas += len(gravadas_do_lote)
+        chaves_com_erro.extend(com_erro)
+        if ao_gravar is not None and gravadas_do_lote:
+            ao_gravar(gravadas_do_lote)
+
+    with ThreadPoolExecutor(max_workers=paralelismo) as executor:
+        pendentes = set()
+        for lote in _em_lotes(chaves, TAMANHO_LOTE):
+            # Limita os lotes em voo para não carregar todas as chaves de uma vez
+            if len(pendentes) >= paralelismo * 2:
+                concluidos, pendentes = wait(pendentes, return_when=FIRST_COMPLETED)
+                for futuro in concluidos:
+                    _receber(futuro)
+            pendentes.add(executor.submit(_gravar_lote, lote))
+        for futuro in pendentes:
+            _receber(futuro)
+    return gravadas, chaves_com_erro
+
+
+# ==============================================================================
+# FIRESTORE E AUTH EM MEMÓRIA (BENCHMARK E TESTES)
+# ==============================================================================
+
+class _DocumentoMemoria:
+    def __init__(self, doc_id, dados):
+        self.id = doc_id
+        self.exists = dados is not None
+        self._dados = dict(dados) if dados is not None else None
+
+    def to_dict(self):
+        return dict(self._dados) if self._dados is not None else None
+
+
+class _ReferenciaMemoria:
+    def __init__(self, banco, caminho):
+        self._banco = banco
+        self.caminho = caminho
+        self.id = caminho[1]
+
+    def get(self, transaction=None):
+        with self._banco.lock:
+            return _DocumentoMemoria(self.id, self._banco.docs.get(self.caminho))
+
+    def set(self, dados, merge=False):
+        with self._banco.lock:
+            base = dict(self._banco.docs.get(self.caminho) or {}) if merge else {}
+            base.update(dados)
+            self._banco.docs[self.caminho] = base
+
+    def update(self, dados):
+        with self._banco.lock:
+            if self.caminho not in self._banco.docs:
+                raise KeyError(f"Documento não encontrado: {self.caminho}")
+            self._banco.docs[self.caminho].update(dados)
+
+
+class _ColecaoMemoria:
+    def __init__(self, banco, nome):
+        self._banco = banco
+        self._nome = nome
+
+    def document(self, doc_id):
+        return _ReferenciaMemoria(self._banco, (self._nome, doc_id))
+
+
+class AlreadyExists(ValueError):
+    """Mesmo nome da exceção do Firestore para um 'create' de documento que já existe."""
+
+
+class _LoteMemoria:
+    """Operações acumuladas e aplicadas de uma vez no commit (tudo ou nada)."""
+
+    def __init__(self, banco):
+        self._banco = banco
+        self._operacoes = []
+
+    def create(self, ref, dados):
+        self._operacoes.append(("create", ref, dados))
+
+    def set(self, ref, dados):
+        self._operacoes.append(("set", ref, dados))
+
+    def update(self, ref, dados):
+        self._operacoes.append(("update", ref, dados))
+
+    def commit(self):
+        with self._banco.lock:
+            for tipo, ref, _ in self._operacoes:
+                if tipo == "create" and ref.caminho in self._banco.docs:
+                    raise AlreadyExists(f"Documento já existe: {ref.caminho}")
+                if tipo == "update" and ref.caminho not in self._banco.docs:
+                    raise KeyError(f"Documento não encontrado: {ref.caminho}")
+            for tipo, ref, dados in self._operacoes:
+                if tipo == "update":
+                    self._banco.docs[ref.caminho].update(dados)
+                else:
+                    self._banco.docs[ref.caminho] = dict(dados)
+
+
+class FirestoreMemoria:
+    """
+    Subconjunto do cliente do Firestore usado por este módulo, em memória.
+    As transações são serializadas por um lock, o que reproduz a garantia do
+    Firestore de que duas transações sobre o mesmo documento não se intercalam.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.docs = {}
+
+    def collection(self, nome):
+        return _ColecaoMemoria(self, nome)
+
+    def batch(self):
+        return _LoteMemoria(self)
+
+    def executar_transacao(self, funcao):
+        with self.lock:
+            transacao = _LoteMemoria(self)
+            resultado = funcao(transacao)
+            transacao.commit()
+            return resultado
+
+
+class AuthMemoria:
+    """Substituto do firebase_admin.auth com create_user/get_user e as mesmas exceções."""
+
+    class UidAlreadyExistsError(Exception):
+        pass
+
+    class EmailAlreadyExistsError(Exception):
+        pass
+
+    class _Usuario:
+        def __init__(self, uid, email):
+            self.uid = uid
+            self.email = email
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._usuarios = {}
+
+    def create_user(self, uid, email, password):
+        with self._lock:
+            if uid in self._usuarios:
+                raise self.UidAlreadyExistsError(uid)
+            if any(u.email == email for u in self._usuarios.values()):
+                raise self.EmailAlreadyExistsError(email)
+            self._usuarios[uid] = self._Usuario(uid, email)
+
+    def get_user(self, uid):
+        with self._lock:
+            return self._usuarios[uid]
+
+
+# ==============================================================================
+# LINHA DE COMANDO E BENCHMARK
+# ==============================================================================
+
+def _criar_db(emulador):
+    if emulador:
+        if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+            raise SystemExit("Defina FIRESTORE_EMULATOR_HOST (ex: localhost:8080) para usar o emulador.")
+        from google.cloud import firestore
+        return firestore.Client(project=os.environ.get("GCLOUD_PROJECT", "demo-mmt"))
+    return FirestoreMemoria()
+
+
+def _benchmark(quantidade, emulador, paralelismo):
+    db = _criar_db(emulador)
+
+    inicio = time.perf_counter()
+    gravadas, erros = importar_chaves(db, gerar_chaves(quantidade), "PRO", paralelismo)
+    duracao = time.perf_counter() - inicio
+    print(f"Importação: {gravadas} chaves em {duracao:.2f}s ({gravadas / duracao:,.0f} chaves/s), chaves com erro: {len(erros)}")
+
+    # Envios duplicados concorrentes: 50 threads com a MESMA chave e o MESMO e-mail,
+    # mais 50 com a mesma chave e e-mails diferentes. Só pode existir um usuário.
+    if emulador:
+        print("Teste de concorrência do resgate pulado (precisa do emulador do Auth).")
+        return
+    auth_admin = AuthMemoria()
+    chave = next(gerar_chaves(1, prefixo="MMT-BENCH"))
+    importar_chaves(db, [chave], "PRO")
+    resultados = []
+
+    def _tentar(email):
+        try:
+            resultados.append(("ok", resgatar_chave(db, auth_admin, email, "senha123", chave)))
+        except ErroAtivacao as e:
+            resultados.append(("recusado", str(e)))
+
+    emails = ["cliente@exemplo.com"] * 50 + [f"outro{i}@exemplo.com" for i in range(50)]
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        list(executor.map(_tentar, emails))
+    uids = {valor for status, valor in resultados if status == "ok"}
+    recusados = sum(1 for status, _ in resultados if status == "recusado")
+    print(f"Resgate concorrente: {len(resultados)} envios, {len(uids)} UID distinto(s), {recusados} recusados")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chaves de ativação do MaxMarketing Total")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    gerar = sub.add_parser("gerar", help="Gera chaves novas, grava no Firestore e exporta em CSV")
+    gerar.add_argument("--quantidade", type=int, required=True)
+    gerar.add_argument("--plano", default="PRO")
+    gerar.add_argument("--saida", required=True)
+
+    importar = sub.add_parser("importar", help="Importa chaves de um CSV (uma chave por linha)")
+    importar.add_argument("--arquivo", required=True)
+    importar.add_argument("--plano", default="PRO")
+
+    bench = sub.add_parser("bench", help="Mede a vazão da importação e testa resgates concorrentes")
+    bench.add_argument("--quantidade", type=int, default=200_000)
+    bench.add_argument("--paralelismo", type=int, default=PARALELISMO_IMPORTACAO)
+    bench.add_argument("--emulador", action="store_true")
+
+    args = parser.parse_args()
+    if args.comando == "bench":
+        _benchmark(args.quantidade, args.emulador, args.paralelismo)
+        return 0
+
+    from ferramentas import carregar_secrets, inicializar_firebase_admin
+    db = inicializar_firebase_admin(carregar_secrets()["gcp_service_account"])
+
+    if args.comando == "gerar":
+        # O CSV só recebe as chaves que o Firestore confirmou: nunca se vende uma chave que não existe
+        with open(args.saida, "w", newline="", encoding="utf-8") as f:
+            escritor = csv.writer(f)
+            gravadas, erros = importar_chaves(
+                db, gerar_chaves(args.quantidade, prefixo=f"MMT-{args.plano}"), args.plano,
+                ao_gravar=lambda lote: escritor.writerows([c] for c in lote),
+            )
+        print(f"{gravadas} chaves geradas e importadas ({args.saida}), {len(erros)} descartadas por erro.")
+        return 0 if not erros else 1
+
+    with open(args.arquivo, newline="", encoding="utf-8") as f:
+        chaves = (linha[0] for linha in csv.reader(f) if linha)
+        gravadas, erros = importar_chaves(db, chaves, args.plano)
+    print(f"{gravadas} chaves importadas, {len(erros)} com erro.")
+    if erros:
+        # Lista para conferir (as que já existiam) ou importar de novo (as que falharam)
+        arquivo_erros = f"{os.path.splitext(args.arquivo)[0]}.erros.csv"
+        with open(arquivo_erros, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows([c] for c in erros)
+        print(f"Chaves não importadas em {arquivo_erros}.")
+    return 0 if not erros else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,307 @@
+import datetime
+import hashlib
+import os
+import re
+import threading
+import time
+
+import telemetria
+
+# ==============================================================================
+# DNA DA MARCA: PREFIXO COMPILADO E CACHE DE PREFIXO
+# ==============================================================================
+# O briefing estratégico é compilado UMA vez, no salvamento, em um prefixo curto
+# (persona do Max + DNA da empresa) que fica guardado no documento da empresa.
+# Todas as ferramentas começam o prompt com esse mesmo prefixo, byte a byte.
+# Para o context caching do Gemini, o DNA vai ao cache junto com o manual de todas as
+# ferramentas (instruções e formatos de saída): sozinho ele tem poucas centenas de tokens,
+# abaixo do mínimo do Gemini, e com o manual no cache o corpo de cada chamada fica menor.
+
+VERSAO_DNA = 1
+# Limite de caracteres por campo do briefing no prefixo compilado
+MAX_CARACTERES_CAMPO = int(os.environ.get("MMT_DNA_MAX_CARACTERES_CAMPO", "280"))
+
+# "gemini" (produção), "local" (testes, com o LLM falso) ou "desligado"
+CACHE_PREFIXO = os.environ.get(
+    "MMT_CACHE_PREFIXO", "local" if os.environ.get("MMT_LLM_BACKEND") == "falso" else "gemini"
+)
+# O CachedContent é criado para o mesmo modelo do cliente (o do criar_llm), e o context
+# caching exige um mínimo de tokens no conteúdo, que depende do modelo. Nos modelos 1.5
+# (32.768) nenhum briefing alcança o mínimo e o DNA segue no prompt; no gemini-2.5-flash
+# (1.024) o DNA com o manual das ferramentas já passa. MMT_MIN_TOKENS_CACHE_GEMINI força um valor.
+MIN_TOKENS_CACHE_POR_MODELO = {
+    "gemini-2.5-flash": 1024,
+    "gemini-2.5-pro": 4096,
+}
+MIN_TOKENS_CACHE_PADRAO = 32768
+MIN_TOKENS_CACHE_GEMINI = os.environ.get("MMT_MIN_TOKENS_CACHE_GEMINI")
+SEGUNDOS_TTL_CACHE = int(os.environ.get("MMT_SEGUNDOS_TTL_CACHE_PREFIXO", "3600"))
+
+# Campos do briefing, na ordem em que entram no prefixo, com rótulos curtos
+CAMPOS_DNA = (
+    ("company_name", "Empresa"),
+    ("pitch", "Pitch"),
+    ("personalidade", "Personalidade"),
+    ("produtos", "Produtos"),
+    ("diferencial", "Diferencial"),
+    ("cliente_ideal", "Cliente ideal"),
+    ("dor_cliente", "Dor do cliente"),
+    ("objetivo_principal", "Objetivo nº 1"),
+)
+
+
+def _compactar(texto):
+    """Junta espaços e quebras de linha e corta textos longos demais."""
+    texto = re.sub(r"\s+", " ", str(texto)).strip()
+    if len(texto) > MAX_CARACTERES_CAMPO:
+        texto = texto[:MAX_CARACTERES_CAMPO].rsplit(" ", 1)[0] + "…"
+    return texto
+
+
+def contar_tokens(texto, llm=None):
+    """Conta os tokens com o próprio LLM quando possível; senão, estima ~4 caracteres por token."""
+    if llm is not None and hasattr(llm, "get_num_tokens"):
+        try:
+            return llm.get_num_tokens(texto)
+        except Exception as e:
+            print(f"Alerta: Não foi possível contar os tokens com o LLM. Usando estimativa. Erro: {e}")
+    return max(1, len(texto) // 4)
+
+
+def hash_do_briefing(dados_empresa, system_prompt):
+    """Identifica o conteúdo que gerou o prefixo; muda sempre que o briefing ou a persona mudam."""
+    base = "|".join([str(VERSAO_DNA), system_prompt] + [str(dados_empresa.get(c, "")) for c, _ in CAMPOS_DNA])
+    return hashlib.sha256(base.encode("utf-8")).hexdigest()[:16]
+
+
+def compilar_dna_marca(dados_empresa, system_prompt, llm=None):
+    """
+    Compila a persona do Max e o briefing da empresa em um prefixo compacto.
+    Devolve o dicionário salvo em 'dna_marca' no documento da empresa.
+    """
+    linhas = [
+        f"{rotulo}: {_compactar(dados_empresa[campo])}"
+        for campo, rotulo in CAMPOS_DNA
+        if dados_empresa.get(campo)
+    ]
+    texto = system_prompt.strip()
+    if linhas:
+        texto += "\n\n**DNA DA MARCA**\n" + "\n".join(linhas)
+    return {
+        "texto": texto,
+        "tokens": contar_tokens(texto, llm),
+        "hash": hash_do_briefing(dados_empresa, system_prompt),
+        "versao": VERSAO_DNA,
+        "compilado_em": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+
+
+def dna_da_empresa(dados_empresa, system_prompt):
+    """
+    Usa o DNA compilado no salvamento do briefing. Se ele não existir ou estiver
+    desatualizado (briefing antigo, persona alterada), compila na hora.
+    """
+    dna = (dados_empresa or {}).get("dna_marca")
+    if dna and dna.get("hash") == hash_do_briefing(dados_empresa, system_prompt):
+        return dna
+    return compilar_dna_marca(dados_empresa or {}, system_prompt)
+
+
+def montar_prefixo(dna, manual):
+    """
+    Prefixo guardado no cache do provedor: o DNA da marca seguido do manual das ferramentas.
+    O hash muda quando o briefing, a persona ou qualquer instrução do prompts.json mudam.
+    """
+    texto = f"{dna['texto']}\n\n**MANUAL DAS FERRAMENTAS**\n{manual}"
+    return {
+        "texto": texto,
+        "tokens": contar_tokens(texto),
+        "hash": hashlib.sha256(f"{dna['hash']}|{manual}".encode("utf-8")).hexdigest()[:16],
+    }
+
+
+# ==============================================================================
+# CACHE DE PREFIXO (GEMINI CONTEXT CACHING E SUBSTITUTO LOCAL)
+# ==============================================================================
+# Contrato: preparar(llm, prefixo) -> (llm_a_usar, enviar_prefixo)
+#   'prefixo' vem do montar_prefixo(). Se enviar_prefixo for False, o prefixo já está no
+#   cache do provedor e o prompt deve levar apenas o corpo da ferramenta; se for True,
+#   quem chama envia só o DNA na frente do corpo completo, como sem cache.
+
+class CachePrefixoDesligado:
+    """Sem cache: o prefixo vai junto em todas as chamadas."""
+
+    def preparar(self, llm, dna):
+        return llm, True
+
+
+class _LLMComPrefixoLocal:
+    """
+    Imita um LLM com o prefixo em cache: envia o prefixo ao modelo por baixo e informa
+    os tokens dele como lidos do cache, no mesmo formato do Gemini (os tokens de entrada
+    continuam incluindo o prefixo; 'input_token_details.cache_read' diz quantos vieram do cache).
+    """
+
+    def __init__(self, llm, dna, informar_cache=True):
+        self._llm = llm
+        self._dna = dna
+        self._informar_cache = informar_cache
+        self.model = getattr(llm, "model", type(llm).__name__)
+        self.temperature = getattr(llm, "temperature", None)
+        # Mesmo papel do 'cached_content' do Gemini: identifica o prefixo em cache
+        self.cached_content = f"local:{dna['hash']}"
+
+    def com_cliente(self, llm):
+        """Mesmo prefixo sobre outro cliente (usado pelo modelo de reserva do resiliencia.py)."""
+        return _LLMComPrefixoLocal(llm, self._dna, self._informar_cache)
+
+    def _ajustar_uso(self, resposta):
+        uso = getattr(resposta, "usage_metadata", None)
+        if uso and self._informar_cache:
+            uso["input_token_details"] = {"cache_read": min(self._dna["tokens"], uso.get("input_tokens", 0))}
+        return resposta
+
+    def invoke(self, prompt):
+        return self._ajustar_uso(self._llm.invoke(f"{self._dna['texto']}\n\n{prompt}"))
+
+    async def ainvoke(self, prompt):
+        return self._ajustar_uso(await self._llm.ainvoke(f"{self._dna['texto']}\n\n{prompt}"))
+
+    async def astream(self, prompt):
+        async for pedaco in self._llm.astream(f"{self._dna['texto']}\n\n{prompt}"):
+            yield self._ajustar_uso(pedaco)
+
+
+class CachePrefixoLocal:
+    """Substituto do context caching para testes: guarda os prefixos em memória e conta acertos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._prefixos = {}
+
+    def preparar(self, llm, dna):
+        with self._lock:
+            acerto = dna["hash"] in self._prefixos
+            self._prefixos[dna["hash"]] = dna
+        telemetria.incrementar("mmt_cache_prefixo_total", resultado="acerto" if acerto else "falha")
+        return _LLMComPrefixoLocal(llm, dna), False
+
+
+def minimo_tokens_cache(modelo):
+    """Mínimo de tokens para o context caching do Gemini no 'modelo' (ex: 'models/gemini-2.5-flash')."""
+    if MIN_TOKENS_CACHE_GEMINI:
+        return int(MIN_TOKENS_CACHE_GEMINI)
+    nome = str(modelo).removeprefix("models/")
+    for prefixo, minimo in MIN_TOKENS_CACHE_POR_MODELO.items():
+        if nome.startswith(prefixo):
+            return minimo
+    return MIN_TOKENS_CACHE_PADRAO
+
+
+class _LLMComCacheGemini:
+    """
+    Cliente do Gemini que referencia um CachedContent. O CachedContent só vale para o modelo
+    em que foi criado, então o modelo de reserva do resiliencia.py recebe o prefixo no prompt.
+    """
+
+    def __init__(self, cliente, dna):
+        self._cliente = cliente
+        self._dna = dna
+        self.model = getattr(cliente, "model", None)
+        self.temperature = getattr(cliente, "temperature", None)
+        self.cached_content = cliente.cached_content
+
+    def com_cliente(self, llm):
+        return _LLMComPrefixoLocal(llm, self._dna, informar_cache=False)
+
+    def invoke(self, prompt):
+        return self._cliente.invoke(prompt)
+
+    async def ainvoke(self, prompt):
+        return await self._cliente.ainvoke(prompt)
+
+    def astream(self, prompt):
+        return self._cliente.astream(prompt)
+
+
+class CachePrefixoGemini:
+    """
+    Usa o context caching do Gemini: o prefixo vira um CachedContent do mesmo modelo do
+    cliente e as chamadas passam a referenciá-lo. Prefixos abaixo do mínimo de tokens do
+    modelo (contados pelo próprio Gemini) não podem ser cacheados e o DNA segue no prompt,
+    sempre idêntico, o que ainda favorece o cache implícito. A economia real aparece nos
+    tokens 'cache' do mmt_llm_tokens_total, lidos do cached_content_token_count das respostas.
+    """
+
+    def __init__(self, api_key=None):
+        self._api_key = api_key
+        self._lock = threading.Lock()
+        # (hash do prefixo, modelo) -> (cliente com o CachedContent ou None se abaixo do mínimo, expira_em)
+        self._caches = {}
+
+    def _criar_cache(self, modelo, dna):
+        import google.generativeai as genai
+        from google.generativeai import caching
+        if self._api_key:
+            genai.configure(api_key=self._api_key)
+        cache = caching.CachedContent.create(
+            model=modelo,
+            system_instruction=dna["texto"],
+            ttl=datetime.timedelta(seconds=SEGUNDOS_TTL_CACHE),
+        )
+        return cache.name
+
+    def _guardar(self, chave, cliente, expira_em):
+        """Guarda o resultado e esquece os caches vencidos (cada renovação cria um cliente novo)."""
+        with self._lock:
+            agora = time.time()
+            for vencida in [c for c, (_, expira) in self._caches.items() if expira <= agora]:
+                del self._caches[vencida]
+            self._caches[chave] = (cliente, expira_em)
+
+    def preparar(self, llm, dna):
+        modelo = getattr(llm, "model", None)
+        chave = (dna["hash"], modelo)
+        with self._lock:
+            guardado = self._caches.get(chave)
+        if guardado and guardado[1] > time.time():
+            if guardado[0] is None:
+                telemetria.incrementar("mmt_cache_prefixo_total", resultado="abaixo_do_minimo")
+                return llm, True
+            telemetria.incrementar("mmt_cache_prefixo_total", resultado="acerto")
+            return guardado[0], False
+
+        # Conta com o próprio Gemini (uma vez por prefixo e TTL): a estimativa por caracteres
+        # pode errar para os dois lados perto do mínimo
+        if not modelo or contar_tokens(dna["texto"], llm) < minimo_tokens_cache(modelo):
+            self._guardar(chave, None, time.time() + SEGUNDOS_TTL_CACHE)
+            telemetria.incrementar("mmt_cache_prefixo_total", resultado="abaixo_do_minimo")
+            return llm, True
+
+        try:
+            with telemetria.span("llm.cache_prefixo.criar"):
+                nome = self._criar_cache(modelo, dna)
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            cliente = _LLMComCacheGemini(ChatGoogleGenerativeAI(
+                model=modelo, google_api_key=self._api_key,
+                temperature=getattr(llm, "temperature", 0.75), timeout=getattr(llm, "timeout", None),
+                cached_content=nome,
+            ), dna)
+        except Exception as e:
+            print(f"Alerta: Não foi possível criar o cache de prefixo no Gemini. Enviando o prefixo no prompt. Erro: {e}")
+            telemetria.incrementar("mmt_cache_prefixo_total", resultado="erro")
+            return llm, True
+
+        # Renova um pouco antes do TTL do Gemini para nunca usar um cache já expirado
+        self._guardar(chave, cliente, time.time() + SEGUNDOS_TTL_CACHE * 0.9)
+        telemetria.incrementar("mmt_cache_prefixo_total", resultado="falha")
+        return cliente, False
+
+
+def criar_cache_prefixo(api_key=None, tipo=CACHE_PREFIXO):
+    """Cria o cache de prefixo configurado em MMT_CACHE_PREFIXO."""
+    if tipo == "gemini":
+        return CachePrefixoGemini(api_key)
+    if tipo == "local":
+        return CachePrefixoLocal()
+    return CachePrefixoDesligado()
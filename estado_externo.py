@@ -0,0 +1,474 @@
+import collections
+import datetime
+import hashlib
+import os
+import pickle
+import secrets
+import threading
+import time
+
+import streamlit as st
+
+import telemetria
+from memoria_sessao import CHAVES_GERENCIADAS, alterado_em, esta_descarregado, registrar_ao_perder_item
+
+# --- INÍCIO DA CONFIGURAÇÃO DO ESTADO EXTERNO ---
+# "memoria" (padrão, desenvolvimento local e testes), "redis" ou "firestore" (produção, várias
+# instâncias; o Dockerfile usa "firestore").
+BACKEND_ESTADO = os.environ.get("MMT_BACKEND_ESTADO", "memoria")
+REDIS_URL = os.environ.get("MMT_REDIS_URL", "redis://localhost:6379/0")
+SESSION_COLLECTION = "sessoes" # Coleção do Firestore com o estado das sessões
+# Uma sessão sem gravações por esse tempo expira no Redis e no Firestore (campo CAMPO_EXPIRACAO,
+# que precisa de uma política de TTL no Firestore; ver README)
+SEGUNDOS_EXPIRACAO_SESSAO = int(os.environ.get("MMT_SEGUNDOS_EXPIRACAO_SESSAO", str(7 * 24 * 3600)))
+CAMPO_EXPIRACAO = "expira_em"
+# O backend em memória guarda uma cópia de cada sessão dentro do próprio processo, então
+# esquece as sessões paradas há mais tempo que isso e as mais antigas acima do limite.
+SEGUNDOS_EXPIRACAO_SESSAO_MEMORIA = int(os.environ.get("MMT_SEGUNDOS_EXPIRACAO_SESSAO_MEMORIA", "7200"))
+MAX_SESSOES_MEMORIA = int(os.environ.get("MMT_MAX_SESSOES_MEMORIA", "100"))
+
+# Tudo o que precisa sobreviver a uma troca de instância: o trabalho do usuário.
+# O login ('user_session', com os tokens do Firebase) NUNCA sai do processo: como o ID da
+# sessão viaja na URL, quem recebesse o link entraria na conta. Em uma instância nova o
+# usuário faz login de novo e só então recupera o trabalho (ver _espaco_da_sessao).
+CHAVES_ANONIMAS = ("show_login_form",)
+CHAVES_DO_USUARIO = ("briefing_data", "pacote_inicial_aplicado") + CHAVES_GERENCIADAS
+CHAVES_EXTERNAS = CHAVES_ANONIMAS + CHAVES_DO_USUARIO
+
+# O ID da sessão viaja na URL para que qualquer instância reconheça a aba,
+# sem depender de sticky sessions no Cloud Run.
+PARAMETRO_SESSAO = "sid"
+# O Firestore recusa documentos acima de 1 MiB; deixamos folga para os nomes dos campos.
+LIMITE_BYTES_ITEM_FIRESTORE = 1_000_000
+_CHAVE_VERSOES = "_mmt_estado_versoes"
+_CHAVE_LIMPAS = "_mmt_estado_limpas" # chave gerenciada -> (id do objeto, momento) da última gravação
+# --- FIM DA CONFIGURAÇÃO DO ESTADO EXTERNO ---
+
+
+class ConflitoDeVersao(Exception):
+    """Outra instância (ou outra aba) gravou a mesma chave desde a nossa última leitura."""
+
+    def __init__(self, chaves):
+        super().__init__(f"Conflito de versão nas chaves: {', '.join(chaves)}")
+        self.chaves = chaves
+
+
+# ==============================================================================
+# BACKENDS DE ESTADO
+# ==============================================================================
+# Todos seguem o mesmo contrato:
+#   ler_versoes(sessao_id) -> {chave: versao}         (uma ida ao servidor, sem os valores)
+#   ler_dados(sessao_id, chaves) -> {chave: dados}    (só para as chaves desatualizadas)
+#   gravar(sessao_id, alteracoes) -> {chave: nova_versao}
+#       alteracoes = {chave: (versao_esperada, dados ou None para apagar)}
+#   apagar_sessao(sessao_id)
+#   limite_bytes_item: tamanho máximo de um valor, ou None se não houver
+
+class BackendMemoria:
+    """
+    Estado em um dicionário do processo. Usado no desenvolvimento local e nos testes: não é
+    compartilhado entre instâncias, e as sessões paradas ou excedentes são esquecidas.
+    """
+
+    limite_bytes_item = None
+
+    def __init__(self, segundos_expiracao=SEGUNDOS_EXPIRACAO_SESSAO_MEMORIA, max_sessoes=MAX_SESSOES_MEMORIA):
+        self._lock = threading.Lock()
+        self._sessoes = collections.OrderedDict() # sessao_id -> {chave: (versao, dados)}, da menos usada para a mais usada
+        self._usadas_em = {}
+        self._segundos_expiracao = segundos_expiracao
+        self._max_sessoes = max_sessoes
+
+    def _usar(self, sessao_id):
+        """Marca o uso da sessão e esquece as expiradas e as excedentes. Chamar com o lock."""
+        agora = time.monotonic()
+        if sessao_id in self._sessoes:
+            self._sessoes.move_to_end(sessao_id)
+            self._usadas_em[sessao_id] = agora
+        while self._sessoes:
+            mais_antiga = next(iter(self._sessoes))
+            expirada = agora - self._usadas_em[mais_antiga] > self._segundos_expiracao
+            if not expirada and len(self._sessoes) <= self._max_sessoes:
+                break
+            self._sessoes.popitem(last=False)
+            del self._usadas_em[mais_antiga]
+        return self._sessoes.get(sessao_id, {})
+
+    def ler_versoes(self, sessao_id):
+        with self._lock:
+            return {chave: versao for chave, (versao, _) in self._usar(sessao_id).items()}
+
+    def ler_dados(self, sessao_id, chaves):
+        with self._lock:
+            atual = self._usar(sessao_id)
+            return {chave: atual[chave][1] for chave in chaves if chave in atual}
+
+    def gravar(self, sessao_id, alteracoes):
+        with self._lock:
+            if sessao_id not in self._sessoes:
+                self._sessoes[sessao_id] = {}
+                self._usadas_em[sessao_id] = time.monotonic()
+            atual = self._usar(sessao_id)
+            conflitos = [c for c, (esperada, _) in alteracoes.items() if atual.get(c, (0, None))[0] != esperada]
+            if conflitos:
+                raise ConflitoDeVersao(conflitos)
+            novas_versoes = {}
+            for chave, (esperada, dados) in alteracoes.items():
+                if dados is None:
+                    atual.pop(chave, None)
+                    novas_versoes[chave] = 0
+                else:
+                    atual[chave] = (esperada + 1, dados)
+                    novas_versoes[chave] = esperada + 1
+            return novas_versoes
+
+    def apagar_sessao(self, sessao_id):
+        with self._lock:
+            self._sessoes.pop(sessao_id, None)
+            self._usadas_em.pop(sessao_id, None)
+
+
+class BackendRedis:
+    """
+    Estado no Redis em dois hashes por sessão: um só com as versões (lido a cada rerun)
+    e outro com os valores (lido apenas para as chaves desatualizadas).
+    """
+
+    limite_bytes_item = None
+
+    def __init__(self, url=REDIS_URL):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("O backend 'redis' precisa do pacote 'redis' instalado.") from e
+        self._redis = redis.Redis.from_url(url)
+        self._erro_watch = redis.WatchError
+
+    @staticmethod
+    def _nomes(sessao_id):
+        return f"mmt:sessao:{sessao_id}:v", f"mmt:sessao:{sessao_id}:d"
+
+    def ler_versoes(self, sessao_id):
+        nome_versoes, _ = self._nomes(sessao_id)
+        return {chave.decode(): int(versao) for chave, versao in self._redis.hgetall(nome_versoes).items()}
+
+    def ler_dados(self, sessao_id, chaves):
+        _, nome_dados = self._nomes(sessao_id)
+        valores = self._redis.hmget(nome_dados, list(chaves))
+        return {chave: dados for chave, dados in zip(chaves, valores) if dados is not None}
+
+    def gravar(self, sessao_id, alteracoes):
+        nome_versoes, nome_dados = self._nomes(sessao_id)
+        with self._redis.pipeline() as pipe:
+            try:
+                pipe.watch(nome_versoes)
+                versoes = pipe.hmget(nome_versoes, list(alteracoes))
+                atuais = {c: int(v or 0) for c, v in zip(alteracoes, versoes)}
+                conflitos = [c for c, (esperada, _) in alteracoes.items() if atuais[c] != esperada]
+                if conflitos:
+                    raise ConflitoDeVersao(conflitos)
+                pipe.multi()
+                novas_versoes = {}
+                for chave, (esperada, dados) in alteracoes.items():
+                    if dados is None:
+                        pipe.hdel(nome_versoes, chave)
+                        pipe.hdel(nome_dados, chave)
+                        novas_versoes[chave] = 0
+                    else:
+                        pipe.hset(nome_dados, chave, dados)
+                        pipe.hset(nome_versoes, chave, esperada + 1)
+                        novas_versoes[chave] = esperada + 1
+                pipe.expire(nome_versoes, SEGUNDOS_EXPIRACAO_SESSAO)
+                pipe.expire(nome_dados, SEGUNDOS_EXPIRACAO_SESSAO)
+                pipe.execute()
+                return novas_versoes
+            except self._erro_watch:
+                raise ConflitoDeVersao(list(alteracoes))
+
+    def apagar_sessao(self, sessao_id):
+        self._redis.delete(*self._nomes(sessao_id))
+
+
+class BackendFirestore:
+    """
+    Estado no Firestore: o documento 'sessoes/{sessao_id}' guarda só o mapa de versões
+    e cada valor fica em um documento próprio em 'sessoes/{sessao_id}/itens'.
+    Atenção: o Firestore limita cada documento a 1 MiB; valores maiores são recusados
+    um a um (ver persistir_estado). Para catálogos com muitas fotos, prefira o backend Redis.
+    Todos os documentos levam o campo CAMPO_EXPIRACAO, apagado pela política de TTL do
+    Firestore; como o TTL não desce para as subcoleções, cada item tem o seu, renovado
+    junto com o da sessão quando passa da metade do prazo.
+    """
+
+    limite_bytes_item = LIMITE_BYTES_ITEM_FIRESTORE
+
+    def __init__(self, db):
+        from google.cloud import firestore
+        self._db = db
+        self._firestore = firestore
+
+    def _sessao(self, sessao_id):
+        return self._db.collection(SESSION_COLLECTION).document(sessao_id)
+
+    def _itens(self, sessao_id):
+        return self._sessao(sessao_id).collection("itens")
+
+    @staticmethod
+    def _versoes_validas(doc, agora):
+        # O TTL do Firestore pode levar horas para apagar um documento vencido
+        dados = (doc.to_dict() or {}) if doc.exists else {}
+        expira_em = dados.get(CAMPO_EXPIRACAO)
+        if expira_em is not None and expira_em <= agora:
+            return {}, None
+        return dict(dados.get("versoes") or {}), expira_em
+
+    def ler_versoes(self, sessao_id):
+        agora = datetime.datetime.now(datetime.timezone.utc)
+        return self._versoes_validas(self._sessao(sessao_id).get(), agora)[0]
+
+    def ler_dados(self, sessao_id, chaves):
+        itens = self._itens(sessao_id)
+        return {
+            doc.id: doc.get("dados")
+            for doc in self._db.get_all([itens.document(chave) for chave in chaves])
+            if doc.exists
+        }
+
+    def gravar(self, sessao_id, alteracoes):
+        sessao = self._sessao(sessao_id)
+        itens = self._itens(sessao_id)
+
+        @self._firestore.transactional
+        def _gravar_na_transacao(transacao):
+            agora = datetime.datetime.now(datetime.timezone.utc)
+            versoes, expira_em = self._versoes_validas(sessao.get(transaction=transacao), agora)
+            nova_expiracao = agora + datetime.timedelta(seconds=SEGUNDOS_EXPIRACAO_SESSAO)
+            renovar = expira_em is None or (expira_em - agora).total_seconds() < SEGUNDOS_EXPIRACAO_SESSAO / 2
+            conflitos = [c for c, (esperada, _) in alteracoes.items() if versoes.get(c, 0) != esperada]
+            if conflitos:
+                raise ConflitoDeVersao(conflitos)
+            novas_versoes = {}
+            for chave, (esperada, dados) in alteracoes.items():
+                if dados is None:
+                    transacao.delete(itens.document(chave))
+                    versoes.pop(chave, None)
+                    novas_versoes[chave] = 0
+                else:
+                    transacao.set(itens.document(chave), {"dados": dados, CAMPO_EXPIRACAO: nova_expiracao})
+                    versoes[chave] = novas_versoes[chave] = esperada + 1
+            if renovar:
+                for chave in versoes:
+                    if chave not in alteracoes:
+                        transacao.update(itens.document(chave), {CAMPO_EXPIRACAO: nova_expiracao})
+            else:
+                nova_expiracao = expira_em
+            transacao.set(sessao, {"versoes": versoes, CAMPO_EXPIRACAO: nova_expiracao})
+            return novas_versoes
+
+        return _gravar_na_transacao(self._db.transaction())
+
+    def apagar_sessao(self, sessao_id):
+        batch = self._db.batch()
+        for doc in self._itens(sessao_id).stream():
+            batch.delete(doc.reference)
+        batch.delete(self._sessao(sessao_id))
+        batch.commit()
+
+
+def criar_backend(db=None, tipo=BACKEND_ESTADO):
+    """Cria o backend de estado configurado em MMT_BACKEND_ESTADO."""
+    if tipo == "redis":
+        return BackendRedis()
+    if tipo == "firestore":
+        return BackendFirestore(db)
+    return BackendMemoria()
+
+
+# ==============================================================================
+# SINCRONIZAÇÃO COM O ST.SESSION_STATE
+# ==============================================================================
+
+def _serializar(valor):
+    dados = pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)
+    return dados, hashlib.sha1(dados).hexdigest()
+
+
+def obter_id_da_sessao():
+    """Lê o ID da sessão da URL, ou cria um novo e o coloca na URL."""
+    sessao_id = st.query_params.get(PARAMETRO_SESSAO)
+    if not sessao_id:
+        sessao_id = secrets.token_urlsafe(24)
+        st.query_params[PARAMETRO_SESSAO] = sessao_id
+    return sessao_id
+
+
+def _espaco_da_sessao():
+    """
+    Devolve (id no backend, chaves guardadas nele). O trabalho do usuário fica em um
+    espaço que combina o ID da URL com o uid confirmado pelo Firebase nesta instância:
+    quem abrir o link sem fazer login com a mesma conta não enxerga nada dele.
+    Antes do login só as chaves anônimas (ex: qual formulário está aberto) são guardadas.
+    """
+    sessao_id = obter_id_da_sessao()
+    uid = st.session_state.get("user_uid")
+    if uid:
+        return f"{sessao_id}.{uid}", CHAVES_DO_USUARIO
+    return sessao_id, CHAVES_ANONIMAS
+
+
+def _versoes():
+    if _CHAVE_VERSOES not in st.session_state:
+        st.session_state[_CHAVE_VERSOES] = {}
+    return st.session_state[_CHAVE_VERSOES]
+
+
+def _limpas():
+    if _CHAVE_LIMPAS not in st.session_state:
+        st.session_state[_CHAVE_LIMPAS] = {}
+    return st.session_state[_CHAVE_LIMPAS]
+
+
+def _esta_limpa(chave, valor):
+    """
+    Verificação barata, sem serializar: uma chave gerenciada não mudou se ainda é o mesmo
+    objeto da última gravação e ninguém a leu pelo obter_do_estado para alterá-la no lugar
+    desde então (leituras com somente_leitura=True não contam; ver memoria_sessao.alterado_em).
+    As demais chaves são pequenas e sempre passam pelo resumo.
+    """
+    if chave not in CHAVES_GERENCIADAS:
+        return False
+    limpa = _limpas().get(chave)
+    return limpa is not None and limpa[0] == id(valor) and alterado_em(chave) < limpa[1]
+
+
+def _esquecer_versao(chave):
+    """Um item perdido na camada de descarga volta do backend: sem versão local, o próximo carregar_estado o recarrega."""
+    _versoes().pop(chave, None)
+    _limpas().pop(chave, None)
+
+registrar_ao_perder_item(_esquecer_versao)
+
+
+def carregar_estado(backend):
+    """
+    Deve ser chamada no início de cada rerun, depois da verificação do login. Lê em lote
+    só as versões e busca os valores apenas das chaves cuja versão remota é mais nova que
+    a local, então uma sessão que continua na mesma instância não baixa nenhum valor.
+    """
+    sessao_id, chaves = _espaco_da_sessao()
+    versoes = _versoes()
+    nome_backend = type(backend).__name__
+    with telemetria.span("estado.leitura", backend=nome_backend):
+        remoto = backend.ler_versoes(sessao_id)
+
+    desatualizadas = [
+        chave for chave, versao in remoto.items()
+        if chave in chaves and versao > versoes.get(chave, (0, None))[0]
+    ]
+    if desatualizadas:
+        with telemetria.span("estado.leitura_dados", backend=nome_backend):
+            valores = backend.ler_dados(sessao_id, desatualizadas)
+        for chave, dados in valores.items():
+            st.session_state[chave] = pickle.loads(dados)
+            versoes[chave] = (remoto[chave], hashlib.sha1(dados).hexdigest())
+            _limpas().pop(chave, None)
+
+    # Chaves apagadas por outra instância (ex: logout em outra aba)
+    for chave in [c for c in chaves if versoes.get(c, (0, None))[0] and c not in remoto]:
+        versoes.pop(chave)
+        st.session_state.pop(chave, None)
+
+    # Itens perdidos na camada de descarga sem cópia no backend (ex: recusados por tamanho):
+    # sem o marcador, o app volta a inicializá-los como se nunca tivessem existido
+    for chave in chaves:
+        valor = st.session_state.get(chave)
+        if esta_descarregado(valor) and valor.referencia is None and chave not in remoto:
+            st.session_state.pop(chave)
+
+
+def persistir_estado(backend):
+    """
+    Deve ser chamada ao final de cada rerun. Grava somente as chaves que mudaram,
+    com a versão esperada, para que duas instâncias nunca sobrescrevam uma à outra sem saber.
+    Devolve as chaves recusadas por excederem o limite de tamanho do backend; as demais
+    são gravadas normalmente.
+    """
+    sessao_id, chaves = _espaco_da_sessao()
+    versoes, limpas = _versoes(), _limpas()
+    alteracoes, resumos, recusadas = {}, {}, []
+    agora = time.time()
+
+    for chave in chaves:
+        versao_local, resumo_local = versoes.get(chave, (0, None))
+        if chave not in st.session_state:
+            if versao_local:
+                alteracoes[chave] = (versao_local, None)
+            continue
+        valor = st.session_state[chave]
+        # Itens descarregados pelo memoria_sessao não mudaram desde que saíram da memória
+        if esta_descarregado(valor) or _esta_limpa(chave, valor):
+            continue
+        dados, resumo = _serializar(valor)
+        if resumo == resumo_local:
+            limpas[chave] = (id(valor), agora)
+            continue
+        if backend.limite_bytes_item and len(dados) > backend.limite_bytes_item:
+            # Um valor grande demais não pode impedir a gravação das outras chaves. A cópia
+            # remota continua na versão anterior; guardamos o resumo para não tentar (e
+            # avisar) de novo a cada rerun enquanto o valor não mudar.
+            print(f"Alerta: '{chave}' tem {len(dados)} bytes e excede o limite do backend de estado; não foi salvo.")
+            telemetria.incrementar("mmt_estado_chaves_recusadas_total", chave=chave)
+            versoes[chave] = (versao_local, resumo)
+            limpas[chave] = (id(valor), agora)
+            recusadas.append(chave)
+            continue
+        alteracoes[chave] = (versao_local, dados)
+        resumos[chave] = resumo
+
+    if not alteracoes:
+        return recusadas
+
+    try:
+        with telemetria.span("estado.escrita", backend=type(backend).__name__):
+            novas_versoes = backend.gravar(sessao_id, alteracoes)
+    except ConflitoDeVersao as e:
+        # Outra aba ganhou a corrida: esquecemos a versão local e o próximo rerun recarrega o valor dela.
+        print(f"Alerta: {e}. O estado será recarregado no próximo rerun.")
+        for chave in e.chaves:
+            versoes.pop(chave, None)
+            limpas.pop(chave, None)
+        return recusadas
+
+    for chave, versao in novas_versoes.items():
+        if versao:
+            versoes[chave] = (versao, resumos[chave])
+            limpas[chave] = (id(st.session_state[chave]), agora)
+        else:
+            versoes.pop(chave, None)
+            limpas.pop(chave, None)
+    return recusadas
+
+
+def esquecer_usuario():
+    """
+    Tira o usuário desta aba sem apagar o trabalho salvo (ex: falha ao validar o token):
+    o espaço remoto 'sid.uid' continua lá e volta quando a mesma conta fizer login de novo.
+    O trabalho também sai da memória local, para não vazar para outra conta nesta aba.
+    """
+    for chave in ("user_session", "user_is_authenticated", "user_uid", "user_email") + CHAVES_DO_USUARIO:
+        st.session_state.pop(chave, None)
+        _versoes().pop(chave, None)
+        _limpas().pop(chave, None)
+
+
+def limpar_sessao(backend):
+    """Apaga o estado local e o remoto da sessão (logout ou token expirado)."""
+    sessao_id = obter_id_da_sessao()
+    uid = st.session_state.get("user_uid")
+    try:
+        backend.apagar_sessao(sessao_id)
+        if uid:
+            backend.apagar_sessao(f"{sessao_id}.{uid}")
+    except Exception as e:
+        print(f"Alerta: Não foi possível apagar o estado remoto da sessão. Erro: {e}")
+    st.session_state.clear()
@@ -0,0 +1,202 @@
+import json
+import os
+import tomllib
+import threading
+import time
+from collections import defaultdict
+
+import dna_marca
+import resiliencia
+import telemetria
+from servico_llm import LLMFalso, invocar_llm, nome_do_modelo
+
+# ==============================================================================
+# NÚCLEO DAS FERRAMENTAS DE GERAÇÃO
+# ==============================================================================
+# Tudo o que a MaxMarketingApp (Streamlit) e a API headless precisam para gerar
+# conteúdo: prompts, cliente do LLM, Firebase e briefing da empresa.
+# Este módulo não importa o Streamlit, para poder rodar fora dele.
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+PROMPTS_PATH = os.path.join(PROJECT_ROOT, "prompts", "prompts.json")
+SECRETS_PATH = os.path.join(PROJECT_ROOT, ".streamlit", "secrets.toml")
+
+USER_COLLECTION = "users"
+COMPANY_COLLECTION = "companies"
+
+MODELO_PADRAO = "gemini-1.5-pro-latest"
+TEMPERATURA_PADRAO = 0.75
+# "gemini" em produção; "falso" para testes e benchmarks sem chamar a rede
+LLM_BACKEND = os.environ.get("MMT_LLM_BACKEND", "gemini")
+# Modelo usado quando o principal falha ou está com o disjuntor aberto ("" desliga a reserva)
+MODELO_RESERVA = os.environ.get("MMT_MODELO_RESERVA", "gemini-1.5-flash-latest")
+
+# Por quanto tempo o documento da empresa (com o DNA compilado) fica em memória
+SEGUNDOS_CACHE_EMPRESA = int(os.environ.get("MMT_SEGUNDOS_CACHE_EMPRESA", "300"))
+
+
+class FerramentaDesconhecida(KeyError):
+    """A ferramenta pedida não existe em 'ferramentas_marketing' no prompts.json."""
+
+
+def ler_prompts(caminho=PROMPTS_PATH):
+    """Lê o prompts.json sem depender do Streamlit."""
+    with open(caminho, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def carregar_secrets(caminho=SECRETS_PATH):
+    """Lê o mesmo secrets.toml do Streamlit fora dele; variáveis de ambiente têm prioridade."""
+    secrets = {}
+    if os.path.exists(caminho):
+        with open(caminho, "rb") as f:
+            secrets = tomllib.load(f)
+    if os.environ.get("GOOGLE_API_KEY"):
+        secrets["GOOGLE_API_KEY"] = os.environ["GOOGLE_API_KEY"]
+    return secrets
+
+
+def criar_llm(api_key, modelo=MODELO_PADRAO, temperatura=TEMPERATURA_PADRAO, backend=LLM_BACKEND):
+    """
+    Cria o cliente do LLM (Gemini em produção, LLMFalso em testes e benchmarks)
+    e registra o modelo de reserva usado pelo disjuntor do resiliencia.py.
+    """
+    if backend == "falso":
+        llm = LLMFalso()
+        # A reserva do LLM falso nunca recebe falhas injetadas
+        reserva = LLMFalso(prob_lenta=0, prob_falha=0, model="llm-falso-reserva")
+    else:
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        # O mesmo timeout do resiliencia.py: uma chamada abandonada por ele não segura a thread por mais tempo
+        llm = ChatGoogleGenerativeAI(
+            model=modelo, google_api_key=api_key, temperature=temperatura, timeout=resiliencia.TIMEOUT_SEGUNDOS,
+        )
+        reserva = None
+        if MODELO_RESERVA and MODELO_RESERVA != modelo:
+            reserva = ChatGoogleGenerativeAI(
+                model=MODELO_RESERVA, google_api_key=api_key, temperature=temperatura,
+                timeout=resiliencia.TIMEOUT_SEGUNDOS,
+            )
+    if reserva is not None:
+        resiliencia.registrar_reserva(nome_do_modelo(llm), reserva)
+    return llm
+
+
+def inicializar_firebase_admin(service_account_creds):
+    """Inicializa o Firebase Admin SDK uma única vez e devolve o cliente do Firestore."""
+    import firebase_admin
+    from firebase_admin import credentials, firestore as firebase_admin_firestore
+    # A verificação "if not firebase_admin._apps" impede a reinicialização do app.
+    if not firebase_admin._apps:
+        cred = credentials.Certificate(dict(service_account_creds))
+        firebase_admin.initialize_app(cred)
+    return firebase_admin_firestore.client()
+
+
+_cache_empresas = {}
+_cache_empresas_lock = threading.Lock()
+
+def buscar_dados_empresa(db, user_uid):
+    """
+    Busca o briefing estratégico salvo pelo usuário (vazio se ainda não existir).
+    O documento fica alguns minutos em memória, para não ler o Firestore a cada geração.
+    """
+    if not db or not user_uid:
+        return {}
+    with _cache_empresas_lock:
+        guardado = _cache_empresas.get(user_uid)
+    if guardado and time.monotonic() - guardado[0] < SEGUNDOS_CACHE_EMPRESA:
+        return guardado[1]
+    with telemetria.span("firestore.leitura", colecao=COMPANY_COLLECTION):
+        doc = db.collection(COMPANY_COLLECTION).document(user_uid).get()
+    dados = doc.to_dict() if doc.exists else {}
+    with _cache_empresas_lock:
+        _cache_empresas[user_uid] = (time.monotonic(), dados)
+    return dados
+
+
+def invalidar_dados_empresa(user_uid):
+    """Descarta o briefing em memória (chamada quando o usuário salva um novo briefing)."""
+    with _cache_empresas_lock:
+        _cache_empresas.pop(user_uid, None)
+
+
+def system_prompt(prompts):
+    """Persona central do Max, que abre o prompt de todas as ferramentas."""
+    return prompts.get("persona_central", {}).get("system_prompt", "")
+
+
+def manual_das_ferramentas(prompts):
+    """
+    Instruções e formatos de saída de todas as ferramentas e do refinamento, na ordem do
+    prompts.json. Vai para o cache de prefixo junto com o DNA da marca.
+    """
+    blocos = [
+        f"### {nome} ({config['nome_ferramenta']})\n{config['descricao_curta']}\n"
+        f"Instrução: {config['instrucao_llm']}\nFormato de saída:\n{config['formato_saida']}"
+        for nome, config in prompts.get("ferramentas_marketing", {}).items()
+    ]
+    refinamento = prompts.get("refinamento", {})
+    if refinamento:
+        blocos.append(
+            f"### refinamento\nConteúdo completo: {refinamento.get('instrucao_completa', '')}\n"
+            f"Uma seção: {refinamento.get('instrucao_secao', '')}"
+        )
+    return "\n\n".join(blocos)
+
+
+def montar_corpo(prompts, ferramenta, campos, instrucoes_no_prefixo=False):
+    """
+    Preenche o template da ferramenta (instrução, formato de saída e contexto do usuário).
+    Campos não informados viram 'Não informado'. Com 'instrucoes_no_prefixo', a instrução
+    e o formato já estão no manual em cache e o corpo só aponta para eles.
+    """
+    config = prompts.get("ferramentas_marketing", {}).get(ferramenta)
+    if not config:
+        raise FerramentaDesconhecida(ferramenta)
+
+    valores = defaultdict(lambda: "Não informado", {k: v for k, v in campos.items() if v not in (None, "")})
+    if instrucoes_no_prefixo:
+        valores.update({
+            "instrucao_llm": f"Siga a instrução da ferramenta '{ferramenta}' do MANUAL DAS FERRAMENTAS.",
+            "formato_saida": f"O formato de saída da ferramenta '{ferramenta}' do MANUAL DAS FERRAMENTAS.",
+        })
+    else:
+        valores.update({"instrucao_llm": config["instrucao_llm"], "formato_saida": config["formato_saida"]})
+    return config["prompt_template"].format_map(valores)
+
+
+def _preparar_prefixo(llm, prompts, dados_empresa, cache_prefixo):
+    """Devolve (llm_a_usar, DNA a colocar na frente do corpo, ou None se o prefixo está no cache)."""
+    dna = dna_marca.dna_da_empresa(dados_empresa, system_prompt(prompts))
+    if cache_prefixo is None:
+        return llm, dna["texto"]
+    prefixo = dna_marca.montar_prefixo(dna, manual_das_ferramentas(prompts))
+    llm_alvo, enviar_prefixo = cache_prefixo.preparar(llm, prefixo)
+    return llm_alvo, (dna["texto"] if enviar_prefixo else None)
+
+
+def preparar_chamada(llm, prompts, ferramenta, campos, dados_empresa=None, cache_prefixo=None):
+    """
+    Decide o que enviar ao LLM. Com um cache de prefixo, o DNA da marca e o manual das
+    ferramentas ficam no cache do provedor e o prompt leva só o contexto da ferramenta.
+    Devolve (llm_a_usar, prompt).
+    """
+    corpo = montar_corpo(prompts, ferramenta, campos)
+    llm_alvo, dna = _preparar_prefixo(llm, prompts, dados_empresa, cache_prefixo)
+    if dna is None:
+        return llm_alvo, montar_corpo(prompts, ferramenta, campos, instrucoes_no_prefixo=True)
+    return llm_alvo, f"{dna}\n\n{corpo}"
+
+
+def anexar_prefixo(llm, prompts, corpo, dados_empresa=None, cache_prefixo=None):
+    """Coloca o DNA da marca na frente de um corpo de prompt qualquer (ou no cache do provedor)."""
+    llm_alvo, dna = _preparar_prefixo(llm, prompts, dados_empresa, cache_prefixo)
+    return llm_alvo, (corpo if dna is None else f"{dna}\n\n{corpo}")
+
+
+def gerar_conteudo(llm, prompts, ferramenta, campos, dados_empresa=None, cache_prefixo=None,
+                   prioridade="interativa"):
+    """Monta o prompt da ferramenta e chama o LLM. Devolve o texto gerado."""
+    llm_alvo, prompt = preparar_chamada(llm, prompts, ferramenta, campos, dados_empresa, cache_prefixo)
+    return invocar_llm(llm_alvo, prompt, ferramenta, prioridade)
@@ -0,0 +1,357 @@
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import streamlit as st
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+import telemetria
+
+# --- INÍCIO DA CONFIGURAÇÃO DE MEMÓRIA POR SESSÃO ---
+# Todos os limites podem ser ajustados por variáveis de ambiente no Cloud Run,
+# sem precisar de um novo deploy do código.
+ORCAMENTO_BYTES_SESSAO = int(float(os.environ.get("MMT_ORCAMENTO_SESSAO_MB", "8")) * 1024 * 1024)
+LIMITE_BYTES_ITEM = int(float(os.environ.get("MMT_LIMITE_ITEM_MB", "1")) * 1024 * 1024)
+SEGUNDOS_ITEM_FRIO = int(os.environ.get("MMT_SEGUNDOS_ITEM_FRIO", "300"))
+SEGUNDOS_SESSAO_INATIVA = int(os.environ.get("MMT_SEGUNDOS_SESSAO_INATIVA", "3600"))
+# O Streamlit guarda uma sessão desconectada por alguns minutos para o caso de ela reconectar;
+# a descarga só é apagada depois de a sessão continuar encerrada por todo este intervalo.
+SEGUNDOS_CARENCIA_RECONEXAO = int(os.environ.get("MMT_SEGUNDOS_CARENCIA_RECONEXAO", "600"))
+SEGUNDOS_ENTRE_RELATORIOS = int(os.environ.get("MMT_SEGUNDOS_ENTRE_RELATORIOS", "60"))
+
+# Camada de descarga: disco local por padrão, ou um bucket do Cloud Storage se configurado.
+DIRETORIO_DESCARGA = os.environ.get("MMT_DIRETORIO_DESCARGA", os.path.join(tempfile.gettempdir(), "mmt_sessoes"))
+BUCKET_DESCARGA = os.environ.get("MMT_BUCKET_DESCARGA", "")
+
+# Apenas os resultados grandes das ferramentas são gerenciados. Dados de login e
+# flags de navegação são pequenos e precisam estar sempre à mão.
+CHAVES_GERENCIADAS = (
+    "catalogo_ofertas", "campanha_gerada", "post_gerado", "refinamento_post",
+    "media_plan_result", "geo_result", "ads_result",
+)
+_CHAVE_META = "_mmt_memoria_meta"
+# --- FIM DA CONFIGURAÇÃO DE MEMÓRIA POR SESSÃO ---
+
+
+class ItemDescarregado:
+    """Marcador guardado no st.session_state no lugar de um valor que foi enviado para a camada de descarga."""
+    __slots__ = ("referencia", "bytes")
+
+    def __init__(self, referencia, tamanho):
+        self.referencia = referencia
+        self.bytes = tamanho
+
+
+def esta_descarregado(valor):
+    """Indica se o valor é apenas o marcador de um item que está fora da memória."""
+    return isinstance(valor, ItemDescarregado)
+
+
+def medir_bytes(valor):
+    """Estima o tamanho em bytes de um valor pelo tamanho da sua serialização."""
+    try:
+        return len(pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(valor)
+
+
+# ==============================================================================
+# CAMADAS DE DESCARGA (DISCO LOCAL E CLOUD STORAGE)
+# ==============================================================================
+
+class _ArmazemDisco:
+    """Guarda os itens descarregados em arquivos locais, uma pasta por sessão."""
+
+    def salvar(self, sessao_id, chave, dados):
+        pasta = os.path.join(DIRETORIO_DESCARGA, sessao_id)
+        os.makedirs(pasta, exist_ok=True)
+        caminho = os.path.join(pasta, f"{chave}-{uuid.uuid4().hex}.pkl")
+        with open(caminho, "wb") as arquivo:
+            arquivo.write(dados)
+        return caminho
+
+    def carregar(self, referencia):
+        with open(referencia, "rb") as arquivo:
+            return arquivo.read()
+
+    def apagar(self, referencia):
+        try:
+            os.remove(referencia)
+        except OSError:
+            pass
+
+    def apagar_sessao(self, sessao_id):
+        shutil.rmtree(os.path.join(DIRETORIO_DESCARGA, sessao_id), ignore_errors=True)
+
+
+class _ArmazemBucket:
+    """Guarda os itens descarregados como blobs em um bucket do Cloud Storage."""
+
+    def __init__(self, nome_bucket):
+        from google.cloud import storage
+        self.bucket = storage.Client().bucket(nome_bucket)
+
+    def salvar(self, sessao_id, chave, dados):
+        nome_blob = f"sessoes/{sessao_id}/{chave}-{uuid.uuid4().hex}.pkl"
+        self.bucket.blob(nome_blob).upload_from_string(dados)
+        return nome_blob
+
+    def carregar(self, referencia):
+        return self.bucket.blob(referencia).download_as_bytes()
+
+    def apagar(self, referencia):
+        try:
+            self.bucket.blob(referencia).delete()
+        except Exception:
+            pass
+
+    def apagar_sessao(self, sessao_id):
+        for blob in self.bucket.list_blobs(prefix=f"sessoes/{sessao_id}/"):
+            self.apagar(blob.name)
+
+
+_armazem = None
+_armazem_lock = threading.Lock()
+
+def _obter_armazem():
+    """Cria a camada de descarga na primeira utilização (o cliente do Storage só é criado se for usado)."""
+    global _armazem
+    with _armazem_lock:
+        if _armazem is None:
+            _armazem = _ArmazemBucket(BUCKET_DESCARGA) if BUCKET_DESCARGA else _ArmazemDisco()
+        return _armazem
+
+
+# ==============================================================================
+# REGISTRO DE TOTAIS DA INSTÂNCIA
+# ==============================================================================
+
+class _RegistroInstancia:
+    """Acumula o consumo de memória de todas as sessões atendidas por este processo."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessoes = {}
+        self._ultimo_relatorio = 0.0
+
+    def atualizar(self, sessao_id, bytes_memoria, bytes_descarregados):
+        with self._lock:
+            self._sessoes[sessao_id] = {
+                "memoria": bytes_memoria,
+                "descarregado": bytes_descarregados,
+                "visto_em": time.time(),
+            }
+
+    def expirar_encerradas(self, sessao_ativa):
+        """
+        Remove as sessões que não aparecem há muito tempo E que o Streamlit já encerrou,
+        e devolve os seus IDs. Uma aba aberta e parada continua ativa e mantém a sua descarga.
+        """
+        agora = time.time()
+        limite = agora - SEGUNDOS_SESSAO_INATIVA
+        with self._lock:
+            candidatas = [sid for sid, dados in self._sessoes.items() if dados["visto_em"] < limite]
+        expiradas = []
+        for sid in candidatas:
+            ativa = sessao_ativa(sid)
+            with self._lock:
+                dados = self._sessoes.get(sid)
+                if dados is None:
+                    continue
+                if ativa:
+                    dados.pop("encerrada_em", None)
+                    continue
+                if agora - dados.setdefault("encerrada_em", agora) >= SEGUNDOS_CARENCIA_RECONEXAO:
+                    del self._sessoes[sid]
+                    expiradas.append(sid)
+        return expiradas
+
+    def totais(self):
+        with self._lock:
+            sessoes = list(self._sessoes.values())
+        return {
+            "sessoes_ativas": len(sessoes),
+            "bytes_memoria": sum(s["memoria"] for s in sessoes),
+            "bytes_descarregados": sum(s["descarregado"] for s in sessoes),
+            "maior_sessao_bytes": max((s["memoria"] for s in sessoes), default=0),
+        }
+
+    def deve_relatar(self):
+        with self._lock:
+            agora = time.time()
+            if agora - self._ultimo_relatorio < SEGUNDOS_ENTRE_RELATORIOS:
+                return False
+            self._ultimo_relatorio = agora
+            return True
+
+
+# O módulo é importado uma única vez por processo, então este registro é compartilhado
+# por todas as sessões da instância.
+_registro = _RegistroInstancia()
+
+
+def totais_da_instancia():
+    """Retorna os totais de memória desta instância, para dimensionar os contêineres."""
+    return _registro.totais()
+
+
+def _coletar_metricas():
+    """Expõe os totais da instância como medidores no endpoint de métricas."""
+    return [(f"mmt_memoria_{nome}", {}, valor) for nome, valor in totais_da_instancia().items()]
+
+telemetria.registrar_coletor(_coletar_metricas)
+
+
+# ==============================================================================
+# ACESSO AO ESTADO E APLICAÇÃO DO ORÇAMENTO
+# ==============================================================================
+
+def _id_da_sessao():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else "sem_sessao"
+
+
+def _sessao_ativa(sessao_id):
+    """Pergunta ao runtime do Streamlit se a sessão ainda está conectada (na dúvida, sim)."""
+    if not Runtime.exists():
+        return True
+    return Runtime.instance().is_active_session(sessao_id)
+
+
+# Funções chamadas com a chave de um item que não pôde ser recarregado da camada de descarga.
+# O estado_externo registra aqui a recuperação a partir do backend de estado.
+_ao_perder_item = []
+
+def registrar_ao_perder_item(funcao):
+    if funcao not in _ao_perder_item:
+        _ao_perder_item.append(funcao)
+
+
+def _meta():
+    if _CHAVE_META not in st.session_state:
+        st.session_state[_CHAVE_META] = {}
+    return st.session_state[_CHAVE_META]
+
+
+def alterado_em(chave):
+    """
+    Momento em que a chave pode ter sido alterada pela última vez: a última leitura pelo
+    obter_do_estado (que entrega o valor para ser alterado no lugar) ou o último
+    marcar_alterado (0 se nenhum dos dois aconteceu).
+    """
+    return _meta().get(chave, {}).get("alterado", 0)
+
+
+def marcar_alterado(chave):
+    """Avisa que um valor lido com somente_leitura=True foi alterado no lugar."""
+    _meta().setdefault(chave, {})["alterado"] = time.time()
+
+
+def obter_do_estado(chave, padrao=None, somente_leitura=False):
+    """
+    Lê um valor do st.session_state, recarregando-o da camada de descarga se ele
+    tiver sido retirado da memória. Deve ser usado no lugar de st.session_state[chave]
+    para todas as CHAVES_GERENCIADAS.
+    Com somente_leitura=True a leitura conta como uso (o item continua quente), mas não
+    como alteração: o valor não é medido nem serializado de novo ao final do rerun. Quem
+    alterar esse valor no lugar deve chamar marcar_alterado.
+    """
+    valor = st.session_state.get(chave, padrao)
+    if esta_descarregado(valor) and valor.referencia is None:
+        valor = padrao
+    elif esta_descarregado(valor):
+        armazem = _obter_armazem()
+        referencia = valor.referencia
+        try:
+            valor = pickle.loads(armazem.carregar(referencia))
+            armazem.apagar(referencia)
+            st.session_state[chave] = valor
+        except Exception as e:
+            print(f"Alerta: Não foi possível recarregar '{chave}' da camada de descarga. Erro: {e}")
+            # A chave NÃO é apagada: uma chave ausente faria o persistir_estado apagar a cópia
+            # intacta do backend de estado. O marcador fica sem referência (para não tentar de
+            # novo a cada leitura) e o backend devolve o valor no próximo carregar_estado.
+            st.session_state[chave] = ItemDescarregado(None, 0)
+            for funcao in _ao_perder_item:
+                funcao(chave)
+            valor = padrao
+    if chave in CHAVES_GERENCIADAS:
+        info = _meta().setdefault(chave, {})
+        info["acesso"] = time.time()
+        if not somente_leitura:
+            info["alterado"] = info["acesso"]
+    return valor
+
+
+def _descarregar(sessao_id, chave, valor):
+    """Serializa o valor, envia para a camada de descarga e deixa um marcador no lugar."""
+    dados = pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)
+    referencia = _obter_armazem().salvar(sessao_id, chave, dados)
+    st.session_state[chave] = ItemDescarregado(referencia, len(dados))
+    return len(dados)
+
+
+def aplicar_orcamento_de_memoria():
+    """
+    Mede a sessão atual e, se ela estourar o orçamento, descarrega os itens frios
+    e grandes primeiro. Deve ser chamada ao final de cada rerun.
+    """
+    sessao_id = _id_da_sessao()
+    meta = _meta()
+    agora = time.time()
+    bytes_memoria, bytes_descarregados = 0, 0
+    em_memoria = []
+
+    for chave in CHAVES_GERENCIADAS:
+        if chave not in st.session_state:
+            meta.pop(chave, None)
+            continue
+        valor = st.session_state[chave]
+        if esta_descarregado(valor):
+            bytes_descarregados += valor.bytes
+            continue
+
+        info = meta.setdefault(chave, {"acesso": agora})
+        # Só mede de novo o que mudou ou pode ter sido alterado desde a última medição.
+        if info.get("id") != id(valor) or info.get("alterado", 0) >= info.get("medido_em", 0):
+            info.update({"bytes": medir_bytes(valor), "id": id(valor), "medido_em": agora})
+        bytes_memoria += info["bytes"]
+        em_memoria.append(chave)
+
+    # Ordem de descarga: itens frios antes dos quentes, e os maiores primeiro.
+    def _prioridade(chave):
+        info = meta[chave]
+        frio = agora - info.get("acesso", agora) >= SEGUNDOS_ITEM_FRIO
+        return (not frio, -info["bytes"], info.get("acesso", agora))
+
+    for chave in sorted(em_memoria, key=_prioridade):
+        info = meta[chave]
+        frio_e_grande = agora - info.get("acesso", agora) >= SEGUNDOS_ITEM_FRIO and info["bytes"] >= LIMITE_BYTES_ITEM
+        if not frio_e_grande and bytes_memoria <= ORCAMENTO_BYTES_SESSAO:
+            break
+        try:
+            bytes_descarregados += _descarregar(sessao_id, chave, st.session_state[chave])
+            bytes_memoria -= info["bytes"]
+            for campo in ("id", "medido_em"):
+                info.pop(campo, None)
+        except Exception as e:
+            print(f"Alerta: Não foi possível descarregar '{chave}' da memória. Erro: {e}")
+
+    _registro.atualizar(sessao_id, bytes_memoria, bytes_descarregados)
+
+    if _registro.deve_relatar():
+        for sessao_expirada in _registro.expirar_encerradas(_sessao_ativa):
+            _obter_armazem().apagar_sessao(sessao_expirada)
+        totais = totais_da_instancia()
+        print(
+            f"[memoria] instancia: {totais['sessoes_ativas']} sessoes, "
+            f"{totais['bytes_memoria'] / 1024 / 1024:.1f} MB em memoria, "
+            f"{totais['bytes_descarregados'] / 1024 / 1024:.1f} MB descarregados, "
+            f"maior sessao {totais['maior_sessao_bytes'] / 1024 / 1024:.1f} MB"
+        )
@@ -0,0 +1,122 @@
+"""
+Pipeline de assets estáticos do MaxMarketing Total.
+
+Roda no build (veja o Dockerfile) e gera, a partir de 'assets/images', versões
+redimensionadas e otimizadas em WebP e PNG/JPEG com o hash do conteúdo no nome.
+Os arquivos vão para 'static/assets', que o servidor.py serve em '/estaticos/...' com
+cache de longa duração (no 'streamlit run' local, o Streamlit os serve em '/app/static/...',
+via server.enableStaticServing no .streamlit/config.toml). Um 'manifest.json' liga
+cada imagem original às suas variantes, e utils.get_static_url() consulta esse manifest.
+
+Uso:
+    python pipeline_assets.py
+"""
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import urllib.request
+
+from PIL import Image
+
+# --- INÍCIO DA CONFIGURAÇÃO DO PIPELINE ---
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+IMAGES_DIR = os.path.join(PROJECT_ROOT, "assets", "images")
+STATIC_DIR = os.path.join(PROJECT_ROOT, "static")
+SAIDA_DIR = os.path.join(STATIC_DIR, "assets")
+MANIFEST_PATH = os.path.join(SAIDA_DIR, "manifest.json")
+
+# Larguras usadas pelas páginas (logo na sidebar/login, logo na capa, fundo da capa),
+# mais as versões em dobro para telas de alta densidade.
+LARGURAS = (150, 200, 300, 400, 640, 1260, 1920)
+
+# O fundo da página de entrada era carregado direto do Pexels a cada acesso.
+# Agora ele é baixado uma vez no build e servido pelo nosso próprio contêiner.
+FUNDO_ENTRADA = "fundo_pagina_entrada.jpg"
+FUNDO_ENTRADA_ORIGEM = "https://images.pexels.com/photos/3184418/pexels-photo-3184418.jpeg?auto=compress&cs=tinysrgb&w=1920"
+
+EXTENSOES_SUPORTADAS = (".png", ".jpg", ".jpeg")
+# --- FIM DA CONFIGURAÇÃO DO PIPELINE ---
+
+
+def baixar_fundo_entrada():
+    """Baixa a imagem de fundo da capa para 'assets/images' se ela ainda não estiver lá."""
+    destino = os.path.join(IMAGES_DIR, FUNDO_ENTRADA)
+    if os.path.exists(destino):
+        return
+    try:
+        with urllib.request.urlopen(FUNDO_ENTRADA_ORIGEM, timeout=30) as resposta:
+            dados = resposta.read()
+        with open(destino, "wb") as arquivo:
+            arquivo.write(dados)
+        print(f"Fundo da página de entrada baixado para '{destino}'.")
+    except Exception as e:
+        print(f"Alerta: Não foi possível baixar o fundo da página de entrada. A capa usará a URL externa. Erro: {e}")
+
+
+def _codificar(imagem, formato):
+    """Codifica a imagem no formato pedido, com as opções de compressão de cada um."""
+    buffer = io.BytesIO()
+    if formato == "webp":
+        imagem.save(buffer, format="WEBP", quality=85, method=6)
+    elif formato == "png":
+        imagem.save(buffer, format="PNG", optimize=True)
+    else:
+        imagem.convert("RGB").save(buffer, format="JPEG", quality=85, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def processar_imagem(nome_arquivo):
+    """Gera todas as variantes de uma imagem e devolve a entrada dela no manifest."""
+    caminho = os.path.join(IMAGES_DIR, nome_arquivo)
+    nome_base, extensao = os.path.splitext(nome_arquivo)
+    # Imagens com transparência continuam em PNG; fotos ficam em JPEG.
+    formato_classico = "png" if extensao.lower() == ".png" else "jpg"
+
+    entrada = {}
+    with Image.open(caminho) as original:
+        original.load()
+        larguras = [l for l in LARGURAS if l < original.width] + [original.width]
+        for largura in sorted(set(larguras)):
+            altura = round(original.height * largura / original.width)
+            redimensionada = original.resize((largura, altura), Image.LANCZOS) if largura != original.width else original
+            variantes = {}
+            for formato in ("webp", formato_classico):
+                dados = _codificar(redimensionada, formato)
+                hash_conteudo = hashlib.sha256(dados).hexdigest()[:12]
+                nome_saida = f"{nome_base}.{hash_conteudo}.w{largura}.{formato}"
+                with open(os.path.join(SAIDA_DIR, nome_saida), "wb") as arquivo:
+                    arquivo.write(dados)
+                variantes[formato] = {"arquivo": f"assets/{nome_saida}", "hash": hash_conteudo, "bytes": len(dados)}
+            entrada[str(largura)] = variantes
+    return entrada
+
+
+def main():
+    baixar_fundo_entrada()
+
+    # Recria a pasta de saída do zero para não acumular variantes antigas
+    shutil.rmtree(SAIDA_DIR, ignore_errors=True)
+    os.makedirs(SAIDA_DIR, exist_ok=True)
+
+    manifest = {}
+    for nome_arquivo in sorted(os.listdir(IMAGES_DIR)):
+        if not nome_arquivo.lower().endswith(EXTENSOES_SUPORTADAS):
+            continue
+        try:
+            manifest[nome_arquivo] = processar_imagem(nome_arquivo)
+            print(f"Processado: {nome_arquivo} ({len(manifest[nome_arquivo])} larguras)")
+        except Exception as e:
+            print(f"Erro ao processar '{nome_arquivo}': {e}")
+            return 1
+
+    with open(MANIFEST_PATH, "w", encoding="utf-8") as arquivo:
+        json.dump(manifest, arquivo, indent=2, ensure_ascii=False)
+    print(f"Manifest gerado em '{MANIFEST_PATH}' com {len(manifest)} imagens.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
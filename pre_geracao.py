@@ -0,0 +1,217 @@
+import collections
+import datetime
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ferramentas
+import telemetria
+from servico_llm import chamadas_interativas_em_andamento
+
+# ==============================================================================
+# PRÉ-GERAÇÃO ESPECULATIVA DO KIT INICIAL
+# ==============================================================================
+# Assim que o briefing é salvo, um trabalhador em segundo plano gera um kit inicial
+# (alguns posts para o objetivo nº 1, um e-mail de boas-vindas e um plano de mídia
+# base). Quando o usuário abre uma ferramenta pela primeira vez, o conteúdo já está
+# pronto. Esse trabalho é especulativo e nunca disputa a cota do LLM com o usuário:
+#   - no máximo CHAMADAS_POR_MINUTO chamadas especulativas por processo;
+#   - cada chamada só começa quando não há nenhuma chamada interativa em andamento.
+
+# --- INÍCIO DA CONFIGURAÇÃO DA PRÉ-GERAÇÃO ---
+PREGERACAO_ATIVA = os.environ.get("MMT_PREGERACAO", "1") != "0"
+TRABALHADORES = int(os.environ.get("MMT_PREGERACAO_TRABALHADORES", "1"))
+CHAMADAS_POR_MINUTO = float(os.environ.get("MMT_PREGERACAO_CHAMADAS_POR_MINUTO", "6"))
+# Quanto tempo cada item espera por uma brecha no LLM antes de ser abandonado
+SEGUNDOS_ESPERA_MAXIMA = float(os.environ.get("MMT_PREGERACAO_ESPERA_MAXIMA", "120"))
+QUANTIDADE_POSTS = int(os.environ.get("MMT_PREGERACAO_POSTS", "3"))
+# Kits que ficam só em memória (sem Firestore, ou se a gravação falhou); os mais antigos saem primeiro
+MAX_PACOTES_EM_MEMORIA = int(os.environ.get("MMT_PREGERACAO_MAX_PACOTES", "200"))
+# --- FIM DA CONFIGURAÇÃO DA PRÉ-GERAÇÃO ---
+
+CAMPO_PACOTE = "pacote_inicial" # Campo do documento da empresa onde o kit fica guardado
+
+# Um ângulo diferente para cada post do kit, usando um campo do briefing como mensagem
+ANGULOS_POST = (
+    ("Apresentar a marca", "pitch"),
+    ("Mostrar o nosso diferencial", "diferencial"),
+    ("Resolver a principal dor do cliente", "dor_cliente"),
+)
+
+# Objetivo nº 1 do briefing -> opção equivalente do Planejador de Orçamento e Canais
+OBJETIVO_PARA_MIDIA = {
+    "Aumentar seguidores e engajamento": "Fortalecer a marca",
+    "Gerar mais leads (contatos)": "Gerar mais contatos (leads)",
+    "Aumentar as vendas diretas": "Aumentar as vendas online",
+    "Fortalecer a marca": "Fortalecer a marca",
+}
+ORCAMENTO_BASE = 500 # Mesmos valores iniciais do formulário do plano de mídia
+DURACAO_BASE = 15
+
+
+class _BaldeDeFichas:
+    """Limita a vazão das chamadas especulativas (token bucket simples)."""
+
+    def __init__(self, por_minuto):
+        self.capacidade = max(1.0, por_minuto)
+        self.por_segundo = por_minuto / 60
+        self.fichas = self.capacidade
+        self.atualizado_em = time.monotonic()
+        self._lock = threading.Lock()
+
+    def tentar_retirar(self):
+        with self._lock:
+            agora = time.monotonic()
+            self.fichas = min(self.capacidade, self.fichas + (agora - self.atualizado_em) * self.por_segundo)
+            self.atualizado_em = agora
+            if self.fichas < 1:
+                return False
+            self.fichas -= 1
+            return True
+
+
+_balde = _BaldeDeFichas(CHAMADAS_POR_MINUTO)
+_executor = ThreadPoolExecutor(max_workers=TRABALHADORES, thread_name_prefix="pregeracao")
+_lock = threading.Lock()
+# uid -> kit em construção ou ainda não gravado. Depois de gravado no Firestore, o kit sai daqui
+# e passa a vir do documento da empresa (ver obter_pacote).
+_pacotes = collections.OrderedDict()
+_agendados = {} # uid -> hash do DNA do kit que está na fila
+
+
+def _aguardar_vez():
+    """Espera o LLM ficar livre de chamadas interativas e haver ficha no balde."""
+    limite = time.monotonic() + SEGUNDOS_ESPERA_MAXIMA
+    while time.monotonic() < limite:
+        if chamadas_interativas_em_andamento() == 0 and _balde.tentar_retirar():
+            return True
+        time.sleep(0.5)
+    return False
+
+
+def itens_do_pacote(dados_empresa):
+    """
+    Lista (chave, ferramenta, campos) do kit inicial, na ordem em que são gerados:
+    primeiro o que o usuário provavelmente abre primeiro (o Criador de Posts).
+    """
+    objetivo = dados_empresa.get("objetivo_principal")
+    posts = [
+        ("posts", "criar_post_social", {
+            "objetivo": objetivo,
+            "publico": dados_empresa.get("cliente_ideal"),
+            "produto_servico": dados_empresa.get("produtos"),
+            "mensagem_chave": f"{angulo}: {dados_empresa.get(campo) or ''}".rstrip(": "),
+            "usp": dados_empresa.get("diferencial"),
+            "tom_estilo": dados_empresa.get("personalidade"),
+            "info_adicional": "Canal: Instagram Post de Feed (Imagem/Carrossel)",
+        })
+        for angulo, campo in ANGULOS_POST[:QUANTIDADE_POSTS]
+    ]
+    plano = ("plano_midia", "criar_plano_midia", {
+        "objetivo": OBJETIVO_PARA_MIDIA.get(objetivo, objetivo),
+        "orcamento": ORCAMENTO_BASE,
+        "duracao": DURACAO_BASE,
+    })
+    email = ("email_boas_vindas", "gerar_email_marketing", {
+        "objetivo_email": "Dar boas-vindas a novos contatos e apresentar a marca",
+        "segmento_publico": dados_empresa.get("cliente_ideal"),
+        "oferta": dados_empresa.get("produtos"),
+        "tom_voz": dados_empresa.get("personalidade"),
+        "remetente": dados_empresa.get("company_name"),
+    })
+    return posts[:1] + [plano, email] + posts[1:]
+
+
+def _hash_do_dna(dados_empresa):
+    return ((dados_empresa or {}).get("dna_marca") or {}).get("hash")
+
+
+def _gerar_pacote(llm, prompts, db, user_uid, dados_empresa, cache_prefixo):
+    hash_dna = _hash_do_dna(dados_empresa)
+    pacote = {"hash": hash_dna, "status": "gerando", "posts": []}
+    with _lock:
+        _pacotes[user_uid] = pacote
+        _pacotes.move_to_end(user_uid)
+        while len(_pacotes) > MAX_PACOTES_EM_MEMORIA:
+            _pacotes.popitem(last=False)
+
+    with telemetria.span("pregeracao.pacote") as extras:
+        for chave, ferramenta, campos in itens_do_pacote(dados_empresa):
+            with _lock:
+                if _agendados.get(user_uid) != hash_dna:
+                    # O briefing mudou de novo: este kit já nasceu velho
+                    telemetria.incrementar("mmt_pregeracao_itens_total", resultado="descartado")
+                    return
+            if not _aguardar_vez():
+                telemetria.incrementar("mmt_pregeracao_itens_total", resultado="adiado")
+                continue
+            try:
+                texto = ferramentas.gerar_conteudo(
+                    llm, prompts, ferramenta, campos, dados_empresa, cache_prefixo, prioridade="especulativa"
+                )
+            except Exception as e:
+                print(f"Alerta: Não foi possível pré-gerar '{ferramenta}'. Erro: {e}")
+                telemetria.incrementar("mmt_pregeracao_itens_total", resultado="erro")
+                continue
+            telemetria.incrementar("mmt_pregeracao_itens_total", resultado="gerado")
+            with _lock:
+                if chave == "posts":
+                    pacote["posts"] = pacote["posts"] + [texto]
+                else:
+                    pacote[chave] = texto
+
+        pacote.update({
+            "status": "pronto",
+            "gerado_em": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        })
+        extras.update({"posts": len(pacote["posts"])})
+
+    if db is not None:
+        with telemetria.span("firestore.escrita", colecao=ferramentas.COMPANY_COLLECTION):
+            db.collection(ferramentas.COMPANY_COLLECTION).document(user_uid).set({CAMPO_PACOTE: pacote}, merge=True)
+        ferramentas.invalidar_dados_empresa(user_uid)
+        with _lock:
+            if _pacotes.get(user_uid) is pacote:
+                del _pacotes[user_uid]
+
+
+def _executar(llm, prompts, db, user_uid, dados_empresa, cache_prefixo):
+    try:
+        _gerar_pacote(llm, prompts, db, user_uid, dados_empresa, cache_prefixo)
+    except Exception as e:
+        print(f"Alerta: A pré-geração do kit inicial falhou. Erro: {e}")
+    finally:
+        with _lock:
+            if _agendados.get(user_uid) == _hash_do_dna(dados_empresa):
+                del _agendados[user_uid]
+
+
+def agendar_pacote_inicial(llm, prompts, db, user_uid, dados_empresa, cache_prefixo=None):
+    """
+    Coloca a geração do kit inicial na fila do trabalhador em segundo plano.
+    'dados_empresa' é o briefing recém-salvo, já com o 'dna_marca' compilado.
+    Devolve False se a pré-geração estiver desligada ou o mesmo kit já estiver na fila.
+    """
+    if not PREGERACAO_ATIVA or not user_uid:
+        return False
+    hash_dna = _hash_do_dna(dados_empresa)
+    with _lock:
+        if _agendados.get(user_uid) == hash_dna:
+            return False
+        _agendados[user_uid] = hash_dna
+    _executor.submit(_executar, llm, prompts, db, user_uid, dict(dados_empresa), cache_prefixo)
+    return True
+
+
+def obter_pacote(dados_empresa, user_uid):
+    """
+    Devolve o kit inicial do usuário (pode estar incompleto enquanto é gerado),
+    ou {} se não houver um kit para o briefing atual.
+    """
+    hash_dna = _hash_do_dna(dados_empresa)
+    with _lock:
+        pacote = _pacotes.get(user_uid)
+    if not pacote or pacote.get("hash") != hash_dna:
+        pacote = (dados_empresa or {}).get(CAMPO_PACOTE) or {}
+    return pacote if pacote.get("hash") == hash_dna else {}
@@ -0,0 +1,162 @@
+import re
+
+from ferramentas import anexar_prefixo
+from servico_llm import invocar_llm
+
+# ==============================================================================
+# SESSÕES DE REFINAMENTO COM CONTEXTO COMPACTADO
+# ==============================================================================
+# Cada conteúdo gerado ganha uma conversa de refinamento. Em vez de reenviar o
+# briefing e todas as versões anteriores a cada ajuste, o prompt leva apenas:
+#   - o DNA da marca (prefixo em cache, igual em todas as rodadas);
+#   - um resumo curto e de tamanho limitado dos ajustes já feitos;
+#   - o rascunho ATUAL (ou só a seção que está sendo ajustada).
+# Assim o custo de cada rodada fica estável, em vez de crescer a cada pedido.
+
+MAX_AJUSTES_NO_RESUMO = 5
+MAX_CARACTERES_AJUSTE = 80
+
+# Palavras do pedido que indicam que só uma seção precisa ser refeita.
+# A chave é procurada (sem acentos/maiúsculas) no título das seções do rascunho.
+# Tanto as palavras quanto a chave só valem como palavras inteiras (ou no plural):
+# "compacta" não é "cta" e "subtítulo" não é "título".
+PALAVRAS_SECAO = {
+    "hashtag": ("hashtag",),
+    "titulo": ("título", "titulo", "headline", "manchete"),
+    "chamada": ("cta", "chamada para ação", "chamada para acao", "call to action"),
+    "imagem": ("imagem", "imagens", "foto", "vídeo", "video", "visual"),
+    "assunto": ("assunto", "subject"),
+    "pre-cabecalho": ("preheader", "pré-cabeçalho", "pre-cabecalho"),
+}
+
+_TITULO_SECAO = re.compile(r"^\s*(?:(?P<numero>\d+\.)\s*)?\*\*(?P<titulo>[^*]+?):\*\*\s*(?P<resto>.*)$")
+
+
+def _normalizar(texto):
+    trocas = str.maketrans("áàâãéêíóôõúç", "aaaaeeiooouc")
+    return texto.casefold().translate(trocas)
+
+
+def _padrao_palavra(palavra):
+    """Regex da palavra (já normalizada) inteira, aceitando o plural com 's'."""
+    return re.compile(rf"(?<![\w-]){re.escape(_normalizar(palavra))}s?(?![\w-])")
+
+
+_PADROES_PEDIDO = {chave: [_padrao_palavra(p) for p in palavras] for chave, palavras in PALAVRAS_SECAO.items()}
+_PADROES_TITULO = {chave: _padrao_palavra(chave) for chave in PALAVRAS_SECAO}
+
+
+def dividir_em_secoes(texto):
+    """
+    Separa o conteúdo gerado nas seções do 'formato_saida' (linhas como '1. **Título Impactante:** ...').
+    Devolve uma lista de [titulo, conteudo, numero]; 'numero' é a numeração original da seção
+    ('1.', ou '' se não houver) e o texto antes da primeira seção fica com título vazio.
+    """
+    secoes = [["", [], ""]]
+    for linha in texto.strip().splitlines():
+        achou = _TITULO_SECAO.match(linha)
+        if achou:
+            secoes.append([
+                achou.group("titulo").strip(),
+                [achou.group("resto")] if achou.group("resto") else [],
+                achou.group("numero") or "",
+            ])
+        else:
+            secoes[-1][1].append(linha)
+    return [
+        [titulo, "\n".join(linhas).strip(), numero]
+        for titulo, linhas, numero in secoes if titulo or "".join(linhas).strip()
+    ]
+
+
+def juntar_secoes(secoes):
+    """Faz o caminho inverso do dividir_em_secoes, devolvendo a numeração de cada seção."""
+    blocos = []
+    # Sessões gravadas antes da numeração ser guardada têm só [titulo, conteudo]
+    for titulo, conteudo, *numero in secoes:
+        numero = f"{numero[0]} " if numero and numero[0] else ""
+        if not titulo:
+            blocos.append(conteudo)
+        elif "\n" in conteudo:
+            blocos.append(f"{numero}**{titulo}:**\n{conteudo}")
+        else:
+            blocos.append(f"{numero}**{titulo}:** {conteudo}")
+    return "\n\n".join(blocos)
+
+
+class SessaoRefinamento:
+    """Conversa de refinamento de um conteúdo gerado (post, email, anúncio...)."""
+
+    def __init__(self, ferramenta, texto_inicial):
+        self.ferramenta = ferramenta
+        self.secoes = dividir_em_secoes(texto_inicial)
+        self.ajustes = []        # resumo dos pedidos mais recentes
+        self.ajustes_antigos = 0 # quantos pedidos já saíram do resumo
+        self.rodadas = 0
+
+    @property
+    def rascunho(self):
+        return juntar_secoes(self.secoes)
+
+    def secao_alvo(self, pedido):
+        """Índice da seção que o pedido menciona, ou None se o ajuste vale para o conteúdo todo."""
+        pedido_normalizado = _normalizar(pedido)
+        for chave, padroes in _PADROES_PEDIDO.items():
+            if not any(padrao.search(pedido_normalizado) for padrao in padroes):
+                continue
+            for indice, (titulo, *_) in enumerate(self.secoes):
+                if _PADROES_TITULO[chave].search(_normalizar(titulo)):
+                    return indice
+        return None
+
+    def resumo(self):
+        """Resumo compacto dos ajustes anteriores (tamanho limitado, não cresce com as rodadas)."""
+        linhas = []
+        if self.ajustes_antigos:
+            linhas.append(f"- ({self.ajustes_antigos} ajustes anteriores já aplicados ao rascunho)")
+        linhas.extend(f"- {ajuste}" for ajuste in self.ajustes)
+        return "\n".join(linhas) or "- Nenhum ajuste ainda."
+
+    def montar_corpo(self, prompts, pedido, indice_secao):
+        config = prompts["refinamento"]
+        if indice_secao is None:
+            instrucao, rotulo, rascunho = config["instrucao_completa"], "Rascunho atual", self.rascunho
+        else:
+            titulo, conteudo = self.secoes[indice_secao][:2]
+            instrucao, rotulo, rascunho = config["instrucao_secao"], f"Seção atual '{titulo}'", conteudo
+        return config["prompt_template"].format(
+            instrucao=instrucao, resumo=self.resumo(), rotulo_rascunho=rotulo, rascunho=rascunho, pedido=pedido
+        )
+
+    def registrar_ajuste(self, pedido, indice_secao):
+        """Compacta o histórico: guarda só os últimos pedidos, cada um encurtado."""
+        ajuste = pedido.strip().replace("\n", " ")
+        if len(ajuste) > MAX_CARACTERES_AJUSTE:
+            ajuste = ajuste[:MAX_CARACTERES_AJUSTE].rsplit(" ", 1)[0] + "…"
+        if indice_secao is not None:
+            ajuste = f"[{self.secoes[indice_secao][0]}] {ajuste}"
+        self.ajustes.append(ajuste)
+        if len(self.ajustes) > MAX_AJUSTES_NO_RESUMO:
+            self.ajustes.pop(0)
+            self.ajustes_antigos += 1
+        self.rodadas += 1
+
+    def refinar(self, llm, prompts, pedido, dados_empresa=None, cache_prefixo=None):
+        """Executa uma rodada de refinamento e devolve o novo rascunho completo."""
+        indice_secao = self.secao_alvo(pedido)
+        corpo = self.montar_corpo(prompts, pedido, indice_secao)
+        llm_alvo, prompt = anexar_prefixo(llm, prompts, corpo, dados_empresa, cache_prefixo)
+        resposta = invocar_llm(llm_alvo, prompt, f"refinar_{self.ferramenta}").strip()
+
+        if indice_secao is None:
+            self.secoes = dividir_em_secoes(resposta)
+        else:
+            titulo, numero = self.secoes[indice_secao][0], self.secoes[indice_secao][2:]
+            # O modelo às vezes repete o título da seção; nesse caso ficamos só com o conteúdo
+            achou = _TITULO_SECAO.match(resposta.splitlines()[0]) if resposta else None
+            if achou and _normalizar(achou.group("titulo")) == _normalizar(titulo):
+                resposta = "\n".join([achou.group("resto")] + resposta.splitlines()[1:]).strip()
+            self.secoes[indice_secao] = [titulo, resposta, *numero]
+
+        self.registrar_ajuste(pedido, indice_secao)
+        return self.rascunho
@@ -0,0 +1,544 @@
+"""
+Camada de latência de cauda das chamadas ao LLM: hedging, disjuntor e alternativas.
+
+    - Hedging: se uma chamada passa do p95 observado para a ferramenta, uma cópia é
+      enviada e vale a primeira resposta que chegar.
+    - Disjuntor por modelo: depois de várias falhas seguidas o modelo fica "aberto" por
+      um tempo e as chamadas vão direto para o modelo de reserva.
+    - Último resultado bom: se nem o modelo nem a reserva responderem, um prompt idêntico
+      já respondido antes devolve a última resposta boa.
+    - As latências por ferramenta (que definem o limiar do hedging) são acompanhadas ao vivo
+      e exportadas no /metrics.
+
+Uso (simulação com o LLM falso, injetando respostas lentas e falhas):
+    python resiliencia.py simular --chamadas 1000 --prob-lenta 0.02
+"""
+import argparse
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import telemetria
+
+# --- INÍCIO DA CONFIGURAÇÃO DE RESILIÊNCIA ---
+RESILIENCIA_ATIVA = os.environ.get("MMT_RESILIENCIA_LLM", "1") != "0"
+TIMEOUT_SEGUNDOS = float(os.environ.get("MMT_LLM_TIMEOUT", "60"))
+# Hedging: percentil da ferramenta que dispara a cópia, e só depois de um mínimo de amostras
+PERCENTIL_HEDGE = float(os.environ.get("MMT_HEDGE_PERCENTIL", "0.95"))
+MIN_AMOSTRAS_HEDGE = int(os.environ.get("MMT_HEDGE_MIN_AMOSTRAS", "20"))
+JANELA_LATENCIAS = int(os.environ.get("MMT_HEDGE_JANELA", "500"))
+# No máximo esta fração das chamadas recentes pode ganhar uma cópia (evita dobrar a conta numa lentidão geral)
+MAX_FRACAO_HEDGE = float(os.environ.get("MMT_HEDGE_MAX_FRACAO", "0.1"))
+# Disjuntor: falhas seguidas para abrir e quanto tempo fica aberto antes de testar de novo
+FALHAS_PARA_ABRIR = int(os.environ.get("MMT_DISJUNTOR_FALHAS", "5"))
+SEGUNDOS_ABERTO = float(os.environ.get("MMT_DISJUNTOR_SEGUNDOS_ABERTO", "30"))
+MAX_ULTIMOS_BONS = int(os.environ.get("MMT_LLM_MAX_ULTIMOS_BONS", "500"))
+# Teto de chamadas síncronas simultâneas a cada modelo por processo (cópias do hedging incluídas).
+# Cada modelo tem o seu pool: se o principal travar e segurar todas as threads até o timeout,
+# a reserva continua tendo onde rodar. Acima do teto as chamadas esperam na fila do pool do
+# modelo; o tempo na fila não conta para o hedging.
+TRABALHADORES = int(os.environ.get("MMT_LLM_TRABALHADORES", "32"))
+# --- FIM DA CONFIGURAÇÃO DE RESILIÊNCIA ---
+
+
+class LLMIndisponivel(RuntimeError):
+    """Nem o modelo, nem a reserva, nem um resultado anterior puderam atender a chamada."""
+
+
+class _RespostaGuardada:
+    """Resposta reaproveitada (último resultado bom): sem tokens, porque não houve chamada."""
+
+    def __init__(self, content):
+        self.content = content
+        self.usage_metadata = {}
+
+
+# ==============================================================================
+# LATÊNCIAS AO VIVO
+# ==============================================================================
+
+class RastreadorDeLatencias:
+    """
+    Guarda as últimas durações de cada ferramenta e calcula os percentis ao vivo.
+    O limiar do hedging é recalculado a cada RECALCULAR_A_CADA amostras novas, para não
+    ordenar a janela inteira em toda chamada.
+    """
+
+    RECALCULAR_A_CADA = 10
+
+    def __init__(self, janela=JANELA_LATENCIAS):
+        self._janela = janela
+        self._lock = threading.Lock()
+        self._amostras = {}
+        self._limiares = {} # ferramenta -> (amostras novas desde o cálculo, limiar)
+
+    def observar(self, ferramenta, segundos):
+        with self._lock:
+            amostras = self._amostras.get(ferramenta)
+            if amostras is None:
+                amostras = self._amostras[ferramenta] = collections.deque(maxlen=self._janela)
+            amostras.append(segundos)
+            novas, limiar = self._limiares.get(ferramenta, (0, None))
+            self._limiares[ferramenta] = (novas + 1, limiar)
+
+    def percentil(self, ferramenta, p):
+        """Percentil p (0 a 1) das latências recentes, ou None se ainda houver poucas amostras."""
+        with self._lock:
+            amostras = sorted(self._amostras.get(ferramenta, ()))
+        if len(amostras) < MIN_AMOSTRAS_HEDGE:
+            return None
+        return amostras[min(len(amostras) - 1, int(len(amostras) * p))]
+
+    def limiar_hedge(self, ferramenta):
+        """Percentil PERCENTIL_HEDGE da ferramenta (None enquanto houver poucas amostras)."""
+        with self._lock:
+            novas, limiar = self._limiares.get(ferramenta, (0, None))
+        if limiar is None or novas >= self.RECALCULAR_A_CADA:
+            limiar = self.percentil(ferramenta, PERCENTIL_HEDGE)
+            with self._lock:
+                self._limiares[ferramenta] = (0, limiar)
+        return limiar
+
+    def ferramentas(self):
+        with self._lock:
+            return list(self._amostras)
+
+
+class _OrcamentoHedge:
+    """Limita as cópias a MAX_FRACAO_HEDGE das chamadas recentes."""
+
+    def __init__(self, janela=200):
+        self._lock = threading.Lock()
+        self._chamadas = collections.deque(maxlen=janela) # 1 = a chamada ganhou uma cópia
+
+    def permite(self):
+        with self._lock:
+            return sum(self._chamadas) < MAX_FRACAO_HEDGE * len(self._chamadas)
+
+    def registrar(self, com_copia):
+        with self._lock:
+            self._chamadas.append(1 if com_copia else 0)
+
+
+latencias = RastreadorDeLatencias()
+_orcamento_hedge = _OrcamentoHedge()
+
+
+# ==============================================================================
+# DISJUNTOR POR MODELO
+# ==============================================================================
+
+class Disjuntor:
+    """
+    Disjuntor clássico: "fechado" deixa tudo passar; depois de FALHAS_PARA_ABRIR falhas
+    seguidas fica "aberto" e recusa chamadas por SEGUNDOS_ABERTO; então passa a
+    "meio_aberto" e deixa uma única chamada de teste decidir se fecha ou abre de novo.
+    """
+
+    FECHADO, MEIO_ABERTO, ABERTO = "fechado", "meio_aberto", "aberto"
+
+    def __init__(self, modelo, falhas_para_abrir=FALHAS_PARA_ABRIR, segundos_aberto=SEGUNDOS_ABERTO):
+        self.modelo = modelo
+        self.falhas_para_abrir = falhas_para_abrir
+        self.segundos_aberto = segundos_aberto
+        self.estado = self.FECHADO
+        self.falhas_seguidas = 0
+        self._aberto_ate = 0.0
+        self._teste_em_andamento = False
+        self._lock = threading.Lock()
+
+    def _mudar(self, estado):
+        self.estado = estado
+        telemetria.incrementar("mmt_llm_disjuntor_transicoes_total", modelo=self.modelo, estado=estado)
+        print(f"Alerta: Disjuntor do modelo '{self.modelo}' agora está {estado}.")
+
+    def permite(self):
+        with self._lock:
+            if self.estado == self.ABERTO and time.monotonic() >= self._aberto_ate:
+                self._mudar(self.MEIO_ABERTO)
+                self._teste_em_andamento = False
+            if self.estado == self.FECHADO:
+                return True
+            if self.estado == self.MEIO_ABERTO and not self._teste_em_andamento:
+                self._teste_em_andamento = True
+                return True
+            return False
+
+    def sucesso(self):
+        with self._lock:
+            self.falhas_seguidas = 0
+            self._teste_em_andamento = False
+            if self.estado != self.FECHADO:
+                self._mudar(self.FECHADO)
+
+    def falha(self):
+        with self._lock:
+            self.falhas_seguidas += 1
+            self._teste_em_andamento = False
+            if self.estado == self.MEIO_ABERTO or (
+                self.estado == self.FECHADO and self.falhas_seguidas >= self.falhas_para_abrir
+            ):
+                self._aberto_ate = time.monotonic() + self.segundos_aberto
+                self._mudar(self.ABERTO)
+
+    def liberar(self):
+        """
+        A chamada terminou sem resultado (cancelada, cliente desconectado): não conta como
+        sucesso nem como falha, mas devolve a vaga de teste do meio_aberto para a próxima.
+        """
+        with self._lock:
+            self._teste_em_andamento = False
+
+
+_disjuntores = {}
+_reservas = {}      # nome do modelo -> cliente do modelo de reserva
+_ultimos_bons = collections.OrderedDict()
+_registros_lock = threading.Lock()
+
+
+def disjuntor(modelo):
+    with _registros_lock:
+        if modelo not in _disjuntores:
+            _disjuntores[modelo] = Disjuntor(modelo)
+        return _disjuntores[modelo]
+
+
+def registrar_reserva(modelo, llm_reserva):
+    """Define o modelo usado quando o disjuntor de 'modelo' estiver aberto ou a chamada falhar."""
+    with _registros_lock:
+        _reservas[modelo] = llm_reserva
+
+
+def _candidatos(llm, modelo):
+    """O próprio modelo e, se houver, a reserva (mantendo o prefixo em cache, quando o cliente souber trocar)."""
+    yield llm, modelo, "principal"
+    with _registros_lock:
+        reserva = _reservas.get(modelo)
+    if reserva is not None and reserva is not llm:
+        if hasattr(llm, "com_cliente"):
+            reserva = llm.com_cliente(reserva)
+        yield reserva, getattr(reserva, "model", None) or type(reserva).__name__, "modelo_reserva"
+
+
+def _guardar_ultimo_bom(chave, conteudo):
+    with _registros_lock:
+        _ultimos_bons[chave] = conteudo
+        _ultimos_bons.move_to_end(chave)
+        while len(_ultimos_bons) > MAX_ULTIMOS_BONS:
+            _ultimos_bons.popitem(last=False)
+
+
+def _ultimo_bom_ou_erro(chave, modelo, erro):
+    with _registros_lock:
+        conteudo = _ultimos_bons.get(chave)
+    if conteudo is not None:
+        telemetria.incrementar("mmt_llm_alternativas_total", modelo=modelo, destino="ultimo_bom")
+        return _RespostaGuardada(conteudo)
+    telemetria.incrementar("mmt_llm_alternativas_total", modelo=modelo, destino="sem_alternativa")
+    raise LLMIndisponivel(
+        f"O Max está com instabilidade para gerar conteúdo agora. Tente novamente em instantes. (Detalhe: {erro})"
+    ) from erro
+
+
+def _coletar_metricas():
+    medidores = []
+    for ferramenta in latencias.ferramentas():
+        p95 = latencias.percentil(ferramenta, PERCENTIL_HEDGE)
+        if p95 is not None:
+            medidores.append(("mmt_llm_latencia_p95_segundos", {"ferramenta": ferramenta}, p95))
+    valores = {Disjuntor.FECHADO: 0, Disjuntor.MEIO_ABERTO: 1, Disjuntor.ABERTO: 2}
+    with _registros_lock:
+        disjuntores = list(_disjuntores.values())
+    medidores.extend(("mmt_llm_disjuntor_estado", {"modelo": d.modelo}, valores[d.estado]) for d in disjuntores)
+    return medidores
+
+telemetria.registrar_coletor(_coletar_metricas)
+
+
+# ==============================================================================
+# CHAMADA SÍNCRONA (APP STREAMLIT)
+# ==============================================================================
+
+_executores = {} # modelo -> pool de threads das chamadas síncronas a ele
+_executores_lock = threading.Lock()
+
+
+def _executor(modelo):
+    with _executores_lock:
+        executor = _executores.get(modelo)
+        if executor is None:
+            executor = _executores[modelo] = ThreadPoolExecutor(max_workers=TRABALHADORES, thread_name_prefix="llm")
+        return executor
+
+
+def _tentativa(llm, prompt, ferramenta, medir, comecou=None):
+    if comecou is not None:
+        comecou.set()
+    inicio = time.perf_counter()
+    resposta = llm.invoke(prompt)
+    # A cópia perdedora também entra na distribuição: ela mostra a latência real do modelo
+    if medir:
+        latencias.observar(ferramenta, time.perf_counter() - inicio)
+    return resposta
+
+
+def _invocar_com_hedge(llm, prompt, ferramenta, modelo, hedge=True):
+    executor = _executor(modelo)
+    limiar = latencias.limiar_hedge(ferramenta) if hedge else None
+    comecou = threading.Event()
+    tentativas = [executor.submit(_tentativa, llm, prompt, ferramenta, hedge, comecou)]
+    prazo = time.monotonic() + TIMEOUT_SEGUNDOS
+
+    if limiar is not None:
+        # O limiar conta a partir de quando a chamada sai da fila do pool e começa de verdade,
+        # senão um pool cheio dispararia cópias (que também iriam para a fila) à toa
+        comecou.wait(timeout=max(0.0, prazo - time.monotonic()))
+        feitas, _ = wait(tentativas, timeout=limiar)
+        if not feitas and _orcamento_hedge.permite():
+            tentativas.append(executor.submit(_tentativa, llm, prompt, ferramenta, True))
+            telemetria.incrementar("mmt_llm_hedges_total", ferramenta=ferramenta, resultado="disparado")
+    _orcamento_hedge.registrar(len(tentativas) > 1)
+
+    pendentes, erro = set(tentativas), None
+    while pendentes:
+        feitas, pendentes = wait(pendentes, timeout=max(0.0, prazo - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not feitas:
+            raise TimeoutError(f"O modelo não respondeu em {TIMEOUT_SEGUNDOS:.0f}s.")
+        for tentativa in feitas:
+            if tentativa.exception() is None:
+                if tentativa is not tentativas[0]:
+                    telemetria.incrementar("mmt_llm_hedges_total", ferramenta=ferramenta, resultado="venceu")
+                return tentativa.result()
+            erro = tentativa.exception()
+    raise erro
+
+
+def _liberado(circuito, especulativa):
+    """
+    Chamadas especulativas (pré-geração) só usam um modelo com o disjuntor fechado e não
+    mexem nele: nem ocupam a vaga de teste do meio_aberto, nem contam sucesso ou falha.
+    """
+    if especulativa:
+        return circuito.estado == Disjuntor.FECHADO
+    return circuito.permite()
+
+
+def invocar(llm, prompt, ferramenta, modelo, chave, prioridade="interativa"):
+    """
+    Substitui o llm.invoke(prompt): hedging no p95 da ferramenta, disjuntor por modelo,
+    modelo de reserva e, por último, o último resultado bom do mesmo prompt.
+    'chave' identifica o prompt e as configurações do modelo (a mesma da coalescência).
+    Chamadas "especulativas" não ganham cópias nem entram nas latências da ferramenta.
+    """
+    if not RESILIENCIA_ATIVA:
+        return llm.invoke(prompt)
+
+    erro, especulativa = None, prioridade == "especulativa"
+    for alvo, nome, destino in _candidatos(llm, modelo):
+        circuito = disjuntor(nome)
+        if not _liberado(circuito, especulativa):
+            erro = erro or LLMIndisponivel(f"Disjuntor do modelo '{nome}' aberto.")
+            continue
+        try:
+            resposta = _invocar_com_hedge(alvo, prompt, ferramenta, nome, hedge=not especulativa)
+        except Exception as e:
+            if not especulativa:
+                circuito.falha()
+            print(f"Alerta: A chamada ao modelo '{nome}' falhou. Erro: {e}")
+            erro = e
+            continue
+        except BaseException:
+            if not especulativa:
+                circuito.liberar()
+            raise
+        if not especulativa:
+            circuito.sucesso()
+        if destino != "principal":
+            telemetria.incrementar("mmt_llm_alternativas_total", modelo=modelo, destino=destino)
+        _guardar_ultimo_bom(chave, resposta.content)
+        return resposta
+    return _ultimo_bom_ou_erro(chave, modelo, erro)
+
+
+# ==============================================================================
+# CHAMADAS ASSÍNCRONAS (API HEADLESS)
+# ==============================================================================
+
+async def _tentativa_async(llm, prompt, ferramenta, medir):
+    inicio = time.perf_counter()
+    resposta = await llm.ainvoke(prompt)
+    if medir:
+        latencias.observar(ferramenta, time.perf_counter() - inicio)
+    return resposta
+
+
+async def _ainvocar_com_hedge(llm, prompt, ferramenta, hedge=True):
+    limiar = latencias.limiar_hedge(ferramenta) if hedge else None
+    tentativas = [asyncio.ensure_future(_tentativa_async(llm, prompt, ferramenta, hedge))]
+    prazo = time.monotonic() + TIMEOUT_SEGUNDOS
+    try:
+        if limiar is not None:
+            feitas, _ = await asyncio.wait(tentativas, timeout=limiar)
+            if not feitas and _orcamento_hedge.permite():
+                tentativas.append(asyncio.ensure_future(_tentativa_async(llm, prompt, ferramenta, True)))
+                telemetria.incrementar("mmt_llm_hedges_total", ferramenta=ferramenta, resultado="disparado")
+        _orcamento_hedge.registrar(len(tentativas) > 1)
+
+        pendentes, erro = set(tentativas), None
+        while pendentes:
+            feitas, pendentes = await asyncio.wait(
+                pendentes, timeout=max(0.0, prazo - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+            )
+            if not feitas:
+                raise TimeoutError(f"O modelo não respondeu em {TIMEOUT_SEGUNDOS:.0f}s.")
+            for tentativa in feitas:
+                if tentativa.exception() is None:
+                    if tentativa is not tentativas[0]:
+                        telemetria.incrementar("mmt_llm_hedges_total", ferramenta=ferramenta, resultado="venceu")
+                    return tentativa.result()
+                erro = tentativa.exception()
+        raise erro
+    finally:
+        # No asyncio a cópia perdedora pode ser cancelada de verdade
+        for tentativa in tentativas:
+            if not tentativa.done():
+                tentativa.cancel()
+
+
+async def ainvocar(llm, prompt, ferramenta, modelo, chave, prioridade="interativa"):
+    """Versão assíncrona do invocar()."""
+    if not RESILIENCIA_ATIVA:
+        return await llm.ainvoke(prompt)
+
+    erro, especulativa = None, prioridade == "especulativa"
+    for alvo, nome, destino in _candidatos(llm, modelo):
+        circuito = disjuntor(nome)
+        if not _liberado(circuito, especulativa):
+            erro = erro or LLMIndisponivel(f"Disjuntor do modelo '{nome}' aberto.")
+            continue
+        try:
+            resposta = await _ainvocar_com_hedge(alvo, prompt, ferramenta, hedge=not especulativa)
+        except Exception as e:
+            if not especulativa:
+                circuito.falha()
+            print(f"Alerta: A chamada ao modelo '{nome}' falhou. Erro: {e}")
+            erro = e
+            continue
+        except BaseException:
+            # Cancelamento (ex: cliente desconectado): sem veredito sobre o modelo
+            if not especulativa:
+                circuito.liberar()
+            raise
+        if not especulativa:
+            circuito.sucesso()
+        if destino != "principal":
+            telemetria.incrementar("mmt_llm_alternativas_total", modelo=modelo, destino=destino)
+        _guardar_ultimo_bom(chave, resposta.content)
+        return resposta
+    return _ultimo_bom_ou_erro(chave, modelo, erro)
+
+
+def cliente_para_stream(llm, modelo):
+    """
+    Um stream já começado não pode ser duplicado, então aqui só vale o disjuntor: devolve
+    (cliente, nome) do modelo que vai transmitir. Quem chama deve informar o resultado
+    com disjuntor(nome).sucesso() ou .falha(), ou devolver a vaga com .liberar() se o
+    stream for interrompido antes do fim.
+    """
+    if not RESILIENCIA_ATIVA:
+        return llm, modelo
+    for alvo, nome, destino in _candidatos(llm, modelo):
+        if disjuntor(nome).permite():
+            if destino != "principal":
+                telemetria.incrementar("mmt_llm_alternativas_total", modelo=modelo, destino=destino)
+            return alvo, nome
+    telemetria.incrementar("mmt_llm_alternativas_total", modelo=modelo, destino="sem_alternativa")
+    raise LLMIndisponivel("O Max está com instabilidade para gerar conteúdo agora. Tente novamente em instantes.")
+
+
+# ==============================================================================
+# SIMULAÇÃO COM O LLM FALSO
+# ==============================================================================
+
+def _resumo(rotulo, duracoes, erros):
+    duracoes = sorted(duracoes) or [0.0]
+    def p(q):
+        return duracoes[min(len(duracoes) - 1, int(len(duracoes) * q))] * 1000
+    print(f"{rotulo:<22} p50: {p(0.5):7.1f} ms | p95: {p(0.95):7.1f} ms | p99: {p(0.99):7.1f} ms | "
+          f"máx: {duracoes[-1] * 1000:7.1f} ms | erros: {erros}")
+
+
+def _rodar(chamar, total, concorrencia):
+    duracoes, erros = [], 0
+    lock = threading.Lock()
+
+    def _uma(i):
+        nonlocal erros
+        inicio = time.perf_counter()
+        try:
+            chamar(i)
+        except Exception:
+            with lock:
+                erros += 1
+            return
+        with lock:
+            duracoes.append(time.perf_counter() - inicio)
+
+    with ThreadPoolExecutor(max_workers=concorrencia) as pool:
+        list(pool.map(_uma, range(total)))
+    return duracoes, erros
+
+
+def _simular(args):
+    from servico_llm import LLMFalso
+
+    print("1) Respostas lentas injetadas: chamada direta x hedging no p95")
+    lento = LLMFalso(latencia=args.latencia, prob_lenta=args.prob_lenta,
+                     latencia_lenta=args.latencia_lenta, semente=42)
+    _resumo("sem hedging", *_rodar(lambda i: lento.invoke(f"prompt {i}"), args.chamadas, args.concorrencia))
+    # Aquecimento: o limiar do hedging só existe depois de MIN_AMOSTRAS_HEDGE chamadas
+    _rodar(lambda i: invocar(lento, f"aquecer {i}", "simulacao", lento.model, f"aquecer {i}"),
+           MIN_AMOSTRAS_HEDGE * 2, args.concorrencia)
+    _resumo("com hedging", *_rodar(
+        lambda i: invocar(lento, f"prompt {i}", "simulacao", lento.model, f"prompt {i}"),
+        args.chamadas, args.concorrencia,
+    ))
+    print(f"Limiar atual (p95): {latencias.percentil('simulacao', PERCENTIL_HEDGE) * 1000:.1f} ms")
+
+    print("\n2) Modelo principal fora do ar: disjuntor e modelo de reserva")
+    quebrado = LLMFalso(latencia=args.latencia, prob_falha=1.0, model="llm-falso-quebrado")
+    registrar_reserva(quebrado.model, LLMFalso(latencia=args.latencia, model="llm-falso-reserva"))
+    _resumo("com reserva", *_rodar(
+        lambda i: invocar(quebrado, f"prompt {i}", "simulacao_falhas", quebrado.model, f"falha {i}"),
+        args.chamadas // 4, args.concorrencia,
+    ))
+    print(f"Disjuntor do modelo principal: {disjuntor(quebrado.model).estado}")
+
+    print("\nContadores:")
+    for contador in telemetria.exportar_json()["contadores"]:
+        if contador["nome"].startswith(("mmt_llm_hedges", "mmt_llm_alternativas", "mmt_llm_disjuntor")):
+            print(f"  {contador['nome']} {contador['rotulos']} = {contador['valor']:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hedging e disjuntor das chamadas ao LLM")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    simular = sub.add_parser("simular", help="Compara a latência de cauda com e sem hedging usando o LLM falso")
+    simular.add_argument("--chamadas", type=int, default=1000)
+    simular.add_argument("--concorrencia", type=int, default=16)
+    simular.add_argument("--latencia", type=float, default=0.05)
+    simular.add_argument("--prob-lenta", type=float, default=0.02)
+    simular.add_argument("--latencia-lenta", type=float, default=1.0)
+    args = parser.parse_args()
+
+    if args.comando == "simular":
+        _simular(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
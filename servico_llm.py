@@ -0,0 +1,367 @@
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import resiliencia
+import telemetria
+
+# Latência simulada do LLM falso (usado nos testes e nos benchmarks da API headless)
+LATENCIA_LLM_FALSO = float(os.environ.get("MMT_LLM_FALSO_LATENCIA", "0.05"))
+# Falhas injetadas no LLM falso, para testar o hedging e o disjuntor (resiliencia.py)
+PROB_LENTA_LLM_FALSO = float(os.environ.get("MMT_LLM_FALSO_PROB_LENTA", "0"))
+LATENCIA_LENTA_LLM_FALSO = float(os.environ.get("MMT_LLM_FALSO_LATENCIA_LENTA", "5"))
+PROB_FALHA_LLM_FALSO = float(os.environ.get("MMT_LLM_FALSO_PROB_FALHA", "0"))
+
+
+class ErroLLMFalso(RuntimeError):
+    """Falha injetada pelo LLM falso (imita um erro 500/503 do Gemini)."""
+
+
+class RespostaFalsa:
+    """Imita o AIMessage do LangChain: texto em 'content' e tokens em 'usage_metadata'."""
+
+    def __init__(self, content, usage_metadata=None):
+        self.content = content
+        self.usage_metadata = usage_metadata or {}
+
+
+class LLMFalso:
+    """
+    Substituto do ChatGoogleGenerativeAI que não chama a rede. Responde com um texto
+    determinístico depois de uma latência fixa, contando ~4 caracteres por token.
+    Ativado com MMT_LLM_BACKEND=falso.
+    Pode injetar respostas lentas ('prob_lenta', esperando 'latencia_lenta') e falhas
+    ('prob_falha'), sorteadas a cada chamada; 'semente' deixa o sorteio reproduzível.
+    """
+
+    model = "llm-falso"
+    PEDACOS_STREAM = 8
+
+    def __init__(self, latencia=LATENCIA_LLM_FALSO, prob_lenta=PROB_LENTA_LLM_FALSO,
+                 latencia_lenta=LATENCIA_LENTA_LLM_FALSO, prob_falha=PROB_FALHA_LLM_FALSO,
+                 model=None, semente=None):
+        self.latencia = latencia
+        self.prob_lenta = prob_lenta
+        self.latencia_lenta = latencia_lenta
+        self.prob_falha = prob_falha
+        if model:
+            self.model = model
+        self._sorteio = random.Random(semente)
+        self._sorteio_lock = threading.Lock()
+
+    def _sortear_latencia(self):
+        """Latência desta chamada; levanta ErroLLMFalso se a chamada foi sorteada para falhar."""
+        with self._sorteio_lock:
+            falha = self._sorteio.random() < self.prob_falha
+            lenta = self._sorteio.random() < self.prob_lenta
+        if falha:
+            raise ErroLLMFalso(f"Falha simulada do {self.model}")
+        return self.latencia_lenta if lenta else self.latencia
+
+    def _responder(self, prompt):
+        texto = f"**Resposta simulada do Max**\n\n{str(prompt)[-200:]}"
+        uso = {"input_tokens": len(str(prompt)) // 4, "output_tokens": len(texto) // 4}
+        return RespostaFalsa(texto, uso)
+
+    def _pedacos(self, resposta):
+        tamanho = max(1, len(resposta.content) // self.PEDACOS_STREAM + 1)
+        pedacos = [resposta.content[i:i + tamanho] for i in range(0, len(resposta.content), tamanho)]
+        for i, pedaco in enumerate(pedacos):
+            # Como no Gemini, a contagem de tokens chega junto com o último pedaço
+            yield RespostaFalsa(pedaco, resposta.usage_metadata if i == len(pedacos) - 1 else None)
+
+    def invoke(self, prompt):
+        time.sleep(self._sortear_latencia())
+        return self._responder(prompt)
+
+    async def ainvoke(self, prompt):
+        await asyncio.sleep(self._sortear_latencia())
+        return self._responder(prompt)
+
+    def stream(self, prompt):
+        latencia = self._sortear_latencia()
+        for pedaco in self._pedacos(self._responder(prompt)):
+            time.sleep(latencia / self.PEDACOS_STREAM)
+            yield pedaco
+
+    async def astream(self, prompt):
+        latencia = self._sortear_latencia()
+        for pedaco in self._pedacos(self._responder(prompt)):
+            await asyncio.sleep(latencia / self.PEDACOS_STREAM)
+            yield pedaco
+
+
+def _extrair_tokens(resposta):
+    """
+    Lê a contagem de tokens da resposta do LangChain (o formato varia entre versões):
+    (entrada, saída, entrada lida do cache de contexto). Os tokens de entrada incluem os do cache.
+    """
+    uso = getattr(resposta, "usage_metadata", None) or {}
+    bruto = (getattr(resposta, "response_metadata", None) or {}).get("usage_metadata", {}) or {}
+    em_cache = ((uso.get("input_token_details") or {}).get("cache_read")
+                or bruto.get("cached_content_token_count") or 0)
+    if uso:
+        return uso.get("input_tokens", 0), uso.get("output_tokens", 0), em_cache
+    return bruto.get("prompt_token_count", 0), bruto.get("candidates_token_count", 0), em_cache
+
+
+def nome_do_modelo(llm):
+    """Nome do modelo configurado no cliente, usado como rótulo nas métricas."""
+    return getattr(llm, "model", None) or getattr(llm, "model_name", None) or type(llm).__name__
+
+
+# Chamadas com um usuário esperando a resposta, em andamento neste processo.
+# O trabalho especulativo (pré-geração) só usa o LLM quando esse número está em zero.
+_interativas_em_andamento = 0
+_interativas_lock = threading.Lock()
+
+
+@contextmanager
+def _contar_chamada(prioridade):
+    global _interativas_em_andamento
+    if prioridade != "interativa":
+        yield
+        return
+    with _interativas_lock:
+        _interativas_em_andamento += 1
+    try:
+        yield
+    finally:
+        with _interativas_lock:
+            _interativas_em_andamento -= 1
+
+
+def chamadas_interativas_em_andamento():
+    """Quantas chamadas interativas ao LLM estão em andamento agora."""
+    return _interativas_em_andamento
+
+
+# ==============================================================================
+# COALESCÊNCIA DE CHAMADAS IDÊNTICAS (SINGLE-FLIGHT)
+# ==============================================================================
+# Clique duplo no botão, a mesma ferramenta aberta em duas abas, vários usuários da
+# mesma empresa pedindo a mesma campanha: chamadas com o mesmo prompt e as mesmas
+# configurações de modelo que chegam enquanto uma delas ainda está em andamento
+# se juntam a ela e recebem o mesmo resultado (ou o mesmo stream), sem nova chamada.
+# Nada fica guardado depois que a chamada termina: isto não é um cache de respostas.
+# Uma chamada interativa só pega carona em outra interativa: a especulativa (pré-geração)
+# não ganha cópias nem tenta um modelo com o disjuntor fora de "fechado", e o usuário
+# esperando receberia um LLMIndisponivel sem a reserva ter sido tentada.
+
+COALESCER_CHAMADAS = os.environ.get("MMT_COALESCER_LLM", "1") != "0"
+
+
+def _chave_da_chamada(llm, prompt):
+    """Identifica chamadas equivalentes: mesmo cliente, mesmas configurações e mesmo prompt."""
+    partes = (
+        type(llm).__name__, nome_do_modelo(llm),
+        getattr(llm, "temperature", None), getattr(llm, "max_output_tokens", None),
+        getattr(llm, "cached_content", None), # prefixo em cache (o DNA da marca)
+        str(prompt),
+    )
+    return hashlib.sha256(repr(partes).encode("utf-8")).hexdigest()
+
+
+def _registrar_coalescida(ferramenta, modelo, tokens):
+    """Conta a chamada que pegou carona e os tokens que ela deixou de gastar."""
+    telemetria.incrementar("mmt_llm_coalescidas_total", ferramenta=ferramenta, modelo=modelo)
+    telemetria.incrementar("mmt_llm_tokens_economizados_total", tokens, ferramenta=ferramenta, modelo=modelo)
+
+
+class _Voo:
+    """Uma chamada síncrona em andamento, com quem está esperando por ela."""
+
+    def __init__(self):
+        self.pronto = threading.Event()
+        self.resultado = None
+        self.erro = None
+
+
+_voos = {}             # (prioridade, chave) -> _Voo
+_voos_lock = threading.Lock()
+_voos_async = {}       # (loop, chave) -> asyncio.Task com (texto, tokens)
+_transmissoes = {}     # (loop, chave) -> _TransmissaoCompartilhada
+
+
+def _invocar(llm, prompt, ferramenta, prioridade, chave):
+    modelo = nome_do_modelo(llm)
+    with _contar_chamada(prioridade), \
+            telemetria.span("llm.invocacao", ferramenta=ferramenta, modelo=modelo, prioridade=prioridade) as extras:
+        # Hedging, disjuntor e alternativas ficam no resiliencia.py
+        resposta = resiliencia.invocar(llm, prompt, ferramenta, modelo, chave, prioridade)
+        tokens_entrada, tokens_saida, tokens_cache = _extrair_tokens(resposta)
+        extras.update({"tokens_entrada": tokens_entrada, "tokens_saida": tokens_saida, "tokens_cache": tokens_cache})
+    telemetria.registrar_tokens(ferramenta, modelo, tokens_entrada, tokens_saida, tokens_cache)
+    return resposta.content, tokens_entrada + tokens_saida
+
+
+def invocar_llm(llm, prompt, ferramenta, prioridade="interativa"):
+    """
+    Ponto único de chamada ao LLM. Mede a duração e registra os tokens de entrada
+    e de saída de cada invocação, e devolve apenas o texto gerado.
+    'prioridade' é "interativa" (usuário esperando) ou "especulativa" (pré-geração).
+    Uma chamada idêntica a outra que ainda está em andamento espera e reaproveita o resultado dela.
+    """
+    chave = _chave_da_chamada(llm, prompt)
+    if not COALESCER_CHAMADAS:
+        return _invocar(llm, prompt, ferramenta, prioridade, chave)[0]
+
+    # Voos por (prioridade, chave); a especulativa prefere pegar carona numa interativa
+    caronas = [("interativa", chave)] + ([(prioridade, chave)] if prioridade != "interativa" else [])
+    with _voos_lock:
+        voo = next((_voos[carona] for carona in caronas if carona in _voos), None)
+        lider = voo is None
+        if lider:
+            voo = _voos[(prioridade, chave)] = _Voo()
+
+    if not lider:
+        with telemetria.span("llm.coalescida", ferramenta=ferramenta):
+            voo.pronto.wait()
+        if voo.erro is not None:
+            raise voo.erro
+        _registrar_coalescida(ferramenta, nome_do_modelo(llm), voo.resultado[1])
+        return voo.resultado[0]
+
+    try:
+        voo.resultado = _invocar(llm, prompt, ferramenta, prioridade, chave)
+    except BaseException as e:
+        voo.erro = e
+        raise
+    finally:
+        with _voos_lock:
+            _voos.pop((prioridade, chave), None)
+        voo.pronto.set()
+    return voo.resultado[0]
+
+
+async def _invocar_async(llm, prompt, ferramenta, chave):
+    modelo = nome_do_modelo(llm)
+    with _contar_chamada("interativa"), \
+            telemetria.span("llm.invocacao", ferramenta=ferramenta, modelo=modelo, prioridade="interativa") as extras:
+        resposta = await resiliencia.ainvocar(llm, prompt, ferramenta, modelo, chave)
+        tokens_entrada, tokens_saida, tokens_cache = _extrair_tokens(resposta)
+        extras.update({"tokens_entrada": tokens_entrada, "tokens_saida": tokens_saida, "tokens_cache": tokens_cache})
+    telemetria.registrar_tokens(ferramenta, modelo, tokens_entrada, tokens_saida, tokens_cache)
+    return resposta.content, tokens_entrada + tokens_saida
+
+
+async def invocar_llm_async(llm, prompt, ferramenta):
+    """Versão assíncrona do invocar_llm, usada pela API headless (também coalesce chamadas idênticas)."""
+    chave_prompt = _chave_da_chamada(llm, prompt)
+    if not COALESCER_CHAMADAS:
+        return (await _invocar_async(llm, prompt, ferramenta, chave_prompt))[0]
+
+    chave = (id(asyncio.get_running_loop()), chave_prompt)
+    tarefa = _voos_async.get(chave)
+    if tarefa is not None:
+        with telemetria.span("llm.coalescida", ferramenta=ferramenta):
+            texto, tokens = await asyncio.shield(tarefa)
+        _registrar_coalescida(ferramenta, nome_do_modelo(llm), tokens)
+        return texto
+
+    # A chamada roda numa tarefa própria: se o cliente que a iniciou desconectar,
+    # quem pegou carona continua recebendo a resposta
+    tarefa = asyncio.ensure_future(_invocar_async(llm, prompt, ferramenta, chave_prompt))
+    _voos_async[chave] = tarefa
+    tarefa.add_done_callback(lambda _: _voos_async.pop(chave, None))
+    return (await asyncio.shield(tarefa))[0]
+
+
+class _TransmissaoCompartilhada:
+    """Guarda os pedaços de um stream em andamento para que vários clientes o leiam do início."""
+
+    def __init__(self):
+        self.pedacos = []
+        self.tokens = 0
+        self.fim = False
+        self.erro = None
+        self._novo_pedaco = asyncio.Event()
+
+    def _avisar(self):
+        self._novo_pedaco.set()
+        self._novo_pedaco = asyncio.Event()
+
+    async def bombear(self, llm, prompt, ferramenta):
+        uso = {}
+        try:
+            async for pedaco in _transmitir(llm, prompt, ferramenta, uso):
+                self.pedacos.append(pedaco)
+                self._avisar()
+        except Exception as e:
+            self.erro = e
+        finally:
+            self.tokens = uso.get("tokens", 0)
+            self.fim = True
+            self._avisar()
+
+    async def ler(self):
+        lidos = 0
+        while True:
+            while lidos < len(self.pedacos):
+                yield self.pedacos[lidos]
+                lidos += 1
+            if self.fim:
+                if self.erro is not None:
+                    raise self.erro
+                return
+            await self._novo_pedaco.wait()
+
+
+async def _transmitir(llm, prompt, ferramenta, uso):
+    modelo = nome_do_modelo(llm)
+    tokens_entrada, tokens_saida, tokens_cache = 0, 0, 0
+    # Stream não tem hedging; se o disjuntor do modelo estiver aberto, a reserva transmite
+    llm_alvo, nome_alvo = resiliencia.cliente_para_stream(llm, modelo)
+    with _contar_chamada("interativa"), \
+            telemetria.span("llm.stream", ferramenta=ferramenta, modelo=modelo, prioridade="interativa") as extras:
+        try:
+            async for pedaco in llm_alvo.astream(prompt):
+                entrada, saida, cache = _extrair_tokens(pedaco)
+                tokens_entrada, tokens_saida = max(tokens_entrada, entrada), tokens_saida + saida
+                tokens_cache = max(tokens_cache, cache)
+                if pedaco.content:
+                    yield pedaco.content
+        except Exception:
+            resiliencia.disjuntor(nome_alvo).falha()
+            raise
+        except BaseException:
+            # GeneratorExit (cliente desconectou) ou cancelamento: o stream não chegou ao fim,
+            # mas a vaga de teste do disjuntor meio_aberto não pode ficar presa
+            resiliencia.disjuntor(nome_alvo).liberar()
+            raise
+        resiliencia.disjuntor(nome_alvo).sucesso()
+        extras.update({"tokens_entrada": tokens_entrada, "tokens_saida": tokens_saida, "tokens_cache": tokens_cache})
+    telemetria.registrar_tokens(ferramenta, modelo, tokens_entrada, tokens_saida, tokens_cache)
+    uso["tokens"] = tokens_entrada + tokens_saida
+
+
+async def transmitir_llm_async(llm, prompt, ferramenta):
+    """
+    Gera o texto em pedaços (streaming), medindo a chamada inteira e somando os tokens no final.
+    Um stream idêntico que já esteja em andamento é compartilhado: quem chega depois recebe
+    os pedaços já gerados e segue junto até o fim.
+    """
+    if not COALESCER_CHAMADAS:
+        async for pedaco in _transmitir(llm, prompt, ferramenta, {}):
+            yield pedaco
+        return
+
+    chave = (id(asyncio.get_running_loop()), _chave_da_chamada(llm, prompt))
+    transmissao = _transmissoes.get(chave)
+    if transmissao is None:
+        transmissao = _TransmissaoCompartilhada()
+        _transmissoes[chave] = transmissao
+        tarefa = asyncio.ensure_future(transmissao.bombear(llm, prompt, ferramenta))
+        tarefa.add_done_callback(lambda _: _transmissoes.pop(chave, None))
+        async for pedaco in transmissao.ler():
+            yield pedaco
+        return
+
+    with telemetria.span("llm.coalescida", ferramenta=ferramenta):
+        async for pedaco in transmissao.ler():
+            yield pedaco
+    _registrar_coalescida(ferramenta, nome_do_modelo(llm), transmissao.tokens)
@@ -0,0 +1,60 @@
+"""
+Ponto de entrada ASGI do app (st.App do Streamlit), usado no contêiner no lugar do
+'streamlit run'. Além do próprio app, serve:
+  - as imagens geradas pelo pipeline_assets.py em uma rota nossa com cache de longa
+    duração: o '/app/static' do Streamlit não manda Cache-Control, e o navegador voltaria
+    a validar o logo e o fundo em toda visita;
+  - as métricas do telemetria.py (/metrics e /metrics.json) na mesma porta do app, ao lado
+    do /_stcore/health, já que o Cloud Run só roteia uma porta por contêiner.
+
+Uso:
+    uvicorn servidor:app --host 0.0.0.0 --port 8501
+"""
+import os
+
+# --- INÍCIO DA CONFIGURAÇÃO DO SERVIDOR ---
+ROTA_ESTATICOS = "/estaticos"
+# Os nomes dos arquivos carregam o hash do conteúdo: uma imagem nova sempre tem uma URL nova
+CACHE_CONTROL_ESTATICOS = "public, max-age=31536000, immutable"
+# --- FIM DA CONFIGURAÇÃO DO SERVIDOR ---
+
+# Precisam ser definidos antes de importar o utils, que monta as URLs com este prefixo,
+# e o telemetria, cujo servidor de métricas próprio fica desligado (as rotas estão aqui)
+os.environ.setdefault("MMT_STATIC_URL_PREFIX", ROTA_ESTATICOS.lstrip("/"))
+os.environ.setdefault("MMT_PORTA_METRICAS", "0")
+
+import streamlit as st
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+
+import telemetria
+from utils import PROJECT_ROOT, STATIC_DIR
+
+
+class ArquivosImutaveis(StaticFiles):
+    """StaticFiles do Starlette que marca as respostas como imutáveis."""
+
+    async def get_response(self, path, scope):
+        resposta = await super().get_response(path, scope)
+        if resposta.status_code in (200, 304):
+            resposta.headers["Cache-Control"] = CACHE_CONTROL_ESTATICOS
+        return resposta
+
+
+async def metricas(request):
+    return Response(telemetria.exportar_prometheus(), media_type=telemetria.TIPO_PROMETHEUS)
+
+
+async def metricas_json(request):
+    return Response(telemetria.exportar_json_texto(), media_type="application/json")
+
+
+app = st.App(
+    os.path.join(PROJECT_ROOT, "app.py"),
+    routes=[
+        Mount(ROTA_ESTATICOS, app=ArquivosImutaveis(directory=STATIC_DIR, check_dir=False), name="estaticos"),
+        Route("/metrics", metricas, methods=["GET"]),
+        Route("/metrics.json", metricas_json, methods=["GET"]),
+    ],
+)
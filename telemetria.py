@@ -0,0 +1,300 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- INÍCIO DA CONFIGURAÇÃO DE TELEMETRIA ---
+# Porta do servidor de métricas próprio, usado com o 'streamlit run' no desenvolvimento local.
+# No contêiner o servidor.py serve /metrics na mesma porta do app (o Cloud Run só roteia uma)
+# e define 0, que desliga este servidor.
+PORTA_METRICAS = int(os.environ.get("MMT_PORTA_METRICAS", "9464"))
+TIPO_PROMETHEUS = "text/plain; version=0.0.4; charset=utf-8"
+# Liga/desliga os logs JSON de cada span (as métricas agregadas continuam sempre ativas).
+LOGS_JSON_ATIVOS = os.environ.get("MMT_TELEMETRIA_LOGS", "1") == "1"
+
+# Faixas dos histogramas, em segundos: de leituras rápidas do Firestore até chamadas longas ao Gemini.
+FAIXAS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Faixas para contagens pequenas (ex: chamadas externas feitas em uma interação).
+FAIXAS_CONTAGEM = (0, 1, 2, 3, 5, 10, 20)
+
+# Spans que são chamadas a serviços externos pagos ou lentos (Firebase, Gemini e o backend
+# de estado), contadas por interação do usuário em 'mmt_chamadas_externas_por_interacao'.
+PREFIXOS_CHAMADA_EXTERNA = ("firebase.", "firestore.", "llm.", "estado.")
+
+# Exceções que o Streamlit usa para controlar o fluxo (st.rerun, st.stop) não são erros.
+_CONTROLE_DE_FLUXO = ("RerunException", "StopException")
+# --- FIM DA CONFIGURAÇÃO DE TELEMETRIA ---
+
+logger = logging.getLogger("mmt.telemetria")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class Histograma:
+    """Histograma cumulativo no formato do Prometheus (contagem por faixa, soma e total)."""
+
+    def __init__(self, faixas=FAIXAS_SEGUNDOS):
+        self.faixas = faixas
+        self.contagens = [0] * len(faixas)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        for i, limite in enumerate(self.faixas):
+            if valor <= limite:
+                self.contagens[i] += 1
+                break
+        self.soma += valor
+        self.total += 1
+
+
+class _RegistroMetricas:
+    """Guarda todos os histogramas e contadores do processo, protegidos por um único lock."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histogramas = {}
+        self._contadores = {}
+        self._coletores = []
+
+    def observar(self, nome, rotulos, valor, faixas=FAIXAS_SEGUNDOS):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            histograma = self._histogramas.get(chave)
+            if histograma is None:
+                histograma = self._histogramas[chave] = Histograma(faixas)
+            histograma.observar(valor)
+
+    def incrementar(self, nome, rotulos, valor=1):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+
+    def registrar_coletor(self, coletor):
+        with self._lock:
+            if coletor not in self._coletores:
+                self._coletores.append(coletor)
+
+    def fotografia(self):
+        """Copia o estado atual para que a exportação não segure o lock."""
+        with self._lock:
+            histogramas = {
+                chave: (h.faixas, list(h.contagens), h.soma, h.total)
+                for chave, h in self._histogramas.items()
+            }
+            contadores = dict(self._contadores)
+            coletores = list(self._coletores)
+        medidores = []
+        for coletor in coletores:
+            try:
+                medidores.extend(coletor())
+            except Exception as e:
+                print(f"Alerta: Coletor de métricas falhou. Erro: {e}")
+        return histogramas, contadores, medidores
+
+
+_registro = _RegistroMetricas()
+
+
+# ==============================================================================
+# API DE INSTRUMENTAÇÃO
+# ==============================================================================
+
+@contextmanager
+def span(nome, **rotulos):
+    """
+    Mede o tempo de um trecho de código e registra no histograma 'mmt_span_duracao_segundos'.
+    Os rótulos viram labels no Prometheus, então devem ter poucos valores possíveis.
+    O dicionário devolvido aceita dados extras (ex: tokens) que só vão para o log JSON.
+    """
+    extras = {}
+    status = "ok"
+    inicio = time.perf_counter()
+    try:
+        yield extras
+    except BaseException as e:
+        if type(e).__name__ not in _CONTROLE_DE_FLUXO:
+            status = "erro"
+        raise
+    finally:
+        duracao = time.perf_counter() - inicio
+        if nome.startswith(PREFIXOS_CHAMADA_EXTERNA) and getattr(_interacao, "chamadas", None) is not None:
+            _interacao.chamadas += 1
+        _registro.observar("mmt_span_duracao_segundos", {"span": nome, "status": status, **rotulos}, duracao)
+        if LOGS_JSON_ATIVOS:
+            logger.info(json.dumps({
+                "tipo": "span", "span": nome, "status": status,
+                "duracao_ms": round(duracao * 1000, 2), **rotulos, **extras,
+            }, ensure_ascii=False, default=str))
+
+
+_interacao = threading.local() # Cada sessão do Streamlit roda o script na sua própria thread
+
+
+@contextmanager
+def interacao(escopo, **rotulos):
+    """
+    Conta as chamadas externas (Firebase, Gemini) feitas durante um rerun, seja da página
+    inteira (escopo "app") ou só de um fragmento (escopo "fragmento"). Um fragmento que roda
+    dentro do rerun da página soma as chamadas dele às da página em vez de registrar à parte.
+    Devolve True quando esta é a interação mais externa.
+    """
+    externas = getattr(_interacao, "chamadas", None)
+    _interacao.chamadas = 0
+    try:
+        yield externas is None
+    finally:
+        chamadas = _interacao.chamadas
+        if externas is None:
+            _interacao.chamadas = None
+            _registro.observar(
+                "mmt_chamadas_externas_por_interacao", {"escopo": escopo, **rotulos}, chamadas, FAIXAS_CONTAGEM
+            )
+        else:
+            _interacao.chamadas = externas + chamadas
+
+
+def incrementar(nome, valor=1, **rotulos):
+    """Soma um valor a um contador (ex: tokens consumidos, chamadas agrupadas)."""
+    _registro.incrementar(nome, rotulos, valor)
+
+
+def observar(nome, valor, **rotulos):
+    """Registra um valor em um histograma qualquer, além dos spans."""
+    _registro.observar(nome, rotulos, valor)
+
+
+def registrar_tokens(ferramenta, modelo, tokens_entrada, tokens_saida, tokens_cache=0):
+    """
+    Contabiliza os tokens de prompt e de resposta de uma chamada ao LLM. 'tokens_cache' é a
+    parte da entrada servida pelo cache de contexto do provedor (cobrada com desconto).
+    """
+    incrementar("mmt_llm_tokens_total", tokens_entrada, ferramenta=ferramenta, modelo=modelo, tipo="entrada")
+    incrementar("mmt_llm_tokens_total", tokens_saida, ferramenta=ferramenta, modelo=modelo, tipo="saida")
+    if tokens_cache:
+        incrementar("mmt_llm_tokens_total", tokens_cache, ferramenta=ferramenta, modelo=modelo, tipo="cache")
+
+
+def registrar_coletor(coletor):
+    """
+    Registra uma função chamada a cada exportação, que devolve medidores instantâneos
+    como uma lista de tuplas (nome, rotulos, valor). Ex: memória das sessões.
+    """
+    _registro.registrar_coletor(coletor)
+
+
+# ==============================================================================
+# EXPORTAÇÃO (PROMETHEUS E JSON)
+# ==============================================================================
+
+def _formatar_rotulos(rotulos):
+    if not rotulos:
+        return ""
+    pares = []
+    for chave, valor in rotulos:
+        texto = str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pares.append(f'{chave}="{texto}"')
+    return "{" + ",".join(pares) + "}"
+
+
+def exportar_prometheus():
+    """Gera o texto no formato de exposição do Prometheus com todas as métricas do processo."""
+    histogramas, contadores, medidores = _registro.fotografia()
+    linhas = []
+
+    tipos_vistos = set()
+    for (nome, rotulos), (faixas, contagens, soma, total) in sorted(histogramas.items()):
+        if nome not in tipos_vistos:
+            linhas.append(f"# TYPE {nome} histogram")
+            tipos_vistos.add(nome)
+        acumulado = 0
+        for limite, contagem in zip(faixas, contagens):
+            acumulado += contagem
+            linhas.append(f"{nome}_bucket{_formatar_rotulos(rotulos + (('le', limite),))} {acumulado}")
+        linhas.append(f"{nome}_bucket{_formatar_rotulos(rotulos + (('le', '+Inf'),))} {total}")
+        linhas.append(f"{nome}_sum{_formatar_rotulos(rotulos)} {soma}")
+        linhas.append(f"{nome}_count{_formatar_rotulos(rotulos)} {total}")
+
+    for (nome, rotulos), valor in sorted(contadores.items()):
+        if nome not in tipos_vistos:
+            linhas.append(f"# TYPE {nome} counter")
+            tipos_vistos.add(nome)
+        linhas.append(f"{nome}{_formatar_rotulos(rotulos)} {valor}")
+
+    for nome, rotulos, valor in medidores:
+        if nome not in tipos_vistos:
+            linhas.append(f"# TYPE {nome} gauge")
+            tipos_vistos.add(nome)
+        linhas.append(f"{nome}{_formatar_rotulos(tuple(sorted(rotulos.items())))} {valor}")
+
+    return "\n".join(linhas) + "\n"
+
+
+def exportar_json_texto():
+    """O exportar_json() já serializado, como servido em /metrics.json."""
+    return json.dumps(exportar_json(), ensure_ascii=False, default=str)
+
+
+def exportar_json():
+    """Resumo das métricas em JSON, útil para depuração e para os logs estruturados."""
+    histogramas, contadores, medidores = _registro.fotografia()
+    return {
+        "histogramas": [
+            {"nome": nome, "rotulos": dict(rotulos), "total": total, "soma": soma,
+             "faixas": dict(zip(faixas, contagens))}
+            for (nome, rotulos), (faixas, contagens, soma, total) in histogramas.items()
+        ],
+        "contadores": [
+            {"nome": nome, "rotulos": dict(rotulos), "valor": valor}
+            for (nome, rotulos), valor in contadores.items()
+        ],
+        "medidores": [
+            {"nome": nome, "rotulos": rotulos, "valor": valor}
+            for nome, rotulos, valor in medidores
+        ],
+    }
+
+
+class _HandlerMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            corpo = exportar_prometheus().encode("utf-8")
+            tipo = TIPO_PROMETHEUS
+        elif self.path == "/metrics.json":
+            corpo = exportar_json_texto().encode("utf-8")
+            tipo = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        # Os scrapes do Prometheus não precisam poluir o log da aplicação
+        pass
+
+
+_servidor = None
+_servidor_lock = threading.Lock()
+
+def iniciar_servidor_metricas(porta=PORTA_METRICAS):
+    """
+    Sobe (uma única vez por processo) o servidor HTTP com /metrics e /metrics.json.
+    Com a porta 0 não sobe nada: as rotas já são servidas pelo servidor.py.
+    """
+    global _servidor
+    with _servidor_lock:
+        if _servidor is None and porta:
+            _servidor = ThreadingHTTPServer(("0.0.0.0", porta), _HandlerMetricas)
+            threading.Thread(target=_servidor.serve_forever, name="mmt-metricas", daemon=True).start()
+        return _servidor
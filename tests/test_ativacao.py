@@ -0,0 +1,63 @@
+"""Resgate e importação de chaves de ativação com o Firestore e o Auth em memória."""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import ativacao
+from ativacao import AuthMemoria, ErroAtivacao, FirestoreMemoria
+
+
+@pytest.fixture
+def db():
+    return FirestoreMemoria()
+
+
+@pytest.fixture
+def auth_admin():
+    return AuthMemoria()
+
+
+def _nova_chave(db):
+    chave = next(ativacao.gerar_chaves(1, prefixo="MMT-TESTE"))
+    ativacao.importar_chaves(db, [chave], "PRO")
+    return chave
+
+
+def test_envio_duplicado_do_mesmo_email_devolve_o_mesmo_uid(db, auth_admin):
+    chave = _nova_chave(db)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        uids = list(executor.map(
+            lambda _: ativacao.resgatar_chave(db, auth_admin, "Cliente@Exemplo.com ", "senha123", chave), range(8)
+        ))
+    assert set(uids) == {ativacao.uid_da_chave(chave)}
+    dados = db.collection(ativacao.KEYS_COLLECTION).document(chave).get().to_dict()
+    assert dados["status"] == ativacao.STATUS_USADA
+    assert dados["email"] == "cliente@exemplo.com"
+
+
+def test_chave_usada_recusa_outro_email(db, auth_admin):
+    chave = _nova_chave(db)
+    ativacao.resgatar_chave(db, auth_admin, "cliente@exemplo.com", "senha123", chave)
+    with pytest.raises(ErroAtivacao):
+        ativacao.resgatar_chave(db, auth_admin, "outro@exemplo.com", "senha123", chave)
+
+
+def test_chave_revogada_nao_pode_ser_resgatada(db, auth_admin):
+    chave = _nova_chave(db)
+    db.collection(ativacao.KEYS_COLLECTION).document(chave).update({"status": "revogada"})
+    with pytest.raises(ErroAtivacao):
+        ativacao.resgatar_chave(db, auth_admin, "cliente@exemplo.com", "senha123", chave)
+
+
+def test_lote_com_chave_existente_e_regravado_chave_a_chave(db):
+    existente = _nova_chave(db)
+    novas = list(ativacao.gerar_chaves(5, prefixo="MMT-TESTE"))
+    confirmadas = []
+
+    gravadas, com_erro = ativacao.importar_chaves(db, novas[:2] + [existente] + novas[2:], "PRO", ao_gravar=confirmadas.extend)
+
+    assert gravadas == len(novas)
+    assert com_erro == [existente]
+    assert sorted(confirmadas) == sorted(novas)
+    colecao = db.collection(ativacao.KEYS_COLLECTION)
+    assert all(colecao.document(c).get().to_dict()["status"] == ativacao.STATUS_DISPONIVEL for c in novas)
@@ -0,0 +1,44 @@
+"""Divisão do conteúdo em seções e refinamento de uma seção só, com o LLM falso."""
+import ferramentas
+import refinamento
+from servico_llm import LLMFalso, RespostaFalsa
+
+POST = (
+    "1. **Título Impactante:** Café que acorda ideias\n"
+    "2. **Texto do Post:** Linha um\nLinha dois\n"
+    "3. **Sugestão de Imagem/Vídeo:** Xícara fumegante\n"
+    "4. **Chamada para Ação (CTA):** Peça já o seu\n"
+    "5. **Hashtags Estratégicas:** #cafe #manha"
+)
+
+
+class LLMFixo(LLMFalso):
+    """Responde sempre o mesmo texto."""
+
+    def __init__(self, texto):
+        super().__init__(latencia=0, prob_lenta=0, prob_falha=0, model="teste-refinamento")
+        self.texto = texto
+
+    def _responder(self, prompt):
+        return RespostaFalsa(self.texto, {"input_tokens": 1, "output_tokens": 1})
+
+
+def test_juntar_secoes_mantem_a_numeracao():
+    secoes = refinamento.dividir_em_secoes(POST)
+    assert [numero for _, _, numero in secoes] == ["1.", "2.", "3.", "4.", "5."]
+    rascunho = refinamento.juntar_secoes(secoes)
+    assert rascunho.startswith("1. **Título Impactante:** Café que acorda ideias")
+    assert "2. **Texto do Post:**\nLinha um\nLinha dois" in rascunho
+    assert refinamento.dividir_em_secoes(rascunho) == secoes
+
+
+def test_juntar_secoes_aceita_sessoes_sem_numeracao():
+    assert refinamento.juntar_secoes([["Título", "Olá"]]) == "**Título:** Olá"
+
+
+def test_refinar_uma_secao_mantem_o_formato_da_ferramenta():
+    sessao = refinamento.SessaoRefinamento("criar_post_social", POST)
+    llm = LLMFixo("4. **Chamada para Ação (CTA):** Garanta o seu hoje")
+    rascunho = sessao.refinar(llm, ferramentas.ler_prompts(), "Mude a CTA")
+    assert "4. **Chamada para Ação (CTA):** Garanta o seu hoje" in rascunho
+    assert [linha[:2] for linha in rascunho.splitlines() if "**" in linha] == ["1.", "2.", "3.", "4.", "5."]
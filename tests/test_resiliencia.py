@@ -0,0 +1,173 @@
+"""Hedging, máquina de estados do disjuntor e caminhos de interrupção, com o LLM falso."""
+import asyncio
+import time
+
+import pytest
+
+import resiliencia
+import servico_llm
+import telemetria
+from resiliencia import Disjuntor
+from servico_llm import LLMFalso
+
+LATENCIA_RAPIDA = 0.01
+LATENCIA_LENTA = 0.5
+
+
+def _novo_disjuntor(monkeypatch, nome, falhas_para_abrir=2, segundos_aberto=0.05):
+    circuito = Disjuntor(nome, falhas_para_abrir=falhas_para_abrir, segundos_aberto=segundos_aberto)
+    monkeypatch.setitem(resiliencia._disjuntores, nome, circuito)
+    return circuito
+
+
+def _contador(nome, **rotulos):
+    for contador in telemetria.exportar_json()["contadores"]:
+        if contador["nome"] == nome and contador["rotulos"] == rotulos:
+            return contador["valor"]
+    return 0
+
+
+@pytest.fixture
+def hedge_aquecido(monkeypatch, request):
+    """
+    Latências e orçamento de cópias zerados e uma ferramenta própria do teste, já aquecida
+    com respostas rápidas (a cópia perdedora de outro teste ainda pode terminar depois).
+    """
+    monkeypatch.setattr(resiliencia, "latencias", resiliencia.RastreadorDeLatencias())
+    monkeypatch.setattr(resiliencia, "_orcamento_hedge", resiliencia._OrcamentoHedge())
+    ferramenta = request.node.name
+    rapido = LLMFalso(latencia=LATENCIA_RAPIDA, prob_lenta=0, prob_falha=0, model="teste-hedge")
+    for i in range(resiliencia.MIN_AMOSTRAS_HEDGE):
+        resiliencia.invocar(rapido, f"aquecer {i}", ferramenta, rapido.model, f"aquecer {i}")
+    assert resiliencia.latencias.limiar_hedge(ferramenta) < LATENCIA_LENTA
+    return ferramenta
+
+
+def test_hedge_dispara_depois_do_p95_e_vale_a_primeira_resposta(hedge_aquecido):
+    lento = LLMFalso(latencia=LATENCIA_RAPIDA, prob_lenta=1, latencia_lenta=LATENCIA_LENTA,
+                     prob_falha=0, model="teste-hedge")
+    disparados = _contador("mmt_llm_hedges_total", ferramenta=hedge_aquecido, resultado="disparado")
+    vencidos = _contador("mmt_llm_hedges_total", ferramenta=hedge_aquecido, resultado="venceu")
+
+    inicio = time.perf_counter()
+    resposta = resiliencia.invocar(lento, "prompt lento", hedge_aquecido, lento.model, "lento")
+    duracao = time.perf_counter() - inicio
+
+    assert "prompt lento" in resposta.content
+    assert _contador("mmt_llm_hedges_total", ferramenta=hedge_aquecido, resultado="disparado") == disparados + 1
+    # As duas tentativas são lentas: a original chega primeiro e a resposta não espera pela cópia
+    assert _contador("mmt_llm_hedges_total", ferramenta=hedge_aquecido, resultado="venceu") == vencidos
+    assert duracao < LATENCIA_LENTA * 1.5
+
+
+def test_copia_rapida_vence_a_original_lenta(hedge_aquecido):
+    # Com a semente 9 a primeira chamada é sorteada lenta e a segunda (a cópia), rápida
+    llm = LLMFalso(latencia=LATENCIA_RAPIDA, prob_lenta=0.5, latencia_lenta=LATENCIA_LENTA,
+                   prob_falha=0, model="teste-hedge", semente=9)
+    vencidos = _contador("mmt_llm_hedges_total", ferramenta=hedge_aquecido, resultado="venceu")
+
+    inicio = time.perf_counter()
+    resposta = resiliencia.invocar(llm, "prompt com copia", hedge_aquecido, llm.model, "copia")
+    duracao = time.perf_counter() - inicio
+
+    assert "prompt com copia" in resposta.content
+    assert _contador("mmt_llm_hedges_total", ferramenta=hedge_aquecido, resultado="venceu") == vencidos + 1
+    assert duracao < LATENCIA_LENTA / 2
+
+
+def _meio_aberto(circuito):
+    """Leva o disjuntor até o ponto em que a próxima chamada vira a chamada de teste."""
+    for _ in range(circuito.falhas_para_abrir):
+        circuito.falha()
+    assert circuito.estado == Disjuntor.ABERTO
+    time.sleep(circuito.segundos_aberto * 1.5)
+
+
+def test_disjuntor_abre_testa_e_fecha(monkeypatch):
+    circuito = _novo_disjuntor(monkeypatch, "teste-ciclo")
+    assert circuito.permite()
+    circuito.falha()
+    assert circuito.estado == Disjuntor.FECHADO
+    circuito.falha()
+    assert circuito.estado == Disjuntor.ABERTO
+    assert not circuito.permite()
+
+    time.sleep(circuito.segundos_aberto * 1.5)
+    assert circuito.permite()          # a chamada de teste
+    assert circuito.estado == Disjuntor.MEIO_ABERTO
+    assert not circuito.permite()      # só uma por vez
+    circuito.falha()
+    assert circuito.estado == Disjuntor.ABERTO
+
+    time.sleep(circuito.segundos_aberto * 1.5)
+    assert circuito.permite()
+    circuito.sucesso()
+    assert circuito.estado == Disjuntor.FECHADO
+    assert circuito.permite()
+
+
+def test_liberar_devolve_a_vaga_de_teste(monkeypatch):
+    circuito = _novo_disjuntor(monkeypatch, "teste-liberar")
+    _meio_aberto(circuito)
+    assert circuito.permite()
+    circuito.liberar()
+    assert circuito.estado == Disjuntor.MEIO_ABERTO
+    assert circuito.permite()
+
+
+def test_stream_interrompido_nao_prende_o_meio_aberto(monkeypatch):
+    llm = LLMFalso(latencia=0.01, model="teste-stream")
+    circuito = _novo_disjuntor(monkeypatch, llm.model)
+    _meio_aberto(circuito)
+
+    async def _ler_um_pedaco_e_desconectar():
+        stream = servico_llm._transmitir(llm, "prompt", "teste", {})
+        await stream.__anext__()
+        await stream.aclose() # o mesmo que o Starlette faz quando o cliente desconecta
+
+    asyncio.run(_ler_um_pedaco_e_desconectar())
+    assert circuito.estado == Disjuntor.MEIO_ABERTO
+    assert circuito.permite()
+
+
+def test_ainvocar_cancelado_nao_prende_o_meio_aberto(monkeypatch):
+    llm = LLMFalso(latencia=1.0, model="teste-cancelado")
+    circuito = _novo_disjuntor(monkeypatch, llm.model)
+    _meio_aberto(circuito)
+
+    async def _cancelar_no_meio():
+        tarefa = asyncio.ensure_future(resiliencia.ainvocar(llm, "prompt", "teste", llm.model, "chave-cancelada"))
+        await asyncio.sleep(0.05)
+        tarefa.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await tarefa
+
+    asyncio.run(_cancelar_no_meio())
+    assert circuito.estado == Disjuntor.MEIO_ABERTO
+    assert circuito.permite()
+
+
+def test_especulativas_nao_abrem_o_disjuntor_nem_entram_nas_latencias(monkeypatch):
+    llm = LLMFalso(latencia=0.0, prob_falha=1.0, model="teste-especulativa")
+    circuito = _novo_disjuntor(monkeypatch, llm.model)
+    for i in range(circuito.falhas_para_abrir * 3):
+        with pytest.raises(resiliencia.LLMIndisponivel):
+            resiliencia.invocar(llm, f"p{i}", "teste_especulativa", llm.model, f"esp {i}", "especulativa")
+    assert circuito.estado == Disjuntor.FECHADO
+    assert "teste_especulativa" not in resiliencia.latencias.ferramentas()
+
+    with pytest.raises(resiliencia.LLMIndisponivel):
+        resiliencia.invocar(llm, "p", "teste_especulativa", llm.model, "int 0")
+    with pytest.raises(resiliencia.LLMIndisponivel):
+        resiliencia.invocar(llm, "p", "teste_especulativa", llm.model, "int 1")
+    assert circuito.estado == Disjuntor.ABERTO
+
+
+def test_especulativa_nao_usa_modelo_com_disjuntor_aberto(monkeypatch):
+    llm = LLMFalso(latencia=0.0, model="teste-aberto")
+    circuito = _novo_disjuntor(monkeypatch, llm.model, segundos_aberto=60)
+    for _ in range(circuito.falhas_para_abrir):
+        circuito.falha()
+    with pytest.raises(resiliencia.LLMIndisponivel):
+        resiliencia.invocar(llm, "p", "teste", llm.model, "aberto", "especulativa")
+    assert circuito.estado == Disjuntor.ABERTO
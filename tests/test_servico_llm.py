@@ -0,0 +1,92 @@
+"""Coalescência de chamadas idênticas (single-flight) síncrona, assíncrona e em stream, com o LLM falso."""
+import asyncio
+import threading
+import time
+
+import servico_llm
+from servico_llm import LLMFalso
+
+LATENCIA = 0.2
+
+
+class LLMContado(LLMFalso):
+    """LLM falso que conta quantas chamadas de verdade recebeu."""
+
+    def __init__(self, model):
+        super().__init__(latencia=LATENCIA, prob_lenta=0, prob_falha=0, model=model)
+        self.chamadas = 0
+        self._contador_lock = threading.Lock()
+
+    def _sortear_latencia(self):
+        with self._contador_lock:
+            self.chamadas += 1
+        return super()._sortear_latencia()
+
+
+def _em_paralelo(funcoes):
+    resultados = [None] * len(funcoes)
+
+    def _rodar(i, funcao):
+        resultados[i] = funcao()
+
+    threads = [threading.Thread(target=_rodar, args=(i, f)) for i, f in enumerate(funcoes)]
+    for i, thread in enumerate(threads):
+        thread.start()
+        if i == 0:
+            time.sleep(LATENCIA / 4) # o primeiro vira o líder
+    for thread in threads:
+        thread.join()
+    return resultados
+
+
+def test_chamadas_sincronas_identicas_viram_uma():
+    llm = LLMContado("teste-coalescer-sync")
+    resultados = _em_paralelo([lambda: servico_llm.invocar_llm(llm, "prompt sync", "teste")] * 5)
+    assert llm.chamadas == 1
+    assert len(set(resultados)) == 1
+
+
+def test_interativa_nao_pega_carona_em_especulativa():
+    llm = LLMContado("teste-coalescer-prioridade")
+    _em_paralelo([
+        lambda: servico_llm.invocar_llm(llm, "prompt prioridade", "teste", "especulativa"),
+        lambda: servico_llm.invocar_llm(llm, "prompt prioridade", "teste", "interativa"),
+    ])
+    assert llm.chamadas == 2
+
+
+def test_especulativa_pega_carona_em_interativa():
+    llm = LLMContado("teste-coalescer-especulativa")
+    _em_paralelo([
+        lambda: servico_llm.invocar_llm(llm, "prompt carona", "teste", "interativa"),
+        lambda: servico_llm.invocar_llm(llm, "prompt carona", "teste", "especulativa"),
+    ])
+    assert llm.chamadas == 1
+
+
+def test_chamadas_assincronas_identicas_viram_uma():
+    llm = LLMContado("teste-coalescer-async")
+
+    async def _rodar():
+        return await asyncio.gather(*(servico_llm.invocar_llm_async(llm, "prompt async", "teste") for _ in range(5)))
+
+    resultados = asyncio.run(_rodar())
+    assert llm.chamadas == 1
+    assert len(set(resultados)) == 1
+
+
+def test_streams_identicos_compartilham_os_pedacos():
+    llm = LLMContado("teste-coalescer-stream")
+
+    async def _ler(atraso):
+        await asyncio.sleep(atraso)
+        return [pedaco async for pedaco in servico_llm.transmitir_llm_async(llm, "prompt stream", "teste")]
+
+    async def _rodar():
+        # O segundo chega com o stream já em andamento e recebe também os pedaços anteriores
+        return await asyncio.gather(_ler(0), _ler(LATENCIA / 2))
+
+    primeiro, segundo = asyncio.run(_rodar())
+    assert llm.chamadas == 1
+    assert primeiro == segundo
+    assert len(primeiro) > 1
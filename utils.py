@@ -5,11 +5,18 @@ import os
 # --- INÍCIO DA CONFIGURAÇÃO DE CAMINHOS ---
 # Pega o diretório onde o projeto está sendo executado.
 # Isso garante que os caminhos funcionarão em qualquer computador ou servidor.
-PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# O utils.py fica na raiz do projeto, então basta subir um nível a partir do arquivo.
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 
 # Define os caminhos para as pastas de primeiro nível que realmente existem no projeto.
 ASSETS_DIR = os.path.join(PROJECT_ROOT, "assets")
 PROMPTS_DIR = os.path.join(PROJECT_ROOT, "prompts")
+
+# Saída do pipeline_assets.py. Em produção o servidor.py a serve em '/estaticos/' com cache
+# de longa duração; no 'streamlit run' local, o Streamlit a serve em '/app/static/' (sem cache).
+STATIC_DIR = os.path.join(PROJECT_ROOT, "static")
+STATIC_MANIFEST_PATH = os.path.join(STATIC_DIR, "assets", "manifest.json")
+STATIC_URL_PREFIX = os.environ.get("MMT_STATIC_URL_PREFIX", "app/static")
 # --- FIM DA CONFIGURAÇÃO DE CAMINHOS ---
 
 
@@ -32,6 +39,38 @@ def carregar_prompts_config():
 def get_asset_path(file_name):
     """
     Função ÚNICA e universal para construir o caminho para qualquer arquivo
-    dentro da pasta '/assets/'.
+    dentro da pasta '/assets/'. Procura também nas subpastas 'images' e 'fonts'.
     """
+    for subpasta in ("", "images", "fonts"):
+        caminho = os.path.join(ASSETS_DIR, subpasta, file_name)
+        if os.path.exists(caminho):
+            return caminho
     return os.path.join(ASSETS_DIR, file_name)
+
+@st.cache_resource
+def carregar_manifest_estatico():
+    """Carrega o manifest gerado pelo pipeline_assets.py (vazio se o pipeline não rodou)."""
+    if not os.path.exists(STATIC_MANIFEST_PATH):
+        return {}
+    try:
+        with open(STATIC_MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Alerta: Não foi possível ler o manifest de assets estáticos. Erro: {e}")
+        return {}
+
+def get_static_url(file_name, largura, formato="webp"):
+    """
+    Retorna a URL da menor variante pré-processada da imagem com pelo menos a largura
+    pedida, ou None se o pipeline de assets não tiver sido executado.
+    O nome do arquivo já carrega o hash do conteúdo, então uma imagem nova sempre gera
+    uma URL nova e a rota do servidor.py pode mandar o navegador guardá-la para sempre.
+    """
+    variantes = carregar_manifest_estatico().get(file_name)
+    if not variantes:
+        return None
+    larguras = sorted(int(l) for l in variantes)
+    escolhida = next((l for l in larguras if l >= largura), larguras[-1])
+    opcoes = variantes[str(escolhida)]
+    variante = opcoes.get(formato) or next(iter(opcoes.values()))
+    return f"{STATIC_URL_PREFIX}/{variante['arquivo']}"